@@ -0,0 +1,99 @@
+"""
+Autocomplete
+
+prefix index over the names of the references of a vocabulary
+"""
+
+import re
+from bisect import bisect_left, insort
+from itertools import count
+
+from cocat.utils import normalize
+
+
+class PrefixIndex:
+    """
+    Prefix index over the french and english names of references
+
+    Names are case and accent folded, split in words (apostrophes and punctuation are separators)
+    and every word of a name is a starting point:
+    `qual` and `air` both complete to `Qualité de l'air`.
+    Entries are kept in a sorted array: a search is a binary search
+    followed by a scan of the matching range, adding or removing a reference
+    only inserts or deletes its own entries.
+
+    Attributes
+    ----------
+    langs: tuple
+        langs of the names indexed
+
+    Methods
+    -------
+    add(reference, key)
+    remove(reference, key)
+    search(prefix, k, lang)
+    """
+
+    def __init__(self, references: list = None, langs: tuple = ("fr", "en")):
+        self.langs = langs
+        self._entries = []
+        self._by_reference = {}
+        self._seq = count()
+        for r in references or []:
+            self.add(r)
+
+    def __len__(self):
+        return len(self._by_reference)
+
+    def add(self, reference, key=None):
+        """index the names of reference: key identifies the reference (default to its identity)"""
+        if key is None:
+            key = id(reference)
+        if key in self._by_reference:
+            return
+        entries = []
+        for lang in self.langs:
+            name = getattr(reference, f"name_{lang}")
+            if name in ["", None]:
+                continue
+            words = re.findall(r"\w+", normalize(name))
+            seq = next(self._seq)
+            for position in range(len(words)):
+                # (key, position, length, seq) orders and identifies the entry: reference is never compared
+                entry = (" ".join(words[position:]), position, len(name), seq, lang, name, reference)
+                insort(self._entries, entry)
+                entries.append(entry)
+        self._by_reference[key] = entries
+
+    def remove(self, reference, key=None):
+        if key is None:
+            key = id(reference)
+        for entry in self._by_reference.pop(key, []):
+            i = bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i][:4] == entry[:4]:
+                del self._entries[i]
+
+    def search(self, prefix: str, k: int = 10, lang: str = None) -> list:
+        """top k names starting with prefix: names starting with the prefix first then shortest names
+        returns a list of (name, lang, reference)
+        """
+        prefix = " ".join(re.findall(r"\w+", normalize(prefix)))
+        if not prefix:
+            return []
+        matches = []
+        i = bisect_left(self._entries, (prefix,))
+        while i < len(self._entries) and self._entries[i][0].startswith(prefix):
+            entry = self._entries[i]
+            if lang is None or entry[4] == lang:
+                matches.append(entry)
+            i += 1
+        results = []
+        seen = set()
+        for entry in sorted(matches, key=lambda e: (e[1], e[2], e[0])):
+            if entry[3] in seen:
+                continue
+            seen.add(entry[3])
+            results.append((entry[5], entry[4], entry[6]))
+            if len(results) == k:
+                break
+        return results
@@ -0,0 +1,355 @@
+"""
+Cache
+
+process local caches
+"""
+
+import os
+import json
+import time
+import asyncio
+import inspect
+import logging
+import threading
+from collections import OrderedDict
+
+from cocat.db import get_version, bump_version
+from cocat.utils import normalize
+from cocat.vocabulary import Vocabulary
+from cocat.snapshot import load_snapshot
+
+LOGGER = logging.getLogger(__name__)
+
+
+class VocabularyCache:
+    """
+    Process local cache of vocabularies keyed by (name, lang)
+
+    Each entry keeps the version stamp of the stored vocabulary it was loaded from.
+    The stamp is checked at most every `check_interval` seconds
+    and the vocabulary is reloaded only when the stamp has changed.
+    With `check_interval` set to None entries are never checked.
+    Inside an event loop the entries are loaded by arefresh() through the async repository
+    (at startup, then by the refresh_forever() background task) and read with peek() without database access.
+
+    Attributes
+    ----------
+    check_interval: float
+        minimum delay in seconds between two checks of the version stamp of an entry
+    metrics: dict
+        number of hits, misses and reloads of the cache
+
+    Methods
+    -------
+    get(name, lang)
+    peek(name, lang)
+    arefresh(repository, names, langs)
+    refresh_forever(repository, interval)
+    invalidate(name)
+    load_snapshot(filename)
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self.metrics = {"hits": 0, "misses": 0, "reloads": 0}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, name: str, lang: str = "fr") -> Vocabulary:
+        key = (name, lang)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.metrics["misses"] += 1
+            return self._load(key)
+        vocabulary, version, checked_at = entry
+        now = time.monotonic()
+        if self.check_interval is not None and now - checked_at >= self.check_interval:
+            current_version = get_version(vocabulary.version_key)
+            if current_version != version:
+                self.metrics["reloads"] += 1
+                return self._load(key, current_version)
+            entry[2] = now
+        self.metrics["hits"] += 1
+        return vocabulary
+
+    def peek(self, name: str, lang: str = "fr") -> Vocabulary:
+        """cached vocabulary without any database access: None if it is not loaded"""
+        entry = self._entries.get((name, lang))
+        if entry is None:
+            self.metrics["misses"] += 1
+            return None
+        self.metrics["hits"] += 1
+        return entry[0]
+
+    async def arefresh(self, repository, names: list = None, langs: tuple = ("fr", "en")) -> int:
+        """load with the async repository (see cocat.repository.VocabularyRepository) the vocabularies
+        not loaded yet or whose stamp has changed: every stored and cached vocabulary by default
+        returns the number of vocabularies loaded
+        """
+        if names is None:
+            names = set(await repository.names()) | {name for name, _ in list(self._entries)}
+        loaded = 0
+        for name in names:
+            version = await repository.version(name)
+            for lang in langs:
+                entry = self._entries.get((name, lang))
+                if entry is not None and entry[1] == version:
+                    entry[2] = time.monotonic()
+                    continue
+                vocabulary = await repository.get(name, lang)
+                if vocabulary is None:
+                    # deleted vocabulary
+                    with self._lock:
+                        self._entries.pop((name, lang), None)
+                    continue
+                self.set(vocabulary, version)
+                self.metrics["reloads" if entry is not None else "misses"] += 1
+                loaded += 1
+        return loaded
+
+    async def refresh_forever(self, repository, interval: float = None):
+        """background task: arefresh every interval seconds (default to check_interval)"""
+        while True:
+            await asyncio.sleep(interval or self.check_interval or 1.0)
+            try:
+                await self.arefresh(repository)
+            except Exception as e:
+                LOGGER.error(f"Vocabulary refresh failed: {e}")
+
+    def set(self, vocabulary: Vocabulary, version: int = None) -> Vocabulary:
+        """register an already loaded vocabulary"""
+        if version is None:
+            version = vocabulary.version
+        self._entries[(vocabulary.name, vocabulary.lang)] = [vocabulary, version, time.monotonic()]
+        return vocabulary
+
+    def load_snapshot(self, filename: str, langs: tuple = ("fr", "en"), offline: bool = True) -> int:
+        """register every vocabulary of a snapshot (see cocat.snapshot) in every lang
+        if offline the version stamps are never checked: the database is not used
+        """
+        if offline:
+            self.check_interval = None
+        vocabularies = load_snapshot(filename)
+        for name, vocabulary in vocabularies.items():
+            if len(vocabulary["references"]) == 0:
+                continue
+            for lang in langs:
+                references = [{**r, "lang": lang} for r in vocabulary["references"]]
+                self.set(Vocabulary(name=name, lang=lang, references=references), vocabulary["version"])
+        return len(vocabularies)
+
+    def invalidate(self, name: str = None):
+        """drop the entries of a vocabulary in every lang or all the entries"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == name]:
+                    del self._entries[key]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.metrics["hits"] + self.metrics["misses"] + self.metrics["reloads"]
+        if total == 0:
+            return 0.0
+        return self.metrics["hits"] / total
+
+    def _load(self, key, version=None) -> Vocabulary:
+        name, lang = key
+        with self._lock:
+            # the stamp is read before the references: a write in between triggers a reload on next check
+            if version is None:
+                version = get_version(f"vocabulary:{name}")
+            vocabulary = Vocabulary(name=name, lang=lang)
+            self._entries[key] = [vocabulary, version, time.monotonic()]
+        LOGGER.debug(f"<Vocabulary(name='{name}', lang='{lang}')> loaded with version {version}")
+        return vocabulary
+
+
+VOCABULARIES = VocabularyCache()
+if os.getenv("VOCABULARY_SNAPSHOT"):
+    # workers and code generator boot from the snapshot without the database
+    VOCABULARIES.load_snapshot(os.getenv("VOCABULARY_SNAPSHOT"))
+
+
+def get_vocabulary(name: str, lang: str = "fr") -> Vocabulary:
+    """get a vocabulary from the process local cache"""
+    return VOCABULARIES.get(name, lang)
+
+
+def model_version_key(model: str) -> str:
+    """version stamp of the documents of a model"""
+    return f"model:{model}"
+
+
+def normalize_query(query: dict, text_keys: tuple = ("q",)) -> str:
+    """canonical form of a query: keys sorted, empty values dropped, list values sorted
+    (filter values are combined with OR), case and accents of the full text keys folded (as by the analyzer)
+    """
+    def canonical(value, fold: bool = False):
+        if isinstance(value, str):
+            return normalize(value) if fold else value.strip()
+        if isinstance(value, (list, tuple, set)):
+            values = [canonical(v, fold) for v in value]
+            return sorted(values, key=lambda v: json.dumps(v, sort_keys=True, default=str))
+        return value
+    canonical_query = {
+        key: canonical(value, key in text_keys)
+        for key, value in (query or {}).items()
+        if value not in [None, "", []]
+    }
+    return json.dumps(canonical_query, sort_keys=True, default=str)
+
+
+class QueryCache:
+    """
+    Process local cache of the results of the search and filter endpoints
+
+    Entries are keyed by (model, kind, normalized query, lang) and keep the version stamp
+    of the model documents (`model:<name>`) they were computed from.
+    The stamp of a model is read at most every `check_interval` seconds:
+    an entry computed from a previous version is a miss and is replaced.
+    Entries are evicted in least recently used order once their estimated size exceeds `max_bytes`.
+
+    Attributes
+    ----------
+    max_bytes: int
+        memory budget: estimated as the size of the JSON encoded results
+    check_interval: float
+        minimum delay in seconds between two reads of the version stamp of a model: never read again if None
+    metrics: dict
+        number of hits, misses, stale entries and evictions of the cache
+
+    Methods
+    -------
+    get(model, kind, query, lang, loader)
+    aget(model, kind, query, lang, loader)
+    aversion(model)
+    invalidate(model)
+    model_changed(model)
+    amodel_changed(model)
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, check_interval: float = 1.0):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.metrics = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, model: str, kind: str, query: dict, lang: str = "fr") -> tuple:
+        return (model, kind, normalize_query(query), lang)
+
+    def version(self, model: str) -> int:
+        """version stamp of a model documents: read from the database at most every check_interval"""
+        now = time.monotonic()
+        cached = self._versions.get(model)
+        if cached is None or (self.check_interval is not None and now - cached[1] >= self.check_interval):
+            cached = self._versions[model] = (get_version(model_version_key(model)), now)
+        return cached[0]
+
+    async def aversion(self, model: str) -> int:
+        """version of an async endpoint: the stamp is read in a thread when a check is due (blocking client)"""
+        cached = self._versions.get(model)
+        if cached is not None and (self.check_interval is None or time.monotonic() - cached[1] < self.check_interval):
+            return cached[0]
+        return await asyncio.get_running_loop().run_in_executor(None, self.version, model)
+
+    def lookup(self, key: tuple, version: int):
+        """cached result of a key computed from version or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.metrics["misses"] += 1
+                return None
+            result, entry_version, _ = entry
+            if entry_version != version:
+                self.metrics["stale"] += 1
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            self.metrics["hits"] += 1
+            return result
+
+    def store(self, key: tuple, version: int, result):
+        nbytes = len(json.dumps(result, default=str))
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (result, version, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.metrics["evictions"] += 1
+
+    def _drop(self, key: tuple):
+        self.nbytes -= self._entries.pop(key)[2]
+
+    def get(self, model: str, kind: str, query: dict, lang: str, loader):
+        """cached result of a query or the result of loader() once stored"""
+        key = self.key(model, kind, query, lang)
+        version = self.version(model)
+        result = self.lookup(key, version)
+        if result is None:
+            result = loader()
+            self.store(key, version, result)
+        return result
+
+    async def aget(self, model: str, kind: str, query: dict, lang: str, loader):
+        """get inside an event loop: loader may be async (e.g. a database query of a FastAPI endpoint)"""
+        key = self.key(model, kind, query, lang)
+        version = await self.aversion(model)
+        result = self.lookup(key, version)
+        if result is None:
+            result = loader()
+            if inspect.isawaitable(result):
+                result = await result
+            self.store(key, version, result)
+        return result
+
+    def invalidate(self, model: str = None):
+        """drop the entries of a model or all the entries"""
+        with self._lock:
+            if model is None:
+                self._entries.clear()
+                self._versions.clear()
+                self.nbytes = 0
+                return
+            for key in [k for k in self._entries if k[0] == model]:
+                self._drop(key)
+            self._versions.pop(model, None)
+
+    def model_changed(self, model: str) -> int:
+        """to call after a write of the documents of a model: bump its version stamp for the other processes
+        and drop its entries in this one
+        """
+        version = bump_version(model_version_key(model))
+        self.invalidate(model)
+        return version
+
+    async def amodel_changed(self, model: str) -> int:
+        """model_changed inside an event loop: the stamp is bumped in a thread"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.model_changed, model)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.metrics["hits"] + self.metrics["misses"] + self.metrics["stale"]
+        if total == 0:
+            return 0.0
+        return self.metrics["hits"] / total
+
+
+QUERIES = QueryCache(int(os.getenv("QUERY_CACHE_BYTES", 64 * 1024 * 1024)))
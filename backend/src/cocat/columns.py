@@ -0,0 +1,261 @@
+"""
+Columns
+
+columnar storage of the references of a vocabulary
+"""
+
+import sys
+
+from cocat.reference import Reference
+from cocat.utils import normalize
+
+# keys of a reference stored by column
+COLUMNS = ["id", "field", "name_fr", "name_en", "uri", "slug", "updated", "standards", "broader", "narrower"]
+# list keys: an empty list is stored as None
+LIST_COLUMNS = ["standards", "broader", "narrower"]
+# keys of a reference indexed by the vocabulary: label is the name in the lang of the vocabulary
+INDEX_KEYS = ["label", "name_fr", "name_en", "slug", "uri"]
+# low cardinality keys: values are interned
+INTERNED = ["field", "updated"]
+
+
+def intern(key, value):
+    if key in INTERNED and isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class ReferenceRow:
+    """lightweight view of a row exposing the keys of a reference as attributes"""
+    __slots__ = ("columns", "row")
+
+    def __init__(self, columns, row):
+        self.columns = columns
+        self.row = row
+
+    def __getattr__(self, key):
+        if key == "label":
+            key = f"name_{self.columns.lang}"
+        return self.columns.columns[key][self.row]
+
+
+class ReferenceColumns:
+    """
+    Columnar storage of the references of a vocabulary
+
+    Each key of COLUMNS is a list of values (interned for INTERNED keys) and a reference is a row number:
+    Reference objects are only built on demand.
+    Rows are never renumbered: a deleted row is a tombstone
+    so that indexes built on row numbers stay valid.
+
+    Attributes
+    ----------
+    vocabulary: str
+        name of the vocabulary
+    lang: str
+        lang of the labels
+    columns: dict
+        one list of values per key of COLUMNS
+    index: dict
+        row number by value of name_fr, name_en, slug and uri: the first row of a value shared by several rows
+    normalized_index: dict
+        row number by case and accent folded value of name_fr, name_en, slug and uri: built on first use
+
+    Methods
+    -------
+    clear()
+    append(reference)
+    remove(row)
+    update(row, values)
+    find(value, key, normalized)
+    column(key)
+    mapping(to)
+    reference(row)
+    """
+
+    def __init__(self, vocabulary: str, lang: str = "fr", references: list = None):
+        self.vocabulary = vocabulary
+        self.lang = lang
+        self.columns = {key: [] for key in COLUMNS}
+        self.deleted = set()
+        self.index = {key: {} for key in INDEX_KEYS[1:]}
+        # other rows of the values shared by several rows: they take over the index entry when its row is removed
+        self._shared = {key: {} for key in self.index}
+        self._normalized_index = None
+        self._normalized_shared = None
+        self._rows = None
+        for r in references or []:
+            self.append(r)
+
+    def __len__(self):
+        return len(self.columns["id"]) - len(self.deleted)
+
+    @property
+    def rows(self) -> list:
+        """row numbers of the references in insertion order"""
+        if self._rows is None:
+            self._rows = [i for i in range(len(self.columns["id"])) if i not in self.deleted]
+        return self._rows
+
+    def append(self, reference) -> int:
+        """add a reference given as a Reference or a dict and return its row number"""
+        if not isinstance(reference, dict):
+            reference = reference.__dict__
+        if reference.get("id") is None and "_id" in reference:
+            reference = {**reference, "id": reference["_id"]}
+        row = len(self.columns["id"])
+        for key in COLUMNS:
+            value = reference.get(key)
+            if key in LIST_COLUMNS and value == []:
+                value = None
+            self.columns[key].append(intern(key, value))
+        self._index(row)
+        self._rows = None
+        return row
+
+    def clear(self):
+        for key in COLUMNS:
+            self.columns[key] = []
+        for key in self.index:
+            self.index[key] = {}
+            self._shared[key] = {}
+        self._normalized_index = None
+        self._normalized_shared = None
+        self.deleted = set()
+        self._rows = None
+
+    def remove(self, row: int):
+        self._unindex(row)
+        self.deleted.add(row)
+        self._rows = None
+
+    def update(self, row: int, values: dict):
+        self._unindex(row)
+        for key, value in values.items():
+            if key in self.columns:
+                self.columns[key][row] = intern(key, value)
+        self._index(row)
+
+    @property
+    def normalized_index(self) -> dict:
+        if self._normalized_index is None:
+            self._normalized_index = {key: {} for key in self.index}
+            self._normalized_shared = {key: {} for key in self.index}
+            for row in self.rows:
+                self._index_normalized(row)
+        return self._normalized_index
+
+    def value(self, row: int, key: str):
+        if key == "label":
+            key = f"name_{self.lang}"
+        return self.columns[key][row]
+
+    def column(self, key: str) -> list:
+        """values of key for every reference"""
+        if key == "label":
+            key = f"name_{self.lang}"
+        values = self.columns[key]
+        if len(self.deleted) == 0:
+            return list(values)
+        return [values[i] for i in self.rows]
+
+    def find(self, value: str, key: str = None, normalized: bool = False) -> int:
+        """row number of the reference by one of its INDEX_KEYS (any key if not specified)"""
+        index = self.normalized_index if normalized else self.index
+        if normalized:
+            value = normalize(value)
+        keys = INDEX_KEYS if key is None else [key]
+        for k in keys:
+            if k not in INDEX_KEYS:
+                raise ValueError(f"{k} is not an indexed key: choose between {INDEX_KEYS}")
+            if k == "label":
+                k = f"name_{self.lang}"
+            if value in index[k]:
+                return index[k][value]
+        return None
+
+    def mapping(self, to: str) -> dict:
+        """{value: value of `to`} of every INDEX_KEYS value of the references (e.g. to="uri" or "label")"""
+        targets = self.column(to)
+        return {
+            value: target
+            for key in INDEX_KEYS
+            for value, target in zip(self.column(key), targets)
+            if value is not None and target is not None
+        }
+
+    def row(self, row: int) -> ReferenceRow:
+        return ReferenceRow(self, row)
+
+    def reference(self, row: int) -> Reference:
+        """build the Reference stored at row"""
+        values = {key: self.columns[key][row] for key in COLUMNS}
+        values = {key: value for key, value in values.items() if value is not None}
+        return Reference(vocabulary=self.vocabulary, lang=self.lang, **values)
+
+    @staticmethod
+    def _add(index: dict, shared: dict, value, row: int):
+        if index.setdefault(value, row) != row:
+            shared.setdefault(value, []).append(row)
+
+    @staticmethod
+    def _discard(index: dict, shared: dict, value, row: int):
+        """remove a row of a value: the next row sharing the value takes over its entry"""
+        others = shared.get(value, [])
+        if index.get(value) == row:
+            if len(others) > 0:
+                index[value] = others.pop(0)
+            else:
+                del index[value]
+        elif row in others:
+            others.remove(row)
+        if value in shared and len(others) == 0:
+            del shared[value]
+
+    def _index(self, row: int):
+        for key in self.index:
+            value = self.columns[key][row]
+            if value in ["", None]:
+                continue
+            self._add(self.index[key], self._shared[key], value, row)
+        if self._normalized_index is not None:
+            self._index_normalized(row)
+
+    def _index_normalized(self, row: int):
+        for key in self._normalized_index:
+            value = self.columns[key][row]
+            if value in ["", None]:
+                continue
+            self._add(self._normalized_index[key], self._normalized_shared[key], normalize(value), row)
+
+    def _unindex(self, row: int):
+        for key in self.index:
+            value = self.columns[key][row]
+            if value in ["", None]:
+                continue
+            self._discard(self.index[key], self._shared[key], value, row)
+            if self._normalized_index is None:
+                continue
+            self._discard(self._normalized_index[key], self._normalized_shared[key], normalize(value), row)
+
+
+class ReferenceList:
+    """list of the references of a ReferenceColumns: Reference objects are built when accessed"""
+
+    def __init__(self, columns: ReferenceColumns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __iter__(self):
+        for row in self.columns.rows:
+            yield self.columns.reference(row)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.columns.reference(row) for row in self.columns.rows[i]]
+        return self.columns.reference(self.columns.rows[i])
+
+    def __repr__(self):
+        return f"<ReferenceList(vocabulary='{self.columns.vocabulary}', size={len(self)})>"
@@ -5,6 +5,7 @@ import logging
 from cocat.vocabulary import Vocabulary
 from cocat.model import Model
 from cocat.property import Property
+from cocat.reference import Reference
 
 LOGGER = logging.getLogger(__name__)
 
@@ -12,6 +13,7 @@ class CSVConfig:
     '''System init configuration from CSV file that list all the properties for the different model list and initialize Vocabualry Properties and Models'''
     def __init__(self, csv_file, conf_dir="./"):
         self.csv_file = csv_file
+        Reference.create_indexes()
         
     @property
     def properties(self) -> list:
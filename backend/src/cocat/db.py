@@ -1,7 +1,12 @@
 import os
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from  pymongo import errors as PyMongoError
 from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from cocat import storage
+from cocat.storage import BACKENDS, MemoryClient, AsyncMemoryClient
+from cocat.monitoring import MONITOR
 
 # from settings import settings
 
@@ -10,9 +15,60 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-mongodb_client = MongoClient(os.getenv("DB_URI"))
-DB = mongodb_client[os.getenv("DB_NAME")]
+# mongo or memory (see cocat.storage): memory needs no database server e.g. for tests and offline tools
+DB_BACKEND = os.getenv("DB_BACKEND", "mongo")
+if DB_BACKEND not in BACKENDS:
+    raise ValueError(f"Storage Error. DB_BACKEND {DB_BACKEND} is not supported: choose between {BACKENDS}")
+
+# record the database commands by call site (see cocat.monitoring)
+DB_MONITORING = os.getenv("DB_MONITORING", "0").lower() in ["1", "true", "yes"]
+EVENT_LISTENERS = [MONITOR] if DB_MONITORING else []
+if DB_MONITORING and MONITOR not in storage.LISTENERS:
+    storage.LISTENERS.append(MONITOR)
+
+
+def get_client(db_uri: str = None):
+    """client of the DB_BACKEND"""
+    if DB_BACKEND == "memory":
+        return MemoryClient()
+    return MongoClient(db_uri or os.getenv("DB_URI"), event_listeners=EVENT_LISTENERS)
+
+
+def get_async_client(db_uri: str = None):
+    """asynchronous (motor) client of the DB_BACKEND to be used inside an event loop"""
+    if DB_BACKEND == "memory":
+        return AsyncMemoryClient()
+    return AsyncIOMotorClient(db_uri or os.getenv("DB_URI"), event_listeners=EVENT_LISTENERS)
+
+
+mongodb_client = get_client()
+DB = mongodb_client[os.getenv("DB_NAME", "cocat")]
+
+
+def get_async_db(db_uri: str = None, db_name: str = None):
+    """asynchronous (motor) database to be used inside an event loop
+    with the memory backend it shares the documents of DB
+    """
+    return get_async_client(db_uri)[db_name or os.getenv("DB_NAME", "cocat")]
+
+
+def get_version(key: str) -> int:
+    """current version stamp of a set of documents (e.g. `vocabulary:status`): 0 if never stamped"""
+    stamp = DB.version.find_one({"_id": key}, {"version": 1})
+    if stamp is None:
+        return 0
+    return stamp["version"]
 
+def bump_version(key: str, session=None) -> int:
+    """increment the version stamp of a set of documents after a write and return it"""
+    stamp = DB.version.find_one_and_update(
+        {"_id": key},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    return stamp["version"]
 
 
 class PyObjectId(ObjectId):
@@ -0,0 +1,510 @@
+"""
+Export
+
+streaming export of the documents of a model as a DCAT-AP xml catalog, a Parquet file
+or linked data (N-Triples, JSON-LD):
+documents are read from a cursor and written one by one (or by row group), the memory used does not grow with the catalog
+"""
+
+import re
+import json
+import logging
+import datetime
+from urllib.parse import quote
+from xml.sax.saxutils import XMLGenerator
+
+from cocat.cache import get_vocabulary
+from cocat.columns import INDEX_KEYS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # optional: Parquet export only (pip install pyarrow)
+    pa = pq = None
+
+LOGGER = logging.getLogger(__name__)
+
+NAMESPACES = {
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "dcat": "http://www.w3.org/ns/dcat#",
+    "dct": "http://purl.org/dc/terms/",
+    "adms": "http://www.w3.org/ns/adms#",
+    "foaf": "http://xmlns.com/foaf/0.1/",
+    "skos": "http://www.w3.org/2004/02/skos/core#",
+}
+
+# INSPIRE metadata are ISO 19139 records (mandatory contact, dates...) which the properties do not describe:
+# catalogs are exported as DCAT-AP only
+FORMATS = ["dcat"]
+
+
+def qualified_name(label: str) -> str:
+    """xml element of the dcat label of a property or None
+    `dcat:themeTaxonomy: skos` -> `dcat:themeTaxonomy`, `dcat/organisationType` -> `dcat:organisationType`
+    """
+    if label is None or label.strip() == "":
+        return None
+    found = re.match(r"\s*([A-Za-z]+)[:/]([A-Za-z][\w.-]*)", label)
+    if found is None or found.group(1) not in NAMESPACES:
+        return None
+    return f"{found.group(1)}:{found.group(2)}"
+
+
+def vocabulary_uris(properties, lang: str = "fr") -> dict:
+    """{field: {value: uri}} of the vocabulary properties: every key of a reference (label, names, slug, uri)
+    maps to its uri, computed once before the export
+    """
+    uris = {}
+    for prop in properties:
+        if not prop.is_vocabulary or prop.vocabulary_name is None:
+            continue
+        try:
+            uris[prop.field] = get_vocabulary(prop.vocabulary_name, lang).columns.mapping("uri")
+        except Exception as e:
+            LOGGER.warning(f"No uri for the values of {prop.field} ({prop.vocabulary_name}): {e}")
+            uris[prop.field] = {}
+    return uris
+
+
+def field_values(document: dict, prop, lang: str = "fr") -> list:
+    """(lang, value) pairs of a field of a document: lang is set for the multilang properties of multilang documents"""
+    langs = [code for code in ["fr", "en"] if isinstance(document.get(code), dict)]
+    if len(langs) == 0:
+        pairs = [(None, document.get(prop.field))]
+    elif prop.multilang:
+        pairs = [(code, document[code].get(prop.field)) for code in langs]
+    else:
+        pairs = [(None, document[lang if lang in langs else langs[0]].get(prop.field))]
+    return [
+        (code, v)
+        for code, value in pairs
+        for v in (value if isinstance(value, (list, tuple)) else [value])
+        if v not in [None, ""]
+    ]
+
+
+class CatalogExporter:
+    """
+    Write the documents of a model as a DCAT-AP xml catalog
+
+    Every property with a dcat label becomes an element of the documents.
+    Values of a vocabulary field are written as a link to the uri of their reference when it has one,
+    the uris of every vocabulary are mapped once before the export. Values of a multilang field are written in every lang with xml:lang.
+
+    Attributes
+    ----------
+    model: Model
+        model of the documents: its properties give the exported fields
+    format: str
+        dcat (the only format: INSPIRE metadata need ISO 19139 records)
+    lang: str
+        lang of the vocabulary labels and of the documents which are not multilang
+    base_uri: str
+        prefix of the uri of a document: base_uri + document id
+
+    Methods
+    -------
+    write(documents, out)
+    export(collection, filename)
+    """
+
+    def __init__(self, model, format: str = "dcat", lang: str = "fr", base_uri: str = ""):
+        if format not in FORMATS:
+            raise ValueError(f"Export Error. Format {format} is not supported: choose between {FORMATS}")
+        self.model = model
+        self.format = format
+        self.lang = lang
+        self.base_uri = base_uri
+        self.fields = []
+        for prop in model.properties:
+            name = qualified_name(prop.dcat_label)
+            if name is not None:
+                self.fields.append((prop, name))
+        self.uris = vocabulary_uris([prop for prop, _ in self.fields], lang)
+
+    def uri(self, prop, value):
+        """uri of the reference of a vocabulary value or None"""
+        if not isinstance(value, str):
+            return None
+        return self.uris.get(prop.field, {}).get(value)
+
+    @staticmethod
+    def text(value) -> str:
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        if isinstance(value, bool):
+            return str(value).lower()
+        if isinstance(value, dict):
+            return str(value.get("name") or value.get("name_fr") or value.get("uri") or "")
+        return str(value)
+
+    def _element(self, generator: XMLGenerator, name: str, attributes: dict, text: str = None):
+        generator.startElement(name, attributes)
+        if text is not None:
+            generator.characters(text)
+        generator.endElement(name)
+        generator.ignorableWhitespace("\n")
+
+    def _write_document(self, generator: XMLGenerator, document: dict):
+        root, item = "dcat:dataset", "dcat:Dataset"
+        doc_id = document.get("_id", document.get("id"))
+        generator.startElement(root, {})
+        generator.startElement(item, {"rdf:about": f"{self.base_uri}{doc_id}"} if doc_id is not None else {})
+        generator.ignorableWhitespace("\n")
+        for prop, name in self.fields:
+            for lang, value in field_values(document, prop, self.lang):
+                uri = self.uri(prop, value)
+                if uri is not None:
+                    self._element(generator, name, {"rdf:resource": uri})
+                elif lang is not None:
+                    self._element(generator, name, {"xml:lang": lang}, self.text(value))
+                else:
+                    self._element(generator, name, {}, self.text(value))
+        generator.endElement(item)
+        generator.endElement(root)
+        generator.ignorableWhitespace("\n")
+
+    def write(self, documents, out) -> int:
+        """write a catalog of documents (any iterable e.g. a cursor) into a text stream: returns the number of documents"""
+        generator = XMLGenerator(out, encoding="utf-8", short_empty_elements=True)
+        generator.startDocument()
+        attributes = {f"xmlns:{prefix}": uri for prefix, uri in NAMESPACES.items()}
+        generator.startElement("rdf:RDF", attributes)
+        catalog = "dcat:Catalog"
+        generator.startElement(catalog, {})
+        generator.ignorableWhitespace("\n")
+        count = 0
+        for document in documents:
+            self._write_document(generator, document)
+            count += 1
+        generator.endElement(catalog)
+        generator.endElement("rdf:RDF")
+        generator.endDocument()
+        return count
+
+    def export(self, collection, filename: str, batch_size: int = 500) -> int:
+        """write every document of a collection in a file"""
+        with open(filename, "w", encoding="utf-8") as f:
+            count = self.write(collection.find({}).batch_size(batch_size), f)
+        LOGGER.info(f"{count} {self.model.name} documents exported to {filename} ({self.format})")
+        return count
+
+
+def export_catalog(model, collection, filename: str, format: str = "dcat", lang: str = "fr", base_uri: str = "") -> int:
+    return CatalogExporter(model, format, lang, base_uri).export(collection, filename)
+
+
+def arrow_type(prop):
+    """arrow type of the values of a property: a list for multiple values,
+    dictionary encoded for a single vocabulary value (lists of vocabulary values are dictionary encoded
+    by the Parquet pages only: arrow can't read back lists of dictionaries from chunked row groups)
+    """
+    value_type = {
+        "integer": pa.int64(),
+        "float": pa.float64(),
+        "number": pa.float64(),
+        "boolean": pa.bool_(),
+        "date": pa.date32(),
+        "datetime": pa.timestamp("us"),
+    }.get(prop.datatype, pa.string())
+    if prop.multiple:
+        return pa.list_(value_type)
+    if prop.is_vocabulary:
+        return pa.dictionary(pa.int32(), pa.string())
+    return value_type
+
+
+def cast(value, datatype: str):
+    """value of a document into the python type of its arrow column: None if it can't be cast"""
+    if value is None or value == "":
+        return None
+    try:
+        if datatype == "integer":
+            return int(value)
+        if datatype in ["float", "number"]:
+            return float(value)
+        if datatype == "boolean":
+            return value if isinstance(value, bool) else str(value).lower() in ["true", "1", "yes", "oui"]
+        if datatype == "date":
+            if isinstance(value, datetime.datetime):
+                return value.date()
+            return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(str(value)[:10])
+        if datatype == "datetime":
+            return value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(str(value))
+        if datatype == "object" or isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False, default=str)
+        return str(value)
+    except (TypeError, ValueError):
+        LOGGER.debug(f"{value!r} is not a {datatype}")
+        return None
+
+
+class ParquetExporter:
+    """
+    Write the documents of a model in a Parquet file
+
+    The Arrow schema is derived from the properties of the model: one column by field
+    (by field and lang e.g. `title_fr`, `title_en` for a multilang field of multilang documents),
+    typed from the datatype of the property, a list for a multiple field, dictionary encoded for a vocabulary field
+    (string columns are also dictionary encoded in the Parquet pages).
+    Documents are buffered by `row_group_size` and written as a row group: the memory used is bounded by a row group.
+
+    Attributes
+    ----------
+    model: Model
+    lang: str
+        lang of the fields which are not translated in multilang documents
+    row_group_size: int
+        number of documents by row group
+    schema: pyarrow.Schema
+
+    Methods
+    -------
+    write(documents, filename)
+    export(collection, filename)
+    """
+
+    def __init__(self, model, lang: str = "fr", multilang: bool = None, row_group_size: int = 65536):
+        if pa is None:
+            raise ImportError("Export Error. Parquet export requires pyarrow: pip install pyarrow")
+        self.model = model
+        self.lang = lang
+        self.row_group_size = row_group_size
+        properties = model.properties
+        if multilang is None:
+            multilang = any(prop.multilang for prop in properties)
+        self.columns = []
+        for prop in properties:
+            if prop.multilang and multilang:
+                self.columns.extend((f"{prop.field}_{lang}", prop, lang) for lang in ["fr", "en"])
+            else:
+                self.columns.append((prop.field, prop, None))
+        self.schema = pa.schema(
+            [pa.field("id", pa.string())] + [pa.field(name, arrow_type(prop)) for name, prop, _ in self.columns]
+        )
+
+    def _source(self, document: dict, lang: str) -> dict:
+        if isinstance(document.get("fr"), dict) or isinstance(document.get("en"), dict):
+            return document.get(lang or self.lang) or {}
+        return document
+
+    @staticmethod
+    def _cast_values(values: list, prop) -> list:
+        if not prop.multiple:
+            return [cast(value, prop.datatype) for value in values]
+        return [
+            None if value is None
+            else [v for v in (cast(v, prop.datatype) for v in (value if isinstance(value, (list, tuple)) else [value])) if v is not None]
+            for value in values
+        ]
+
+    def _array(self, values: list, prop, arrow_type):
+        """arrow array of the values of a column: converted as a whole and value by value only if it fails"""
+        try:
+            return pa.array(values, type=arrow_type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+            pass
+        if prop.datatype in ["date", "datetime"] and not prop.multiple:
+            try:
+                # iso strings
+                return pa.array(values).cast(arrow_type)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                pass
+        return pa.array(self._cast_values(values, prop), type=arrow_type)
+
+    def _table(self, documents: list):
+        ids = [document.get("_id", document.get("id")) for document in documents]
+        arrays = [pa.array([str(doc_id) if doc_id is not None else None for doc_id in ids], type=pa.string())]
+        sources = {}
+        for (_, prop, lang), field in zip(self.columns, list(self.schema)[1:]):
+            if lang not in sources:
+                sources[lang] = [self._source(document, lang) for document in documents]
+            values = [source.get(prop.field) for source in sources[lang]]
+            arrays.append(self._array(values, prop, field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def write(self, documents, filename: str) -> int:
+        """write documents (any iterable e.g. a cursor) in a Parquet file: returns the number of documents"""
+        count = 0
+        with pq.ParquetWriter(filename, self.schema) as writer:
+            batch = []
+            for document in documents:
+                batch.append(document)
+                if len(batch) >= self.row_group_size:
+                    writer.write_table(self._table(batch))
+                    count += len(batch)
+                    batch = []
+            if len(batch) > 0 or count == 0:
+                writer.write_table(self._table(batch))
+                count += len(batch)
+        return count
+
+    def export(self, collection, filename: str, batch_size: int = 1000) -> int:
+        """write every document of a collection in a Parquet file"""
+        count = self.write(collection.find({}).batch_size(batch_size), filename)
+        LOGGER.info(f"{count} {self.model.name} documents exported to {filename} (parquet)")
+        return count
+
+
+def export_parquet(model, collection, filename: str, lang: str = "fr", row_group_size: int = 65536) -> int:
+    return ParquetExporter(model, lang, row_group_size=row_group_size).export(collection, filename)
+
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+XSD_TYPES = {"integer": "integer", "float": "decimal", "number": "decimal", "boolean": "boolean", "date": "date", "datetime": "dateTime"}
+
+
+def expand_name(name: str) -> str:
+    """iri of a qualified name: `dcat:title` -> `http://www.w3.org/ns/dcat#title`"""
+    prefix, _, local = name.partition(":")
+    return NAMESPACES[prefix] + local
+
+
+# absolute iri allowed in N-Triples: a scheme and none of the characters excluded from IRIREF
+IRI = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*:[^\x00-\x20<>"{}|^`\\]+$')
+
+
+def is_iri(value) -> bool:
+    return isinstance(value, str) and IRI.match(value) is not None
+
+
+def escape_literal(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r")
+
+
+class LinkedDataExporter:
+    """
+    Write the documents of a model as linked data: N-Triples or JSON-LD
+
+    Every document is a dcat:Dataset `<base_uri><id>` and every property with a dcat label a predicate.
+    Vocabulary values are written as the uri of their reference from a map computed once before the export
+    (see vocabulary_uris), other values as literals typed from the datatype of the property
+    or tagged with their lang for the multilang fields. A reference uri which is not a valid absolute iri
+    (e.g. with spaces) is skipped: the value is written as a literal.
+    The output is written by chunks of `chunk_size` documents.
+
+    Attributes
+    ----------
+    model: Model
+    base_uri: str
+        absolute iri prefixing the (escaped) id of a document e.g. `https://example.org/dataset/`
+    lang: str
+        lang of the vocabulary labels and of the fields which are not translated
+    chunk_size: int
+        number of documents by write
+
+    Methods
+    -------
+    triples(document)
+    write_ntriples(documents, out)
+    write_jsonld(documents, out)
+    export(collection, filename, format)
+    """
+
+    def __init__(self, model, base_uri: str, lang: str = "fr", chunk_size: int = 1000):
+        if not is_iri(base_uri):
+            raise ValueError(f"Export Error. base_uri {base_uri!r} is not an absolute iri e.g. https://example.org/dataset/")
+        self.model = model
+        self.base_uri = base_uri
+        self.lang = lang
+        self.chunk_size = chunk_size
+        self.fields = [
+            (prop, qualified_name(prop.dcat_label)) for prop in model.properties if qualified_name(prop.dcat_label) is not None
+        ]
+        self.uris = {}
+        for field, uris in vocabulary_uris([prop for prop, _ in self.fields], lang).items():
+            self.uris[field] = {value: uri for value, uri in uris.items() if is_iri(uri)}
+            if len(self.uris[field]) < len(uris):
+                LOGGER.warning(f"{len(uris) - len(self.uris[field])} values of {field} have an uri which is not a valid iri: written as literals")
+
+    def subject(self, document: dict) -> str:
+        return self.base_uri + quote(str(document.get("_id", document.get("id"))), safe="")
+
+    def objects(self, document: dict, prop) -> list:
+        """(uri, literal, lang, datatype) of the values of a field: uri is None for a literal"""
+        uris = self.uris.get(prop.field, {})
+        datatype = XSD_TYPES.get(prop.datatype)
+        objects = []
+        for lang, value in field_values(document, prop, self.lang):
+            uri = uris.get(value) if isinstance(value, str) else None
+            if uri is not None:
+                objects.append((uri, None, None, None))
+            else:
+                objects.append((None, CatalogExporter.text(value), lang, None if lang else datatype))
+        return objects
+
+    def triples(self, document: dict):
+        """(subject, predicate, object) in N-Triples notation"""
+        subject = f"<{self.subject(document)}>"
+        yield subject, f"<{NAMESPACES['rdf']}type>", f"<{NAMESPACES['dcat']}Dataset>"
+        for prop, name in self.fields:
+            predicate = f"<{expand_name(name)}>"
+            for uri, literal, lang, datatype in self.objects(document, prop):
+                if uri is not None:
+                    yield subject, predicate, f"<{uri}>"
+                elif lang is not None:
+                    yield subject, predicate, f'"{escape_literal(literal)}"@{lang}'
+                elif datatype is not None:
+                    yield subject, predicate, f'"{escape_literal(literal)}"^^<{XSD}{datatype}>'
+                else:
+                    yield subject, predicate, f'"{escape_literal(literal)}"'
+
+    def node(self, document: dict) -> dict:
+        """JSON-LD node of a document (compacted with the prefixes of NAMESPACES)"""
+        node = {"@id": self.subject(document), "@type": "dcat:Dataset"}
+        for prop, name in self.fields:
+            values = []
+            for uri, literal, lang, datatype in self.objects(document, prop):
+                if uri is not None:
+                    values.append({"@id": uri})
+                elif lang is not None:
+                    values.append({"@value": literal, "@language": lang})
+                elif datatype is not None:
+                    values.append({"@value": literal, "@type": f"xsd:{datatype}"})
+                else:
+                    values.append(literal)
+            if len(values) > 0:
+                node[name] = values if prop.multiple or len(values) > 1 else values[0]
+        return node
+
+    def _chunks(self, documents, render):
+        chunk = []
+        for document in documents:
+            chunk.append(render(document))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield chunk
+
+    def write_ntriples(self, documents, out) -> int:
+        """write the triples of documents (any iterable e.g. a cursor) into a text stream: returns the number of documents"""
+        count = 0
+        render = lambda document: "".join(f"{s} {p} {o} .\n" for s, p, o in self.triples(document))
+        for chunk in self._chunks(documents, render):
+            out.write("".join(chunk))
+            count += len(chunk)
+        return count
+
+    def write_jsonld(self, documents, out) -> int:
+        """write documents as a JSON-LD graph into a text stream: returns the number of documents"""
+        context = {**NAMESPACES, "xsd": XSD}
+        out.write('{"@context": ' + json.dumps(context) + ', "@graph": [\n')
+        count = 0
+        render = lambda document: json.dumps(self.node(document), ensure_ascii=False)
+        for chunk in self._chunks(documents, render):
+            out.write((",\n" if count > 0 else "") + ",\n".join(chunk))
+            count += len(chunk)
+        out.write("\n]}\n")
+        return count
+
+    def export(self, collection, filename: str, format: str = "nt", batch_size: int = 1000) -> int:
+        """write every document of a collection in a N-Triples (nt) or JSON-LD (jsonld) file"""
+        write = {"nt": self.write_ntriples, "jsonld": self.write_jsonld}.get(format)
+        if write is None:
+            raise ValueError(f"Export Error. Format {format} is not supported: choose between nt and jsonld")
+        with open(filename, "w", encoding="utf-8") as f:
+            count = write(collection.find({}).batch_size(batch_size), f)
+        LOGGER.info(f"{count} {self.model.name} documents exported to {filename} ({format})")
+        return count
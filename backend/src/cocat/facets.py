@@ -0,0 +1,186 @@
+"""
+Facets
+
+bitmap index of the values of the filter fields of a model (Property.filter_values): combined filters and facet counts in memory
+"""
+
+import logging
+import threading
+
+from cocat.cache import get_vocabulary
+
+LOGGER = logging.getLogger(__name__)
+
+
+def popcount(bitmap: int) -> int:
+    """number of documents of a bitmap"""
+    return bin(bitmap).count("1")
+
+
+def positions(bitmap: int) -> list:
+    """positions of the documents of a bitmap in increasing order"""
+    return [i for i, bit in enumerate(reversed(bin(bitmap)[2:])) if bit == "1"]
+
+
+def vocabulary_expand(name: str, lang: str = "fr"):
+    """function mapping a value to itself and its descendants in a vocabulary
+    the vocabulary is read from the cache on every call: the expansion follows its updates
+    """
+    def expand(value) -> list:
+        return get_vocabulary(name, lang).expand(value)
+    return expand
+
+
+class FacetIndex:
+    """
+    Bitmap index over the values of the filter fields of a model
+
+    Each document gets a position (positions of removed documents are reused)
+    and each (field, value) pair a bitmap: a python int whose bit at the position of a document is set.
+    Values of a field are combined with OR, fields with AND.
+    Facet counts are disjunctive: the counts of a field ignore the filter on that field
+    so that the other values of a selected facet keep their counts.
+
+    Attributes
+    ----------
+    fields: list
+        indexed fields
+    expand: dict
+        optional function by field mapping a filter value to the values it covers
+        (e.g. Vocabulary.expand for a hierarchical vocabulary)
+
+    Methods
+    -------
+    add(doc_id, document)
+    remove(doc_id)
+    filter(filters)
+    search(filters, skip, limit)
+    counts(filters)
+    from_model(model, lang)
+    """
+
+    def __init__(self, fields: list, expand: dict = None):
+        self.fields = list(fields)
+        self.expand = expand or {}
+        self.bitmaps = {field: {} for field in self.fields}
+        self._all = 0
+        self._positions = {}
+        self._ids = []
+        self._free = []
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_model(cls, model, lang: str = None) -> "FacetIndex":
+        """index of the filter fields of the properties of a model
+        a filter value of a vocabulary field covers its descendants in the vocabulary (in lang, default to the lang of the model)
+        """
+        properties = [prop for prop in model.properties if prop.filter_values]
+        expand = {
+            prop.field: vocabulary_expand(prop.vocabulary_name, lang or model.lang)
+            for prop in properties
+            if prop.is_vocabulary and prop.vocabulary_name is not None
+        }
+        return cls([prop.field for prop in properties], expand)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, doc_id):
+        return str(doc_id) in self._positions
+
+    @staticmethod
+    def _field_values(value) -> list:
+        if value is None:
+            return []
+        if isinstance(value, (list, tuple, set)):
+            return [v for v in value if v is not None]
+        return [value]
+
+    def add(self, doc_id, document: dict):
+        """index a document or replace its previous version"""
+        doc_id = str(doc_id)
+        with self._lock:
+            self._remove(doc_id)
+            if self._free:
+                position = self._free.pop()
+                self._ids[position] = doc_id
+            else:
+                position = len(self._ids)
+                self._ids.append(doc_id)
+            self._positions[doc_id] = position
+            bit = 1 << position
+            self._all |= bit
+            values = []
+            for field in self.fields:
+                for value in self._field_values(document.get(field)):
+                    bitmaps = self.bitmaps[field]
+                    bitmaps[value] = bitmaps.get(value, 0) | bit
+                    values.append((field, value))
+            self._values[doc_id] = values
+
+    def remove(self, doc_id) -> bool:
+        with self._lock:
+            return self._remove(str(doc_id))
+
+    def _remove(self, doc_id: str) -> bool:
+        position = self._positions.pop(doc_id, None)
+        if position is None:
+            return False
+        mask = ~(1 << position)
+        self._all &= mask
+        for field, value in self._values.pop(doc_id):
+            bitmap = self.bitmaps[field][value] & mask
+            if bitmap == 0:
+                del self.bitmaps[field][value]
+            else:
+                self.bitmaps[field][value] = bitmap
+        self._ids[position] = None
+        self._free.append(position)
+        return True
+
+    def _field_bitmap(self, field: str, values) -> int:
+        bitmap = 0
+        expand = self.expand.get(field)
+        for value in self._field_values(values):
+            for v in (expand(value) if expand is not None else [value]):
+                bitmap |= self.bitmaps[field].get(v, 0)
+        return bitmap
+
+    def filter(self, filters: dict = None, exclude: str = None) -> int:
+        """bitmap of the documents matching every filtered field (any of its values): exclude ignores a field"""
+        bitmap = self._all
+        for field, values in (filters or {}).items():
+            if field == exclude or values in [None, []]:
+                continue
+            if field not in self.bitmaps:
+                raise ValueError(f"Facet Error. {field} is not a filter field: choose between {self.fields}")
+            bitmap &= self._field_bitmap(field, values)
+            if bitmap == 0:
+                break
+        return bitmap
+
+    def search(self, filters: dict = None, skip: int = 0, limit: int = None) -> list:
+        """ids of the documents matching the filters"""
+        selected = positions(self.filter(filters))
+        selected = selected[skip:] if limit is None else selected[skip:skip + limit]
+        return [self._ids[position] for position in selected]
+
+    def count(self, filters: dict = None) -> int:
+        return popcount(self.filter(filters))
+
+    def counts(self, filters: dict = None, fields: list = None) -> dict:
+        """{field: {value: number of matching documents}} for every field (values without document are omitted)"""
+        counts = {}
+        filters = filters or {}
+        selected = self.filter(filters)
+        for field in fields or self.fields:
+            # the selection itself for the fields without filter
+            base = selected if filters.get(field) in [None, []] else self.filter(filters, exclude=field)
+            field_counts = {}
+            for value, bitmap in self.bitmaps[field].items():
+                count = popcount(bitmap & base)
+                if count > 0:
+                    field_counts[value] = count
+            counts[field] = field_counts
+        return counts
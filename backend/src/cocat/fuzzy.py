@@ -0,0 +1,129 @@
+"""
+Fuzzy
+
+approximate matching of free values against the references of a vocabulary
+"""
+
+from collections import defaultdict
+from functools import lru_cache
+
+from cocat.utils import normalize
+
+
+def trigrams(value: str) -> set:
+    """set of the 3-grams of a value padded with spaces"""
+    value = f"  {value} "
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def levenshtein(a: str, b: str, max_distance: int = None) -> int:
+    """edit distance between a and b
+    if max_distance is given stops as soon as the distance is greater and returns max_distance + 1
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb)
+            ))
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class FuzzyMatcher:
+    """
+    Fuzzy matcher of free values against the names of references
+
+    Values and names are case and accent folded: a value equal to a folded name
+    is matched in constant time with a score of 1.0.
+    Otherwise candidates sharing enough trigrams with the value are ranked by edit distance
+    and the score is 1 - distance / length of the longest string.
+    Results are memoized as bulk imports repeat the same values.
+
+    Attributes
+    ----------
+    threshold: float
+        minimum score of a match
+    min_overlap: float
+        minimum share of the trigrams of the value a candidate must contain
+
+    Methods
+    -------
+    add(reference, key)
+    remove(reference, key)
+    match(value)
+    """
+
+    def __init__(self, references: list = None, threshold: float = 0.8, min_overlap: float = 0.3, cache_size: int = 100000, langs: tuple = ("fr", "en")):
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self.langs = langs
+        self._names = {}
+        self._grams = defaultdict(set)
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+        for r in references or []:
+            self.add(r)
+
+    def add(self, reference, key=None):
+        """index the names of reference: key identifies the reference (default to its identity)"""
+        if key is None:
+            key = id(reference)
+        for lang in self.langs:
+            name = getattr(reference, f"name_{lang}")
+            if name in ["", None]:
+                continue
+            folded = normalize(name)
+            if folded in self._names:
+                continue
+            self._names[folded] = (key, reference)
+            for gram in trigrams(folded):
+                self._grams[gram].add(folded)
+        self.match.cache_clear()
+
+    def remove(self, reference, key=None):
+        if key is None:
+            key = id(reference)
+        for folded in [f for f, (k, r) in self._names.items() if k == key]:
+            del self._names[folded]
+            for gram in trigrams(folded):
+                self._grams[gram].discard(folded)
+        self.match.cache_clear()
+
+    def _match(self, value: str) -> tuple:
+        """best (reference, score) for value or (None, 0.0) below threshold"""
+        key = normalize(value)
+        if not key:
+            return (None, 0.0)
+        if key in self._names:
+            return (self._names[key][1], 1.0)
+        grams = trigrams(key)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self._grams.get(gram, ()):
+                shared[candidate] += 1
+        min_shared = self.min_overlap * len(grams)
+        best, best_score = None, 0.0
+        for candidate, n in sorted(shared.items(), key=lambda c: -c[1]):
+            if n < min_shared:
+                break
+            longest = max(len(key), len(candidate))
+            # a candidate can't beat the current best if its length difference already costs too much
+            max_distance = int(longest * (1 - max(self.threshold, best_score)))
+            distance = levenshtein(key, candidate, max_distance)
+            if distance > max_distance:
+                continue
+            score = 1 - distance / longest
+            if score > best_score:
+                best, best_score = candidate, score
+        if best is None or best_score < self.threshold:
+            return (None, 0.0)
+        return (self._names[best][1], best_score)
@@ -3,4 +3,12 @@
 #         document_models=[
 #             "app.models.DemoDocument",
 #         ],
-#     )
\ No newline at end of file
+#     )
+from cocat.utils import load_template
+
+
+def write_vocabulary_router(file="test-vocabulary-router.py"):
+    """Generate the FastAPI router of the vocabularies (apps.vocabulary.routers)"""
+    template = load_template("vocabulary_router.tpl")
+    with open(file, "w") as f:
+        f.write(template.render())
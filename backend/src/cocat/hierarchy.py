@@ -0,0 +1,85 @@
+"""
+Hierarchy
+
+broader/narrower relations (SKOS) between the references of a vocabulary
+"""
+
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Hierarchy:
+    """
+    Transitive closure of the broader/narrower relations of a vocabulary
+
+    Relations are declared on references by the slug, uri or name of the related reference
+    in `broader` (parents) or `narrower` (children).
+    Ancestors and descendants of every reference are computed once:
+    expanding a term to all its descendants is a single lookup.
+
+    Attributes
+    ----------
+    parents: dict
+        row numbers of the direct parents by row number
+    ancestors: dict
+        row numbers of all the ancestors by row number
+    descendants: dict
+        row numbers of all the descendants by row number
+
+    Methods
+    -------
+    expand(row)
+    """
+
+    def __init__(self, columns):
+        self.parents = {row: set() for row in columns.rows}
+        for row in columns.rows:
+            for parent in columns.value(row, "broader") or []:
+                parent_row = self._resolve(columns, row, parent)
+                if parent_row is not None:
+                    self.parents[row].add(parent_row)
+            for child in columns.value(row, "narrower") or []:
+                child_row = self._resolve(columns, row, child)
+                if child_row is not None:
+                    self.parents[child_row].add(row)
+        self.ancestors = {}
+        for row in self.parents:
+            self._set_ancestors(row)
+        self.descendants = {row: set() for row in self.parents}
+        for row, ancestors in self.ancestors.items():
+            for ancestor in ancestors:
+                self.descendants[ancestor].add(row)
+        self.descendants = {row: frozenset(rows) for row, rows in self.descendants.items()}
+
+    @staticmethod
+    def _resolve(columns, row, value):
+        related = columns.find(value, "slug")
+        if related is None:
+            related = columns.find(value)
+        if related is None or related == row:
+            LOGGER.warning(f"<Vocabulary(name='{columns.vocabulary}')> {value} is not a reference: relation ignored.")
+            return None
+        return related
+
+    def _set_ancestors(self, row):
+        """ancestors by iterative depth first search: cycles are ignored"""
+        if row in self.ancestors:
+            return self.ancestors[row]
+        ancestors = set()
+        stack = list(self.parents[row])
+        while stack:
+            parent = stack.pop()
+            if parent in ancestors or parent == row:
+                continue
+            ancestors.add(parent)
+            if parent in self.ancestors:
+                ancestors |= self.ancestors[parent] - {row}
+            else:
+                stack.extend(self.parents[parent])
+        self.ancestors[row] = frozenset(ancestors)
+        return self.ancestors[row]
+
+    def expand(self, row) -> list:
+        """row and all its descendants"""
+        return [row, *self.descendants.get(row, ())]
@@ -0,0 +1,282 @@
+"""
+Importer
+
+parallel bulk import of the records of a model from a csv file following the columns of its properties:
+values are cast by the datatype, format and multiple options of the properties, vocabulary values are checked
+against the references, rejected rows (and rows the database refuses) are written to an error csv
+
+    python -m cocat.importer rules.csv dataset records.csv --errors errors.csv --workers 4
+"""
+
+import re
+import csv
+import json
+import time
+import logging
+import argparse
+import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pymongo.errors import BulkWriteError
+
+from cocat.db import DB
+from cocat.cache import QUERIES, get_vocabulary
+
+LOGGER = logging.getLogger(__name__)
+
+TRUE_VALUES = ["true", "1", "yes", "oui", "vrai"]
+FALSE_VALUES = ["false", "0", "no", "non", "faux"]
+EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def cast_value(value: str, datatype: str = "string", format: str = None):
+    """python value of a csv cell: raise ValueError if it is not a datatype (and format)"""
+    value = value.strip()
+    if datatype == "integer":
+        return int(value)
+    if datatype in ["float", "number"]:
+        return float(value.replace(",", "."))
+    if datatype == "boolean":
+        if value.lower() in TRUE_VALUES:
+            return True
+        if value.lower() in FALSE_VALUES:
+            return False
+        raise ValueError(f"{value} is not a boolean")
+    if datatype in ["date", "datetime"]:
+        # format of the rule, then ISO 8601, then french dates
+        for date_format in [format, None, "%d/%m/%Y"]:
+            try:
+                if date_format is None:
+                    parsed = datetime.datetime.fromisoformat(value)
+                else:
+                    parsed = datetime.datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+            # dates are stored as datetimes (BSON has no date type)
+            return parsed if datatype == "datetime" else datetime.datetime.combine(parsed.date(), datetime.time())
+        raise ValueError(f"{value} is not a {datatype}")
+    if datatype == "object":
+        return json.loads(value)
+    if format == "email" and not EMAIL.match(value):
+        raise ValueError(f"{value} is not an email")
+    if format == "url" and not value.startswith(("http://", "https://")):
+        raise ValueError(f"{value} is not an url")
+    return value
+
+
+def vocabulary_values(name: str, lang: str = "fr") -> dict:
+    """{value: label} of every key of the references of a vocabulary (label, names, slug, uri)"""
+    return get_vocabulary(name, lang).columns.mapping("label")
+
+
+def record_schema(model, lang: str = "fr") -> list:
+    """fields of the properties of a model with their vocabulary values: plain data sent to the worker processes"""
+    schema = []
+    for prop in model.properties:
+        is_vocabulary = bool(prop.is_vocabulary) and prop.vocabulary_name is not None
+        schema.append({
+            "field": prop.field,
+            "datatype": prop.datatype,
+            "format": prop.format,
+            "multiple": bool(prop.multiple),
+            "required": bool(prop.required),
+            "vocabulary": prop.vocabulary_name if is_vocabulary else None,
+            "values": vocabulary_values(prop.vocabulary_name, lang) if is_vocabulary else None,
+        })
+    return schema
+
+
+def validate_row(schema: list, row: dict):
+    """(document, errors) of a csv row: errors are "field: message" strings"""
+    document, errors = {}, []
+    for spec in schema:
+        field = spec["field"]
+        cell = row.get(field)
+        if cell is None or cell.strip() == "":
+            if spec["required"]:
+                errors.append(f"{field}: required")
+            continue
+        cells = [c for c in cell.split("|") if c.strip() != ""] if spec["multiple"] else [cell]
+        values = []
+        for c in cells:
+            try:
+                value = cast_value(c, spec["datatype"], spec["format"])
+            except (ValueError, TypeError) as e:
+                errors.append(f"{field}: {e}")
+                continue
+            if spec["values"] is not None:
+                label = spec["values"].get(value)
+                if label is None:
+                    errors.append(f"{field}: {value} is not in vocabulary {spec['vocabulary']}")
+                    continue
+                value = label
+            values.append(value)
+        if len(values) > 0:
+            document[field] = values if spec["multiple"] else values[0]
+    return document, errors
+
+
+def validate_rows(schema: list, start: int, rows: list):
+    """validate a chunk of rows: ([documents], [line of every document], [(line, row, errors)]) (run in a worker process)"""
+    documents, lines, rejected = [], [], []
+    for line, row in enumerate(rows, start):
+        document, errors = validate_row(schema, row)
+        if len(errors) > 0:
+            rejected.append((line, row, errors))
+        else:
+            documents.append(document)
+            lines.append(line)
+    return documents, lines, rejected
+
+
+# schema of the worker processes: sent once when they start rather than with every chunk
+_WORKER_SCHEMA = None
+
+
+def _init_worker(schema: list):
+    global _WORKER_SCHEMA
+    _WORKER_SCHEMA = schema
+
+
+def _validate_chunk(start: int, rows: list):
+    return validate_rows(_WORKER_SCHEMA, start, rows)
+
+
+class RecordImporter:
+    """
+    Import the records of a model from a csv file
+
+    The csv is read by chunks of `batch_size` rows. Chunks are validated in `workers` processes
+    (in this process if workers is 0) with a bounded number of chunks in flight, and the valid documents
+    of every chunk are written with one unordered insert_many. Documents of a multilang model are stored in their lang
+    (`{lang: document}`). Rejected rows, and rows of the documents refused by the database (e.g. a duplicate key),
+    are written to the error csv with their line and errors. Once the documents are written the version stamp
+    of the model is bumped (once by import): query caches and search indexes of the application are refreshed.
+
+    Attributes
+    ----------
+    model: Model
+    collection: Collection
+        default to the collection of the model
+    lang: str
+        lang of the records and of the vocabulary labels
+    workers: int
+        number of validation processes
+    batch_size: int
+        number of rows by chunk and by insert
+
+    Methods
+    -------
+    run(csv_file, error_file)
+    """
+
+    def __init__(self, model, collection=None, lang: str = "fr", workers: int = 4, batch_size: int = 1000):
+        self.model = model
+        self.collection = collection if collection is not None else DB[model.name]
+        self.lang = lang
+        self.workers = workers
+        self.batch_size = batch_size
+        self.multilang = any(prop.multilang for prop in model.properties)
+        self.schema = record_schema(model, lang)
+
+    def _chunks(self, reader):
+        chunk, start = [], 2
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) >= self.batch_size:
+                yield start, chunk
+                start += len(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            yield start, chunk
+
+    def _results(self, reader):
+        """(start, rows, validate_rows result) of the chunks in order"""
+        if self.workers == 0:
+            for start, chunk in self._chunks(reader):
+                yield (start, chunk) + validate_rows(self.schema, start, chunk)
+            return
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.schema,)) as executor:
+            pending = deque()
+            for start, chunk in self._chunks(reader):
+                pending.append((start, chunk, executor.submit(_validate_chunk, start, chunk)))
+                # bounded memory: at most 2 chunks by worker are read ahead
+                if len(pending) >= 2 * self.workers:
+                    start, chunk, future = pending.popleft()
+                    yield (start, chunk) + future.result()
+            while pending:
+                start, chunk, future = pending.popleft()
+                yield (start, chunk) + future.result()
+
+    def _insert(self, documents: list, lines: list, rows: list, start: int):
+        """insert the valid documents of a chunk: (number of inserted documents, [(line, row, errors)] refused)"""
+        if len(documents) == 0:
+            return 0, []
+        if self.multilang:
+            documents = [{self.lang: document} for document in documents]
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # unordered: every other document is inserted, the index of the errors is their rank in documents
+            refused = [
+                (lines[error["index"]], rows[lines[error["index"]] - start], [error.get("errmsg", "write error")])
+                for error in e.details.get("writeErrors", [])
+            ]
+            LOGGER.warning(f"{len(refused)} {self.model.name} records refused by the database")
+            return e.details.get("nInserted", len(documents) - len(refused)), refused
+        return len(documents), []
+
+    def run(self, csv_file: str, error_file: str = None) -> dict:
+        """import the records of a csv file: returns the numbers of rows, imported and rejected documents"""
+        started_at = time.monotonic()
+        report = {"rows": 0, "imported": 0, "rejected": 0}
+        errors_out, errors_writer = None, None
+        try:
+            with open(csv_file, "r", encoding="utf-8", newline="") as f:
+                reader = csv.DictReader(f)
+                if error_file is not None:
+                    errors_out = open(error_file, "w", encoding="utf-8", newline="")
+                    errors_writer = csv.writer(errors_out)
+                    errors_writer.writerow(["line", "errors"] + list(reader.fieldnames or []))
+                for start, rows, documents, lines, rejected in self._results(reader):
+                    imported, refused = self._insert(documents, lines, rows, start)
+                    rejected = sorted(rejected + refused, key=lambda r: r[0])
+                    for line, row, errors in rejected:
+                        if errors_writer is not None:
+                            errors_writer.writerow([line, "; ".join(errors)] + [row.get(k) for k in reader.fieldnames])
+                    report["imported"] += imported
+                    report["rejected"] += len(rejected)
+                    report["rows"] += len(rows)
+        finally:
+            if errors_out is not None:
+                errors_out.close()
+            # also after a failure: the chunks inserted before it are written
+            if report["imported"] > 0:
+                QUERIES.model_changed(self.model.name)
+        report["duration"] = time.monotonic() - started_at
+        LOGGER.info(f"{report['imported']} {self.model.name} records imported from {csv_file}, {report['rejected']} rejected")
+        return report
+
+
+def import_records(model, csv_file: str, error_file: str = None, collection=None, lang: str = "fr",
+                   workers: int = 4, batch_size: int = 1000) -> dict:
+    return RecordImporter(model, collection, lang=lang, workers=workers, batch_size=batch_size).run(csv_file, error_file)
+
+
+if __name__ == "__main__":
+    from cocat.config_model import CSVConfig
+
+    parser = argparse.ArgumentParser(description="Import the records of a model from a csv file")
+    parser.add_argument("rules", help="csv file of the rules")
+    parser.add_argument("model", help="name of the model")
+    parser.add_argument("records", help="csv file of the records")
+    parser.add_argument("--errors", help="csv file of the rejected rows")
+    parser.add_argument("--lang", default="fr")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    model = CSVConfig(args.rules).models[args.model]
+    importer = RecordImporter(model, lang=args.lang, workers=args.workers, batch_size=args.batch_size)
+    LOGGER.info(importer.run(args.records, args.errors))
@@ -9,8 +9,10 @@ from pydantic import constr
 
 
 from cocat.vocabulary import Vocabulary
+from cocat.cache import get_vocabulary
 from cocat.property import Property
 from cocat.utils import load_template
+from cocat.monitoring import MONITOR
 
 
 class Model(object):
@@ -42,18 +44,17 @@ class Model(object):
             #     if r.is_vocabulary:
             #         r.vocabulary.create()
 
-        return {
-                r.field: {
-                "labels": r.vocabulary.labels,
-                "names_fr": r.vocabulary.names_fr,
-                "names_en": r.vocabulary.names_en,
-                "uris": r.vocabulary.uris
+        vocabularies = {}
+        for r in self.properties:
+            if r.is_vocabulary:
+                vocabulary = get_vocabulary(r.vocabulary_name, self.lang)
+                vocabularies[r.field] = {
+                    "labels": vocabulary.labels,
+                    "names_fr": vocabulary.names_fr,
+                    "names_en": vocabulary.names_en,
+                    "uris": vocabulary.uris
                 }
-            
-                for r in self.properties if r.is_vocabulary
-            }
-        
-        return {}
+        return vocabularies
     
     @property
     def has_external_model(self) -> bool:
@@ -240,7 +241,8 @@ class Model(object):
         """Generate the  FastAPI model python file"""
         file = f"test-{self.model_name}-model.py"
         template = load_template("Model.tpl")
-        with open(file, "w") as f:
+        # repeated queries while building the model are reported as N+1 patterns
+        with MONITOR.scope(f"Model.write_model {self.model_name}"), open(file, "w") as f:
             py_file = template.render(
                 model_name=self.model_name,
                 model_properties=self.pydantic_model,
@@ -255,14 +257,20 @@ class Model(object):
     def write_router(self):
         file = f"test-{self.model_name}-router.py"
         template = load_template("router.tpl")
+        properties = self.properties
+        search_fields = [prop.field for prop in properties if prop.search_full_text]
+        filter_fields = [prop.field for prop in properties if prop.filter_values]
         with open(file, "w") as f:
             py_file = template.render(
                 name = self.name,
                 model_name = self.model_name,
                 # models=self.pydantic_model,
                 import_model=self.import_external_models,
-                search=self.is_searchable,
-                filter=self.has_filter,
+                search=len(search_fields) > 0,
+                filter=len(filter_fields) > 0,
+                search_fields=search_fields,
+                filter_fields=filter_fields,
+                translation_fields=[prop.field for prop in properties if prop.multilang],
             )
             f.write(py_file)
 
@@ -0,0 +1,188 @@
+"""
+Monitoring
+
+database commands by cocat call site: latency, documents, bytes and N+1 query patterns
+enabled with DB_MONITORING=1 (see cocat.db)
+"""
+
+import json
+import logging
+import functools
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import bson
+from pymongo import monitoring
+
+LOGGER = logging.getLogger(__name__)
+
+# innermost cocat call site issuing the commands e.g. Reference.add
+CALL_SITE = ContextVar("cocat_call_site", default=None)
+# unit of work whose repeated query shapes are N+1 candidates e.g. a model build or a request
+SCOPE = ContextVar("cocat_scope", default=None)
+
+# key of the command document holding the filter by command name
+FILTER_KEYS = {"find": "filter", "count": "query", "distinct": "query", "findAndModify": "query"}
+
+
+def shape(value):
+    """query with every value replaced by ?: queries differing only by their values have the same shape"""
+    if isinstance(value, dict):
+        return {key: "?" if key in ["$in", "$nin"] else shape(v) for key, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [shape(v) for v in value]
+    return "?"
+
+
+def query_shape(command: str, collection: str, filter: dict = None) -> str:
+    return f"{command} {collection} {json.dumps(shape(filter or {}), sort_keys=True)}"
+
+
+@contextmanager
+def call_site(name: str):
+    """tag the commands issued inside the block with name"""
+    token = CALL_SITE.set(name)
+    try:
+        yield
+    finally:
+        CALL_SITE.reset(token)
+
+
+def traced(name: str):
+    """decorator: tag the commands issued by a function with name (see call_site)"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with call_site(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Scope:
+    """query shapes issued inside a unit of work"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.shapes = Counter()
+        self.sites = {}
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """
+    Command listener recording every database command by (call site, command, collection)
+
+    Registered on the pymongo and motor clients and on the memory backend.
+    A query shape repeated `threshold` times or more inside a scope is flagged as a N+1 pattern.
+
+    Attributes
+    ----------
+    threshold: int
+        number of repetitions of a query shape in a scope to flag a N+1 pattern
+    commands: dict
+        {(call site, command, collection): {"count", "duration", "documents", "bytes", "failures"}}
+    n_plus_one: deque
+        last flagged N+1 patterns
+
+    Methods
+    -------
+    scope(name)
+    record(command, collection, filter, duration, documents, nbytes)
+    report()
+    reset()
+    """
+
+    def __init__(self, threshold: int = 10, history: int = 100):
+        self.threshold = threshold
+        self.commands = {}
+        self.n_plus_one = deque(maxlen=history)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def scope(self, name: str):
+        """flag the query shapes repeated inside the block"""
+        current = Scope(name)
+        token = SCOPE.set(current)
+        try:
+            yield current
+        finally:
+            SCOPE.reset(token)
+            self._flag(current)
+
+    def _flag(self, scope: Scope):
+        for query, count in scope.shapes.items():
+            if count >= self.threshold:
+                pattern = {"scope": scope.name, "site": scope.sites.get(query), "shape": query, "count": count}
+                self.n_plus_one.append(pattern)
+                LOGGER.warning(f"N+1 queries in {scope.name}: {count} x {query} from {pattern['site']}")
+
+    def _observe(self, command: str, collection: str, filter: dict = None):
+        scope = SCOPE.get()
+        if scope is not None:
+            query = query_shape(command, collection, filter)
+            scope.shapes[query] += 1
+            scope.sites.setdefault(query, CALL_SITE.get())
+
+    def _add(self, site, command: str, collection: str, duration: float, documents: int, nbytes: int, failed: bool = False):
+        with self._lock:
+            stats = self.commands.setdefault(
+                (site, command, collection),
+                {"count": 0, "duration": 0.0, "documents": 0, "bytes": 0, "failures": 0}
+            )
+            stats["count"] += 1
+            stats["duration"] += duration
+            stats["documents"] += documents
+            stats["bytes"] += nbytes
+            stats["failures"] += int(failed)
+
+    def record(self, command: str, collection: str, filter: dict, duration: float, documents: int = 0, nbytes: int = 0):
+        """record a command issued in the current call site and scope (used by the memory backend)"""
+        self._observe(command, collection, filter)
+        self._add(CALL_SITE.get(), command, collection, duration, documents, nbytes)
+
+    # pymongo listener: called in the thread issuing the command
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = None
+        filter = event.command.get(FILTER_KEYS.get(event.command_name, "filter"))
+        self._observe(event.command_name, collection, filter if isinstance(filter, dict) else None)
+        self._pending[(event.connection_id, event.request_id)] = (CALL_SITE.get(), collection)
+
+    def succeeded(self, event):
+        site, collection = self._pending.pop((event.connection_id, event.request_id), (None, None))
+        reply = event.reply
+        cursor = reply.get("cursor", {})
+        documents = len(cursor.get("firstBatch", cursor.get("nextBatch", []))) if cursor else reply.get("n", 0)
+        self._add(site, event.command_name, collection, event.duration_micros / 1e6, documents, len(bson.encode(reply)))
+
+    def failed(self, event):
+        site, collection = self._pending.pop((event.connection_id, event.request_id), (None, None))
+        self._add(site, event.command_name, collection, event.duration_micros / 1e6, 0, 0, failed=True)
+
+    def report(self) -> dict:
+        """totals and commands by call site"""
+        with self._lock:
+            commands = [
+                {"site": site, "command": command, "collection": collection, **stats}
+                for (site, command, collection), stats in self.commands.items()
+            ]
+        totals = {key: sum(c[key] for c in commands) for key in ["count", "duration", "documents", "bytes", "failures"]}
+        return {
+            "totals": totals,
+            "commands": sorted(commands, key=lambda c: c["count"], reverse=True),
+            "n_plus_one": list(self.n_plus_one),
+        }
+
+    def reset(self):
+        with self._lock:
+            self.commands.clear()
+            self.n_plus_one.clear()
+            self._pending.clear()
+
+
+MONITOR = CommandMonitor()
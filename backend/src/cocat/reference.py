@@ -5,15 +5,178 @@ Reference
 from datetime import datetime
 
 from typing import Optional, List
-from pydantic import BaseModel, validator, constr, root_validator
+from pydantic import BaseModel, validator, constr, root_validator, PrivateAttr
 import pymongo
+from pymongo import IndexModel, ASCENDING, UpdateOne, DeleteOne
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+import time
 import logging
-from cocat.db import DB, PyObjectId
-import motor.motor_asyncio
+import threading
+from collections import OrderedDict
+from cocat.monitoring import traced
+from cocat.db import DB, PyObjectId, get_version, bump_version
+from cocat.unit_of_work import current_unit_of_work
 
 LOGGER = logging.getLogger(__name__)
 # from bson.objectid import ObjectId as BsonObjectId
 
+# indexes of the reference collection: every lookup is scoped by vocabulary
+# a name is unique inside a vocabulary for each language (empty names are not indexed)
+REFERENCE_INDEXES = [
+    IndexModel([("vocabulary", ASCENDING)], name="vocabulary"),
+    IndexModel(
+        [("vocabulary", ASCENDING), ("name_fr", ASCENDING)],
+        name="vocabulary_name_fr",
+        unique=True,
+        partialFilterExpression={"name_fr": {"$gt": ""}},
+    ),
+    IndexModel(
+        [("vocabulary", ASCENDING), ("name_en", ASCENDING)],
+        name="vocabulary_name_en",
+        unique=True,
+        partialFilterExpression={"name_en": {"$gt": ""}},
+    ),
+    IndexModel([("uri", ASCENDING)], name="uri"),
+    IndexModel([("slug", ASCENDING)], name="slug"),
+]
+
+
+class ReferenceCache:
+    """
+    Bounded LRU read-through cache of the lookups of stored references
+
+    Lookups by id, by label and by lang are cached (missing references included)
+    and invalidated by Reference.add, update and delete.
+    Entries keep the version stamp of their vocabulary (`vocabulary:<name>`) read at most every `check_interval`
+    seconds: an entry loaded from a previous version (e.g. written by another process) is reloaded.
+    Missing references of a lookup without vocabulary have no stamp and expire after `negative_ttl` seconds.
+    Writes bypassing Reference and Vocabulary (e.g. delete_many) must call clear().
+
+    Attributes
+    ----------
+    maxsize: int
+        maximum number of cached lookups: the least recently used is evicted
+    check_interval: float
+        minimum delay in seconds between two reads of the version stamp of a vocabulary
+    negative_ttl: float
+        lifetime in seconds of the missing references without vocabulary
+    metrics: dict
+        number of hits, misses and stale entries of the cache
+
+    Methods
+    -------
+    get(key, loader)
+    invalidate(reference)
+    clear()
+    """
+
+    def __init__(self, maxsize: int = 10000, check_interval: float = 1.0, negative_ttl: float = 5.0):
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self.negative_ttl = negative_ttl
+        self.metrics = {"hits": 0, "misses": 0, "stale": 0}
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def version(self, vocabulary: str) -> int:
+        """version stamp of a vocabulary: read from the database at most every check_interval"""
+        now = time.monotonic()
+        cached = self._versions.get(vocabulary)
+        if cached is None or now - cached[1] >= self.check_interval:
+            cached = self._versions[vocabulary] = (get_version(f"vocabulary:{vocabulary}"), now)
+        return cached[0]
+
+    @staticmethod
+    def vocabulary(key, ref: dict) -> str:
+        """vocabulary of a lookup: scope of the label and lang lookups, else the one of the found reference"""
+        if isinstance(key, tuple) and len(key) > 2 and key[1] is not None:
+            return key[1]
+        return None if ref is None else ref.get("vocabulary")
+
+    def _fresh(self, key, entry: tuple) -> bool:
+        ref, vocabulary, version, loaded_at = entry
+        if vocabulary is not None:
+            return self.version(vocabulary) == version
+        return ref is not None or time.monotonic() - loaded_at < self.negative_ttl
+
+    def get(self, key: tuple, loader) -> dict:
+        """cached result of the lookup key or loaded with loader()"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            if self._fresh(key, entry):
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                self.metrics["hits"] += 1
+                return None if entry[0] is None else dict(entry[0])
+            self.metrics["stale"] += 1
+        self.metrics["misses"] += 1
+        # the stamp is read before the load: a write in between makes the entry stale rather than wrong
+        vocabulary = self.vocabulary(key, None)
+        version = None if vocabulary is None else self.version(vocabulary)
+        ref = loader()
+        if vocabulary is None and ref is not None:
+            vocabulary = self.vocabulary(key, ref)
+            version = self.version(vocabulary) if vocabulary is not None else None
+        with self._lock:
+            self._entries[key] = (ref, vocabulary, version, time.monotonic())
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return None if ref is None else dict(ref)
+
+    @staticmethod
+    def keys(reference: dict) -> list:
+        """lookups possibly answered by a stored reference"""
+        keys = [("id", reference.get("id") or reference.get("_id"))]
+        for vocabulary in {reference.get("vocabulary"), None}:
+            for lang in ["fr", "en"]:
+                name = reference.get(f"name_{lang}")
+                if name not in ["", None]:
+                    keys.extend([("label", vocabulary, name), ("lang", vocabulary, lang, name)])
+        return keys
+
+    def invalidate(self, reference: dict):
+        with self._lock:
+            for key in self.keys(reference):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.metrics["hits"] + self.metrics["misses"]
+        if total == 0:
+            return 0.0
+        return self.metrics["hits"] / total
+
+
+REFERENCE_CACHE = ReferenceCache()
+
+
+def to_xml(reference) -> str:
+    return f'''<{reference.field}>
+                <name>{reference.name_en}</name>
+                <description></description>
+                <update date="{reference.updated}"/>
+            </{reference.field}>
+        '''
+
+
+def iter_xml(references):
+    """stream the xml representation of references without keeping it on the references"""
+    for reference in references:
+        yield to_xml(reference)
+
 
 class Reference(BaseModel):
     """
@@ -35,10 +198,26 @@ class Reference(BaseModel):
         standard uri for the reference
     slug: Optional[str]
         shortcode for the reference
+    broader: Optional[list]
+        slugs, uris or names of the parent references (csv: separated by |)
+    narrower: Optional[list]
+        slugs, uris or names of the child references (csv: separated by |)
+
+    Properties
+    ----------
+    name: name in the lang of the reference
+    exists: the reference has a label
+    xml: xml representation computed on first access
 
     Methods
     -------
-    set_name()
+    add()
+    update()
+    delete()
+    get_by_id()
+    get_by_label()
+    get_by_lang()
+    create_indexes()
     """
 
     id: Optional[PyObjectId] = None
@@ -52,8 +231,20 @@ class Reference(BaseModel):
     lang: constr(regex="^(fr|en)$") = "fr"
     updated: str = datetime.today().strftime("%Y-%m-%d")
     standards: Optional[List] = []
+    broader: Optional[List[str]] = []
+    narrower: Optional[List[str]] = []
+    _xml: Optional[str] = PrivateAttr(default=None)
 
     
+    @validator("broader", "narrower", pre=True)
+    def split_relations(cls, value):
+        """csv declares relations as a string separated by |"""
+        if value in ["", None]:
+            return []
+        if isinstance(value, str):
+            return [v.strip() for v in value.split("|") if v.strip() != ""]
+        return value
+
     @root_validator
     def set_label(cls, values):
         if values["lang"] == "en":
@@ -64,40 +255,73 @@ class Reference(BaseModel):
         return values
 
 
-    @root_validator
-    def set_name(cls, values):
-        if values["lang"] == "en":
-            values["name"] = values["name_en"]
-        
-        else:
-            values["name"] = values["name_fr"]
-        return values
+    @property
+    def name(self) -> str:
+        """name in the lang of the reference"""
+        if self.lang == "en":
+            return self.name_en
+        return self.name_fr
 
-    @root_validator
-    def set_xml(cls, values):
-        values["xml"] = f'''<{values["field"]}>
-                <name>{values["name_en"]}</name>
-                <description></description>
-                <update date="{values["updated"]}"/>
-            </{values["field"]}>
-        '''
-        return values
+    @property
+    def exists(self) -> bool:
+        return self.label is not None
 
-    @root_validator
-    def exists(cls, values):
-        values["exists"] = values["label"] is not None
-        return values
+    @property
+    def xml(self) -> str:
+        """xml representation: built on first access"""
+        if self._xml is None:
+            self._xml = to_xml(self)
+        return self._xml
 
-    def add(self) -> bool:    
+    @classmethod
+    def create_indexes(cls) -> list:
+        """ensure the declared REFERENCE_INDEXES exist: called once at startup"""
+        return DB.reference.create_indexes(REFERENCE_INDEXES)
+
+    @traced("Reference.add")
+    def add(self, stamp: bool = True) -> bool:
+        """store the reference and bump the stamp of its vocabulary (unless stamp is False e.g. for a bulk load
+        stamped once by its caller): False if it already exists
+        """
         exists = self.get_by_label(self.name)
         if exists is not None:
             LOGGER.warning(f"<Reference(name='{self.label}'> already exists.")
             self.id = exists["_id"]
             return False
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is not None:
+            # added earlier in the same unit of work: not yet in the database
+            pending = unit_of_work.pending(self._same_names)
+            if pending is not None:
+                LOGGER.warning(f"<Reference(name='{self.label}'> already exists.")
+                self.id = pending["_id"]
+                return False
+            # inserted on flush: other duplicates are then reported by the unique indexes
+            self.id = ObjectId()
+            unit_of_work.insert({**self.__dict__, "id": None, "_id": self.id})
+            self._invalidate(unit_of_work)
+            if stamp:
+                self._touch(unit_of_work)
+            return True
         else:
-            self.id = DB.reference.insert_one(self.__dict__).inserted_id
+            try:
+                self.id = DB.reference.insert_one(self.__dict__).inserted_id
+            except DuplicateKeyError:
+                LOGGER.warning(f"<Reference(name='{self.label}'> already exists.")
+                return False
+            self._invalidate()
+            if stamp:
+                self._touch()
             return True
     
+    def _same_names(self, document: dict) -> bool:
+        """document of the vocabulary sharing a name of the reference (the keys of the unique indexes)"""
+        if document.get("vocabulary") != self.vocabulary:
+            return False
+        names = {name for name in [self.name_fr, self.name_en] if name not in [None, ""]}
+        return document.get("name_fr") in names or document.get("name_en") in names
+
+    @traced("Reference.update")
     def update(self, update_reference: dict) -> bool:
         if self.id is None:
             LOGGER.warning(
@@ -105,41 +329,94 @@ class Reference(BaseModel):
             return False
         else:
             invalid_keys = []
-            exists = self.get_by_id(self.id)
+            # the previous names are invalidated as well as the new ones
+            self._invalidate()
             for k, v in update_reference.items():
                 try:
                     setattr(self, k, v)
                 except ValueError:
                     invalid_keys.append(k)
                     pass
-            DB.reference.update_one({"_id": exists["_id"]}, {"$set": {k: v for k, v in update_reference.items() if k not in invalid_keys}})
-            return True
+            self._xml = None
+            update = {"$set": {k: v for k, v in update_reference.items() if k not in invalid_keys}}
+            unit_of_work = current_unit_of_work()
+            if unit_of_work is not None:
+                unit_of_work.add(UpdateOne({"_id": self.id}, update))
+                self._invalidate(unit_of_work)
+                self._touch(unit_of_work)
+                return True
+            # the loaded reference holds its id: no lookup before the write
+            result = DB.reference.update_one({"_id": self.id}, update)
+            self._invalidate()
+            if result.modified_count > 0:
+                self._touch()
+            return result.matched_count == 1
             
+    @traced("Reference.delete")
     def delete(self) -> bool:
+        unit_of_work = current_unit_of_work()
         exists = self.get_by_label(self.name)
-        if exists is None:
+        if exists is None and (unit_of_work is None or self.id is None):
             LOGGER.warning(f"<Reference(name='{self.name}'> doesn't exist.")
             return False
         else:
-            self.id = exists["_id"]
-            DB.reference.delete_one({"_id": self.id})
+            if exists is not None:
+                self.id = exists["_id"]
+            if unit_of_work is not None:
+                # the reference may be inserted by the same unit of work
+                unit_of_work.add(DeleteOne({"_id": self.id}))
+                self._invalidate(unit_of_work)
+                self._touch(unit_of_work)
+                return True
+            if DB.reference.delete_one({"_id": self.id}).deleted_count > 0:
+                self._touch()
+            self._invalidate()
             return True
         
+    @traced("Reference.get_by_id")
     def get_by_id(self, id) -> dict:
-        ref = DB.reference.find_one({"_id": id})
-        if ref is None:
-            return None
-        return dict(ref)
+        return REFERENCE_CACHE.get(("id", id), lambda: DB.reference.find_one({"_id": id}))
+
+    @traced("Reference.get_by_label")
+    def get_by_label(self, name, vocabulary=None) -> dict:
+        """find a reference by its name in any lang
+        scoped to the vocabulary of the reference when declared
+        """
+        if vocabulary is None:
+            vocabulary = self.vocabulary
+        if vocabulary is None:
+            query = {"$or": [{"name_fr": name}, {"name_en": name}]}
+        else:
+            # each branch is served by the (vocabulary, name_<lang>) index
+            query = {"$or": [
+                {"vocabulary": vocabulary, "name_fr": name},
+                {"vocabulary": vocabulary, "name_en": name}
+            ]}
+        return REFERENCE_CACHE.get(("label", vocabulary, name), lambda: DB.reference.find_one(query))
 
-    def get_by_label(self, name) -> dict:
-        ref = DB.reference.find_one({"$or": [{"label": name}, {"name_fr": name}, {"name_en": name}]})
-        if ref is None:
-            return None
-        return dict(ref)
 
+    @traced("Reference.get_by_lang")
+    def get_by_lang(self, name, lang=constr(regex="^(fr|en)$"), vocabulary=None) -> dict:
+        if vocabulary is None:
+            vocabulary = self.vocabulary
+        query = {f"name_{lang}": name}
+        if vocabulary is not None:
+            query = {"vocabulary": vocabulary, **query}
+        return REFERENCE_CACHE.get(("lang", vocabulary, lang, name), lambda: DB.reference.find_one(query))
 
-    def get_by_lang(self, name, lang=constr(regex="^(fr|en)$")) -> dict:
-        ref = DB.reference.find_one({f"name_{lang}": name})
-        if ref is None:
+    def _touch(self, unit_of_work=None):
+        """bump the version stamp of the vocabulary of the reference: now or on flush of the unit of work
+        caches of the other processes (vocabularies, references, resolver) then reload it
+        """
+        if self.vocabulary in [None, ""]:
             return None
-        return dict(ref)
+        key = f"vocabulary:{self.vocabulary}"
+        if unit_of_work is not None:
+            return unit_of_work.touch(key)
+        return bump_version(key)
+
+    def _invalidate(self, unit_of_work=None):
+        """drop the cached lookups of the reference: again after the flush of a unit of work"""
+        REFERENCE_CACHE.invalidate(self.__dict__)
+        if unit_of_work is not None:
+            unit_of_work.after_flush(lambda reference=dict(self.__dict__): REFERENCE_CACHE.invalidate(reference))
@@ -0,0 +1,343 @@
+"""
+Reindex
+
+rebuild a search index from a new mapping (index_mapping of a model) without downtime:
+a versioned index is filled in parallel batches and the read alias is switched atomically
+
+    python -m cocat.reindex rules.csv dataset --workers 4 --batch-size 500
+"""
+
+import os
+import re
+import time
+import logging
+import argparse
+import datetime
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+LOGGER = logging.getLogger(__name__)
+
+# index field type of the datatypes of the filter properties
+FIELD_TYPES = {
+    "string": "keyword", "integer": "long", "float": "double", "number": "double",
+    "boolean": "boolean", "date": "date", "datetime": "date", "object": "object",
+}
+# analyzer of the full text search fields by lang
+ANALYZERS = {"fr": "french", "en": "english"}
+
+
+def index_mapping(model) -> dict:
+    """index mapping of the full text search (text) and filter fields of the properties of a model
+    {lang: mapping} for a multilang model, None if the model has no search or filter field
+    """
+    properties = [prop for prop in model.properties if prop.search_full_text or prop.filter_values]
+    if len(properties) == 0:
+        return None
+
+    def mapping(lang: str) -> dict:
+        fields = {}
+        for prop in properties:
+            field = {"type": FIELD_TYPES.get(prop.datatype, "keyword")}
+            if prop.search_full_text:
+                field = {"type": "text", "analyzer": ANALYZERS.get(lang, "standard")}
+                if prop.filter_values:
+                    field["fields"] = {"keyword": {"type": "keyword"}}
+            fields[prop.field] = field
+        return {"properties": fields}
+
+    if any(prop.multilang for prop in model.properties):
+        return {lang: mapping(lang) for lang in ANALYZERS}
+    return mapping(model.lang)
+
+
+class LocalCluster:
+    """
+    In memory stand-in of a search cluster: the index and alias operations used by Reindexer
+
+    Methods
+    -------
+    create_index(index, mapping)
+    delete_index(index)
+    exists(index)
+    get_alias(alias)
+    update_aliases(actions)
+    bulk(index, documents)
+    delete(index, ids)
+    count(index)
+    get(index, doc_id)
+    """
+
+    def __init__(self):
+        self.indices = {}
+        self.mappings = {}
+        self.aliases = {}
+        self._lock = threading.Lock()
+
+    def create_index(self, index: str, mapping: dict):
+        with self._lock:
+            if index in self.indices:
+                raise ValueError(f"Reindex Error. Index {index} already exists.")
+            self.indices[index] = {}
+            self.mappings[index] = mapping
+
+    def delete_index(self, index: str):
+        with self._lock:
+            self.indices.pop(index, None)
+            self.mappings.pop(index, None)
+            for alias in list(self.aliases):
+                self.aliases[alias].discard(index)
+                if len(self.aliases[alias]) == 0:
+                    del self.aliases[alias]
+
+    def exists(self, index: str) -> bool:
+        return index in self.indices
+
+    def get_alias(self, alias: str) -> set:
+        """indices of an alias"""
+        return set(self.aliases.get(alias, set()))
+
+    def update_aliases(self, actions: list):
+        """apply add and remove actions at once: readers see the old or the new indices, never none"""
+        with self._lock:
+            aliases = {alias: set(indices) for alias, indices in self.aliases.items()}
+            for action in actions:
+                (operation, target), = action.items()
+                if target["index"] not in self.indices:
+                    raise ValueError(f"Reindex Error. Index {target['index']} doesn't exist.")
+                if operation == "add":
+                    aliases.setdefault(target["alias"], set()).add(target["index"])
+                elif operation == "remove":
+                    aliases.get(target["alias"], set()).discard(target["index"])
+            self.aliases = {alias: indices for alias, indices in aliases.items() if len(indices) > 0}
+
+    def _resolve(self, index: str) -> str:
+        indices = self.aliases.get(index, {index})
+        if len(indices) != 1:
+            raise ValueError(f"Reindex Error. {index} points to {len(indices)} indices.")
+        return next(iter(indices))
+
+    def bulk(self, index: str, documents: list) -> int:
+        """index (id, document) pairs"""
+        target = self.indices[self._resolve(index)]
+        with self._lock:
+            for doc_id, document in documents:
+                target[str(doc_id)] = document
+        return len(documents)
+
+    def delete(self, index: str, ids: list) -> int:
+        target = self.indices[self._resolve(index)]
+        with self._lock:
+            return sum(target.pop(str(doc_id), None) is not None for doc_id in ids)
+
+    def count(self, index: str) -> int:
+        return len(self.indices[self._resolve(index)])
+
+    def get(self, index: str, doc_id) -> dict:
+        return self.indices[self._resolve(index)].get(str(doc_id))
+
+
+class ElasticsearchCluster:
+    """
+    Elasticsearch implementation of the operations of LocalCluster (elasticsearch client required)
+    """
+
+    def __init__(self, uri: str = None):
+        from elasticsearch import Elasticsearch, helpers
+        self.client = Elasticsearch(uri or os.getenv("ES_URI"))
+        self._helpers = helpers
+
+    def create_index(self, index: str, mapping: dict):
+        self.client.indices.create(index=index, mappings=mapping)
+
+    def delete_index(self, index: str):
+        self.client.indices.delete(index=index, ignore_unavailable=True)
+
+    def exists(self, index: str) -> bool:
+        return bool(self.client.indices.exists(index=index))
+
+    def get_alias(self, alias: str) -> set:
+        if not self.client.indices.exists_alias(name=alias):
+            return set()
+        return set(self.client.indices.get_alias(name=alias))
+
+    def update_aliases(self, actions: list):
+        self.client.indices.update_aliases(actions=actions)
+
+    def bulk(self, index: str, documents: list) -> int:
+        success, _ = self._helpers.bulk(
+            self.client,
+            ({"_index": index, "_id": str(doc_id), "_source": document} for doc_id, document in documents),
+        )
+        return success
+
+    def delete(self, index: str, ids: list) -> int:
+        success, _ = self._helpers.bulk(
+            self.client,
+            ({"_op_type": "delete", "_index": index, "_id": str(doc_id)} for doc_id in ids),
+            raise_on_error=False,
+        )
+        return success
+
+    def count(self, index: str) -> int:
+        self.client.indices.refresh(index=index)
+        return self.client.count(index=index)["count"]
+
+    def get(self, index: str, doc_id) -> dict:
+        return self.client.get(index=index, id=str(doc_id))["_source"]
+
+
+def batches(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+class Reindexer:
+    """
+    Zero downtime reindex behind a read alias
+
+    The documents are copied into a new index `<alias>_v<version>` created with the new mapping,
+    in batches sent in parallel with at most 2 batches by worker in flight. Once every document is indexed
+    the alias is switched from the previous indices to the new one in a single update
+    and the previous indices are dropped. On failure the new index is dropped and the alias is left untouched.
+
+    Writes to the source during the copy are not seen by the copy: either the source is quiesced
+    or `changes(since)` gives the (id, document) pairs written since the copy started (document None if deleted),
+    replayed into the new index before the switch. Writes between the replay and the switch are still lost.
+
+    Attributes
+    ----------
+    cluster: LocalCluster or ElasticsearchCluster
+    alias: str
+        read alias of the index e.g. the name of the model
+    workers: int
+        number of batches sent in parallel
+    batch_size: int
+        number of documents by bulk request
+
+    Methods
+    -------
+    run(mapping, documents, transform=None, changes=None)
+    """
+
+    def __init__(self, cluster, alias: str, workers: int = 4, batch_size: int = 500):
+        self.cluster = cluster
+        self.alias = alias
+        self.workers = workers
+        self.batch_size = batch_size
+
+    def version(self, index: str) -> int:
+        found = re.fullmatch(rf"{re.escape(self.alias)}_v(\d+)", index)
+        return int(found.group(1)) if found else 0
+
+    def next_index(self) -> str:
+        version = max([self.version(index) for index in self.cluster.get_alias(self.alias)] + [0]) + 1
+        while self.cluster.exists(f"{self.alias}_v{version}"):
+            version += 1
+        return f"{self.alias}_v{version}"
+
+    def copy(self, index: str, documents) -> int:
+        """bulk (id, document) pairs into index: returns the number of documents indexed"""
+        indexed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for batch in batches(documents, self.batch_size):
+                pending.append(executor.submit(self.cluster.bulk, index, batch))
+                # bounded memory: at most 2 batches by worker are read ahead
+                if len(pending) >= 2 * self.workers:
+                    indexed += pending.popleft().result()
+            while pending:
+                indexed += pending.popleft().result()
+        return indexed
+
+    def replay(self, index: str, changes, transform=None) -> int:
+        """apply (id, document) changes to index (document None if deleted): returns the number of changes"""
+        replayed = 0
+        for batch in batches(changes, self.batch_size):
+            deleted = [doc_id for doc_id, document in batch if document is None]
+            written = [
+                (doc_id, document if transform is None else transform(document))
+                for doc_id, document in batch if document is not None
+            ]
+            if len(written) > 0:
+                self.cluster.bulk(index, written)
+            if len(deleted) > 0:
+                self.cluster.delete(index, deleted)
+            replayed += len(batch)
+        return replayed
+
+    def run(self, mapping: dict, documents, transform=None, changes=None) -> dict:
+        """copy (id, document) pairs into a new index with mapping and switch the alias on it"""
+        started_at = time.monotonic()
+        copy_started = datetime.datetime.utcnow()
+        previous = self.cluster.get_alias(self.alias)
+        index = self.next_index()
+        self.cluster.create_index(index, mapping)
+        LOGGER.info(f"Reindexing {self.alias} into {index}")
+        replayed = 0
+        try:
+            if transform is not None:
+                documents = ((doc_id, transform(document)) for doc_id, document in documents)
+            indexed = self.copy(index, documents)
+            if self.cluster.count(index) != indexed:
+                raise ValueError(f"Reindex Error. {indexed} documents sent but {self.cluster.count(index)} indexed.")
+            if changes is not None:
+                replayed = self.replay(index, changes(copy_started), transform)
+            self.cluster.update_aliases(
+                [{"remove": {"index": old, "alias": self.alias}} for old in previous]
+                + [{"add": {"index": index, "alias": self.alias}}]
+            )
+        except Exception:
+            LOGGER.error(f"Reindexing {self.alias} failed: {index} is dropped, {self.alias} is unchanged")
+            self.cluster.delete_index(index)
+            raise
+        for old in previous:
+            self.cluster.delete_index(old)
+        report = {
+            "alias": self.alias, "index": index, "previous": sorted(previous),
+            "documents": indexed, "replayed": replayed, "duration": time.monotonic() - started_at,
+        }
+        LOGGER.info(f"{self.alias} now reads {index}: {indexed} documents, {replayed} changes replayed")
+        return report
+
+
+def reindex_model(model, cluster, collection, workers: int = 4, batch_size: int = 500, changes=None) -> list:
+    """reindex the documents of a model collection with its index_mapping: one alias by lang for a multilang model
+    the collection must be quiesced during the reindex unless changes(since) is given (see Reindexer)
+    """
+    mapping = index_mapping(model)
+    if mapping is None:
+        raise ValueError(f"Reindex Error. Model {model.name} has no search or filter field.")
+    documents = lambda: ((doc["_id"], {k: v for k, v in doc.items() if k != "_id"}) for doc in collection.find({}))
+    if "properties" in mapping:
+        return [Reindexer(cluster, model.name, workers, batch_size).run(mapping, documents(), changes=changes)]
+    return [
+        Reindexer(cluster, f"{model.name}_{lang}", workers, batch_size).run(
+            lang_mapping, documents(), transform=lambda document, lang=lang: document.get(lang, document), changes=changes
+        )
+        for lang, lang_mapping in mapping.items()
+    ]
+
+
+if __name__ == "__main__":
+    from cocat.db import DB
+    from cocat.config_model import CSVConfig
+
+    parser = argparse.ArgumentParser(description="Rebuild the search index of a model without downtime")
+    parser.add_argument("rules", help="csv file of the rules")
+    parser.add_argument("model", help="name of the model")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--local", action="store_true", help="dry run on an in memory cluster")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    model = CSVConfig(args.rules).models[args.model]
+    cluster = LocalCluster() if args.local else ElasticsearchCluster()
+    for report in reindex_model(model, cluster, DB[args.model], args.workers, args.batch_size):
+        LOGGER.info(report)
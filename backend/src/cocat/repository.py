@@ -0,0 +1,171 @@
+"""
+Repository
+
+asynchronous access to references and vocabularies (motor) for the generated app
+"""
+
+import logging
+from typing import List
+
+from pymongo import ReturnDocument, InsertOne
+from pymongo.errors import BulkWriteError
+
+from cocat.reference import Reference, REFERENCE_INDEXES, REFERENCE_CACHE
+from cocat.vocabulary import Vocabulary
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ReferenceRepository:
+    """
+    Asynchronous CRUD on the reference collection
+
+    Queries are the ones of Reference and use the REFERENCE_INDEXES
+
+    Methods
+    -------
+    create_indexes()
+    find(vocabulary)
+    find_one(name, vocabulary)
+    get_by_id(id)
+    add_many(references)
+    update(id, update_reference)
+    delete(id)
+    delete_many(vocabulary)
+    """
+
+    def __init__(self, db):
+        self.collection = db.reference
+
+    async def create_indexes(self) -> list:
+        return await self.collection.create_indexes(REFERENCE_INDEXES)
+
+    async def find(self, vocabulary: str, lang: str = "fr") -> List[Reference]:
+        return [
+            Reference(**{**r, "id": r["_id"], "lang": lang})
+            async for r in self.collection.find({"vocabulary": vocabulary})
+        ]
+
+    async def find_one(self, name: str, vocabulary: str = None) -> Reference:
+        if vocabulary is None:
+            query = {"$or": [{"name_fr": name}, {"name_en": name}]}
+        else:
+            query = {"$or": [
+                {"vocabulary": vocabulary, "name_fr": name},
+                {"vocabulary": vocabulary, "name_en": name}
+            ]}
+        r = await self.collection.find_one(query)
+        if r is None:
+            return None
+        return Reference(**{**r, "id": r["_id"]})
+
+    async def get_by_id(self, id) -> Reference:
+        r = await self.collection.find_one({"_id": id})
+        if r is None:
+            return None
+        return Reference(**{**r, "id": r["_id"]})
+
+    async def add_many(self, references: List[Reference]) -> int:
+        """insert references in one unordered bulk: existing references are skipped
+        returns the number of references inserted
+        """
+        if len(references) == 0:
+            return 0
+        requests = [InsertOne(r.dict(exclude={"id"})) for r in references]
+        try:
+            result = await self.collection.bulk_write(requests, ordered=False)
+            return result.inserted_count
+        except BulkWriteError as e:
+            LOGGER.warning(f"{len(e.details['writeErrors'])} references already exist.")
+            return e.details["nInserted"]
+
+    async def update(self, id, update_reference: dict) -> bool:
+        result = await self.collection.update_one({"_id": id}, {"$set": update_reference})
+        return result.matched_count == 1
+
+    async def delete(self, id) -> bool:
+        result = await self.collection.delete_one({"_id": id})
+        return result.deleted_count == 1
+
+    async def delete_many(self, vocabulary: str) -> int:
+        result = await self.collection.delete_many({"vocabulary": vocabulary})
+        return result.deleted_count
+
+
+class VocabularyRepository:
+    """
+    Asynchronous access to vocabularies
+
+    Every write bumps the version stamp of the vocabulary (see cocat.cache.VocabularyCache)
+
+    Methods
+    -------
+    get(name, lang)
+    names()
+    version(name)
+    add_references(name, references)
+    update_reference(name, label, update_reference)
+    delete_reference(name, label)
+    delete(name)
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.references = ReferenceRepository(db)
+
+    async def get(self, name: str, lang: str = "fr") -> Vocabulary:
+        """vocabulary with its references or None if the vocabulary is empty"""
+        references = await self.references.find(name, lang)
+        if len(references) == 0:
+            return None
+        return Vocabulary(name=name, lang=lang, references=references)
+
+    async def names(self) -> list:
+        return await self.db.reference.distinct("vocabulary")
+
+    async def version(self, name: str) -> int:
+        """version stamp of a vocabulary: 0 if never stamped"""
+        stamp = await self.db.version.find_one({"_id": f"vocabulary:{name}"}, {"version": 1})
+        if stamp is None:
+            return 0
+        return stamp["version"]
+
+    async def add_references(self, name: str, references: List[dict]) -> int:
+        inserted = await self.references.add_many(
+            [Reference(**{**r, "vocabulary": name}) for r in references]
+        )
+        if inserted > 0:
+            await self.bump_version(name)
+        return inserted
+
+    async def update_reference(self, name: str, label: str, update_reference: dict) -> bool:
+        r = await self.references.find_one(label, name)
+        if r is None:
+            return False
+        await self.references.update(r.id, update_reference)
+        await self.bump_version(name)
+        return True
+
+    async def delete_reference(self, name: str, label: str) -> bool:
+        r = await self.references.find_one(label, name)
+        if r is None:
+            return False
+        await self.references.delete(r.id)
+        await self.bump_version(name)
+        return True
+
+    async def delete(self, name: str) -> int:
+        deleted = await self.references.delete_many(name)
+        await self.bump_version(name)
+        return deleted
+
+    async def bump_version(self, name: str) -> int:
+        # every write of the vocabulary bumps its stamp: the cached lookups are dropped as well
+        REFERENCE_CACHE.clear()
+        stamp = await self.db.version.find_one_and_update(
+            {"_id": f"vocabulary:{name}"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return stamp["version"]
@@ -0,0 +1,155 @@
+"""
+Resolver
+
+reverse lookup of external URIs and standard labels (DCAT, INSPIRE) across vocabularies
+"""
+
+import time
+import logging
+import threading
+
+from cocat.db import DB
+from cocat.reference import Reference
+
+LOGGER = logging.getLogger(__name__)
+
+# keys of a stored reference kept by the resolver
+KEYS = ["vocabulary", "field", "name_fr", "name_en", "uri", "slug", "updated", "standards"]
+
+
+def standard_values(standards) -> list:
+    """string values of the standards of a reference: labels or uris given as strings or dicts"""
+    values = []
+    for standard in standards or []:
+        if isinstance(standard, dict):
+            values.extend(v for v in standard.values() if isinstance(v, str))
+        elif isinstance(standard, str):
+            values.append(standard)
+    return [v for v in values if v != ""]
+
+
+class URIResolver:
+    """
+    Reverse index from uri and standard labels to the references of every vocabulary
+
+    The index is built with a single query on first use.
+    Every `check_interval` seconds the version stamps of the vocabularies are read in a single query
+    and only the vocabularies whose stamp has changed are reloaded.
+    With `check_interval` set to None the index is never checked.
+
+    Attributes
+    ----------
+    check_interval: float
+        minimum delay in seconds between two checks of the version stamps
+    labels: dict
+        vocabularies by xml label (`vocab` and `inspire` of the rules) to narrow a lookup
+
+    Methods
+    -------
+    resolve(value, label=None, lang="fr")
+    register_rules(rules)
+    invalidate()
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self.labels = {}
+        self._index = None
+        self._versions = {}
+        # indexed values by vocabulary: a reload drops only the values of the vocabulary
+        self._values = {}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def index(self) -> dict:
+        """{uri or standard: {vocabulary: stored reference}}"""
+        if self._index is None:
+            self._build()
+        elif self.check_interval is not None and time.monotonic() - self._checked_at >= self.check_interval:
+            self._refresh()
+        return self._index
+
+    def register_rules(self, rules) -> dict:
+        """map the xml labels of the rules with a reference table to their vocabulary"""
+        for rule in rules:
+            if rule.reference_table is None:
+                continue
+            for label in (rule.vocab, rule.inspire):
+                if label is not None:
+                    self.labels.setdefault(label, set()).add(rule.reference_table)
+        return self.labels
+
+    def resolve(self, value: str, label: str = None, lang: str = "fr") -> tuple:
+        """find the reference of an uri or a standard label in constant time: returns (vocabulary, Reference) or None
+        label (a DCAT or INSPIRE xml label of a rule) narrows the lookup to the vocabulary of the rule
+        """
+        matches = self.index.get(value)
+        if not matches:
+            return None
+        if label is not None:
+            names = self.labels.get(label, set())
+            matches = {name: r for name, r in matches.items() if name in names}
+            if not matches:
+                return None
+        name = next(iter(matches))
+        if len(matches) > 1:
+            LOGGER.warning(f"{value} is declared by the vocabularies {sorted(matches)}: {name} is used.")
+        return (name, Reference(**matches[name], lang=lang))
+
+    def invalidate(self):
+        """drop the index: rebuilt on next use"""
+        with self._lock:
+            self._index = None
+
+    def _stamps(self) -> dict:
+        return {
+            stamp["_id"].split(":", 1)[1]: stamp["version"]
+            for stamp in DB.version.find({"_id": {"$regex": "^vocabulary:"}})
+        }
+
+    def _add(self, index, values, r: dict):
+        reference = {key: r[key] for key in KEYS if r.get(key) is not None}
+        reference["id"] = r.get("_id")
+        for value in [r.get("uri")] + standard_values(r.get("standards")):
+            if value not in ["", None]:
+                index.setdefault(value, {})[r["vocabulary"]] = reference
+                values.setdefault(r["vocabulary"], set()).add(value)
+
+    def _build(self):
+        with self._lock:
+            # the stamps are read before the references: a write in between triggers a reload on next check
+            versions = self._stamps()
+            index, values = {}, {}
+            for r in DB.reference.find({}, {key: 1 for key in KEYS}):
+                self._add(index, values, r)
+            self._index, self._values = index, values
+            self._versions, self._checked_at = versions, time.monotonic()
+        LOGGER.debug(f"<URIResolver> {len(index)} uris and standards loaded")
+
+    def _refresh(self):
+        with self._lock:
+            versions = self._stamps()
+            changed = [name for name in set(versions) | set(self._versions) if versions.get(name) != self._versions.get(name)]
+            if len(changed) > 0:
+                for name in changed:
+                    for value in self._values.pop(name, set()):
+                        matches = self._index[value]
+                        matches.pop(name, None)
+                        if not matches:
+                            del self._index[value]
+                for r in DB.reference.find({"vocabulary": {"$in": changed}}, {key: 1 for key in KEYS}):
+                    self._add(self._index, self._values, r)
+                LOGGER.debug(f"<URIResolver> vocabularies {sorted(changed)} reloaded")
+            self._versions, self._checked_at = versions, time.monotonic()
+
+
+RESOLVER = URIResolver()
+
+
+def resolve_uri(value: str, label: str = None, lang: str = "fr") -> tuple:
+    """find (vocabulary, Reference) of an uri or a standard label with the process local resolver"""
+    return RESOLVER.resolve(value, label, lang)
@@ -13,7 +13,7 @@ import logging
 from typing import Optional
 from pydantic import BaseModel, validator
 
-from cocat.vocabulary import Vocabulary
+from cocat.cache import get_vocabulary
 from cocat.model import Model
 from cocat.db import DB
 
@@ -319,8 +319,8 @@ class Rule(BaseModel):
     @property
     def reference(self) -> object:
         if self.is_reference:
-            v = Vocabulary(name=self.reference_table)
-            
+            v = get_vocabulary(self.reference_table)
+
             if len(v.labels) == 0:
                 LOGGER.warning(f"<Rule(field='{self.field}'> is a reference to an empty Vocabulary.")
             return v
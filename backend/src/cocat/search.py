@@ -0,0 +1,219 @@
+"""
+Search
+
+embedded full text engine over the full text search fields of a model (Property.search_full_text): used when no Elasticsearch is set
+"""
+
+import os
+import re
+import json
+import zlib
+import math
+import heapq
+import logging
+import threading
+from collections import Counter
+
+from cocat.utils import normalize
+
+LOGGER = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# stop words of the std_french and std_english analyzers (see Rule.get_index_property), accents folded
+STOPWORDS = {
+    "fr": set("""
+        a afin ai au aux avec c ce ces cet cette d dans de des du elle en et etc il ils j l la le les leur leurs lui
+        m ma mais me mes n ne ni nos notre nous on ou par pas pour qu que qui s sa se ses si son sur t ta te tes
+        un une vos votre vous y est sont ete etre
+    """.split()),
+    "en": set("""
+        a an and are as at be been but by for from has have if in into is it its not of on or s such that the
+        their then there these they this to was were will with
+    """.split()),
+}
+
+
+def stem(word: str, lang: str) -> str:
+    """light stemming: plural forms"""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if lang == "fr":
+        if word.endswith("aux") and len(word) > 4:
+            return word[:-3] + "al"
+        if word[-1] in "sx":
+            return word[:-1]
+        return word
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("sses"):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and not word.endswith("us"):
+        return word[:-1]
+    return word
+
+
+def analyze(text: str, lang: str = "fr") -> list:
+    """terms of a text: case and accents folded, split on non word characters (elisions as l' and d' included),
+    stop words removed, plural forms stemmed
+    """
+    if text is None:
+        return []
+    stopwords = STOPWORDS.get(lang, set())
+    return [stem(word, lang) for word in re.findall(r"\w+", normalize(text)) if word not in stopwords]
+
+
+def document_text(value) -> str:
+    """text of a field value: strings, lists and dicts of strings are joined"""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return " ".join(document_text(v) for v in value.values())
+    if isinstance(value, (list, tuple, set)):
+        return " ".join(document_text(v) for v in value)
+    return str(value)
+
+
+class SearchIndex:
+    """
+    Inverted index with BM25 scoring over the search fields of a model
+
+    Documents are added, replaced and removed one by one: only the postings of their terms change.
+    A field weight repeats the terms of the field (e.g. {"title": 2, "description": 1}).
+
+    Attributes
+    ----------
+    fields: dict
+        weight by indexed field
+    lang: str
+        analyzer: fr (std_french) or en (std_english)
+    k1: float
+        BM25 term frequency saturation
+    b: float
+        BM25 length normalization
+
+    Methods
+    -------
+    add(doc_id, document)
+    remove(doc_id)
+    search(query, k)
+    save(filename)
+    load(filename)
+    from_model(model, lang)
+    """
+
+    def __init__(self, fields, lang: str = "fr", k1: float = 1.2, b: float = 0.75):
+        if not isinstance(fields, dict):
+            fields = {field: 1 for field in fields}
+        self.fields = fields
+        self.lang = lang
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._lengths = {}
+        self._terms = {}
+        self._total_length = 0
+        # BM25 length normalization by document: computed on first search after a write
+        self._norms = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_model(cls, model, lang: str = None) -> "SearchIndex":
+        """index of the full text search fields of the properties of a model in lang (default to the lang of the model)"""
+        return cls([prop.field for prop in model.properties if prop.search_full_text], lang or model.lang)
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __contains__(self, doc_id):
+        return str(doc_id) in self._lengths
+
+    def analyze(self, document: dict) -> Counter:
+        terms = Counter()
+        for field, weight in self.fields.items():
+            for term in analyze(document_text(document.get(field)), self.lang):
+                terms[term] += weight
+        return terms
+
+    def add(self, doc_id, document: dict):
+        """index a document or replace its previous version"""
+        doc_id = str(doc_id)
+        terms = self.analyze(document)
+        with self._lock:
+            self._remove(doc_id)
+            for term, frequency in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = frequency
+            self._terms[doc_id] = list(terms)
+            self._lengths[doc_id] = sum(terms.values())
+            self._total_length += self._lengths[doc_id]
+            self._norms = None
+
+    def remove(self, doc_id) -> bool:
+        with self._lock:
+            return self._remove(str(doc_id))
+
+    def _remove(self, doc_id: str) -> bool:
+        if doc_id not in self._lengths:
+            return False
+        for term in self._terms.pop(doc_id, []):
+            postings = self._postings[term]
+            del postings[doc_id]
+            if len(postings) == 0:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id)
+        self._norms = None
+        return True
+
+    def search(self, query: str, k: int = 10) -> list:
+        """top k (doc_id, score) matching any term of the query by decreasing BM25 score"""
+        terms = set(analyze(query, self.lang))
+        size = len(self._lengths)
+        if size == 0 or len(terms) == 0:
+            return []
+        norms = self._norms
+        if norms is None:
+            average_length = self._total_length / size or 1.0
+            k1, b = self.k1, self.b
+            norms = self._norms = {
+                doc_id: k1 * (1 - b + b * length / average_length) for doc_id, length in self._lengths.items()
+            }
+        scores = Counter()
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            weight = math.log(1 + (size - len(postings) + 0.5) / (len(postings) + 0.5)) * (self.k1 + 1)
+            for doc_id, frequency in postings.items():
+                scores[doc_id] += weight * frequency / (frequency + norms[doc_id])
+        return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], item[0]))
+
+    def save(self, filename: str):
+        """write the index in a compressed file: replaced atomically"""
+        payload = {
+            "version": FORMAT_VERSION, "fields": self.fields, "lang": self.lang, "k1": self.k1, "b": self.b,
+            "postings": self._postings, "lengths": self._lengths,
+        }
+        data = zlib.compress(json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+        with open(f"{filename}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{filename}.tmp", filename)
+        LOGGER.info(f"<SearchIndex(lang='{self.lang}')> {len(self)} documents saved to {filename}")
+
+    @classmethod
+    def load(cls, filename: str) -> "SearchIndex":
+        with open(filename, "rb") as f:
+            payload = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+        if payload["version"] != FORMAT_VERSION:
+            raise ValueError(f"Search Error. Unsupported index version {payload['version']}.")
+        index = cls(payload["fields"], payload["lang"], payload["k1"], payload["b"])
+        index._postings = payload["postings"]
+        index._lengths = payload["lengths"]
+        index._total_length = sum(index._lengths.values())
+        terms = {doc_id: [] for doc_id in index._lengths}
+        for term, postings in index._postings.items():
+            for doc_id in postings:
+                terms[doc_id].append(term)
+        index._terms = terms
+        return index
@@ -0,0 +1,133 @@
+"""
+Snapshot
+
+compact binary snapshot of all the vocabularies to boot without the database
+
+    python -m cocat.snapshot export vocabularies.snapshot
+    python -m cocat.snapshot import vocabularies.snapshot
+
+Layout: MAGIC | format version (1 byte) | sha256 of the payload (32 bytes) | payload
+the payload is zlib compressed json, columnar: one list of values per reference key and vocabulary
+the id column holds the stored _id of the references (as a string for an ObjectId)
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import zlib
+
+from bson import ObjectId
+
+from cocat.db import DB, bump_version
+from cocat.reference import REFERENCE_CACHE
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"COCATSNAP"
+FORMAT_VERSION = 1
+COLUMNS = ["id", "field", "lang", "name_fr", "name_en", "uri", "slug", "updated", "standards", "broader", "narrower"]
+
+
+def column_value(reference: dict, key: str):
+    """value of a reference in a snapshot column: the id is the stored _id"""
+    if key == "id":
+        id = reference.get("_id") or reference.get("id")
+        return str(id) if isinstance(id, ObjectId) else id
+    return reference.get(key)
+
+
+def stored_reference(reference: dict) -> dict:
+    """document of a snapshot reference with its original _id (a new one if the snapshot has none)"""
+    document = {k: v for k, v in reference.items() if k != "id"}
+    id = reference.get("id")
+    document["_id"] = ObjectId(id) if isinstance(id, str) and ObjectId.is_valid(id) else (id or ObjectId())
+    document["id"] = None
+    document.setdefault("lang", "fr")
+    return document
+
+
+def encode_snapshot(vocabularies: dict) -> bytes:
+    """vocabularies: {name: {"version": int, "references": [dict]}}"""
+    payload = {
+        name: {
+            "version": vocabulary["version"],
+            "columns": {
+                key: [column_value(r, key) for r in vocabulary["references"]]
+                for key in COLUMNS
+            }
+        }
+        for name, vocabulary in vocabularies.items()
+    }
+    data = zlib.compress(json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 9)
+    return MAGIC + bytes([FORMAT_VERSION]) + hashlib.sha256(data).digest() + data
+
+
+def decode_snapshot(raw: bytes) -> dict:
+    """inverse of encode_snapshot: raise a ValueError if the snapshot is not valid"""
+    if not raw.startswith(MAGIC):
+        raise ValueError("Snapshot Error. Not a vocabulary snapshot.")
+    header = len(MAGIC)
+    if raw[header] != FORMAT_VERSION:
+        raise ValueError(f"Snapshot Error. Unsupported format version {raw[header]}.")
+    checksum, data = raw[header + 1:header + 33], raw[header + 33:]
+    if hashlib.sha256(data).digest() != checksum:
+        raise ValueError("Snapshot Error. Checksum mismatch: snapshot is corrupted.")
+    payload = json.loads(zlib.decompress(data).decode("utf-8"))
+    vocabularies = {}
+    for name, vocabulary in payload.items():
+        columns = vocabulary["columns"]
+        size = len(next(iter(columns.values()), []))
+        # snapshots written before a column was added do not hold it
+        columns = {key: columns.get(key, [None] * size) for key in COLUMNS}
+        references = [
+            {"vocabulary": name, **{key: value for key, value in zip(COLUMNS, row) if value is not None}}
+            for row in zip(*[columns[key] for key in COLUMNS])
+        ]
+        vocabularies[name] = {"version": vocabulary["version"], "references": references}
+    return vocabularies
+
+
+def dump_snapshot(filename: str) -> dict:
+    """write every stored vocabulary into a snapshot file: 2 queries whatever the number of vocabularies"""
+    vocabularies = {}
+    for r in DB.reference.find({}, {key: 1 for key in ["vocabulary"] + COLUMNS if key != "id"}):
+        vocabularies.setdefault(r["vocabulary"], {"version": 0, "references": []})["references"].append(r)
+    for stamp in DB.version.find({"_id": {"$in": [f"vocabulary:{name}" for name in vocabularies]}}):
+        vocabularies[stamp["_id"].split(":", 1)[1]]["version"] = stamp["version"]
+    with open(filename, "wb") as f:
+        f.write(encode_snapshot(vocabularies))
+    LOGGER.info(f"{len(vocabularies)} vocabularies exported to {filename}")
+    return vocabularies
+
+
+def load_snapshot(filename: str) -> dict:
+    with open(filename, "rb") as f:
+        return decode_snapshot(f.read())
+
+
+def restore_snapshot(filename: str) -> dict:
+    """replace the stored vocabularies of the snapshot by their content in the snapshot
+    the references keep their _id and lang: documents referring to them by id are still valid
+    the stamps of the vocabularies are bumped (never set back to the version of the snapshot): caches of other processes reload
+    """
+    vocabularies = load_snapshot(filename)
+    for name, vocabulary in vocabularies.items():
+        DB.reference.delete_many({"vocabulary": name})
+        if len(vocabulary["references"]) > 0:
+            DB.reference.insert_many([stored_reference(r) for r in vocabulary["references"]])
+        bump_version(f"vocabulary:{name}")
+    REFERENCE_CACHE.clear()
+    LOGGER.info(f"{len(vocabularies)} vocabularies imported from {filename}")
+    return vocabularies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import all the vocabularies in a binary snapshot")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("filename")
+    args = parser.parse_args()
+    if args.command == "export":
+        dump_snapshot(args.filename)
+    else:
+        restore_snapshot(args.filename)
@@ -0,0 +1,708 @@
+"""
+Storage
+
+in memory implementation of the database operations used by cocat
+with the query semantics of MongoDB: selected with DB_BACKEND=memory (see cocat.db)
+"""
+
+import re
+import copy
+import time
+import logging
+import functools
+import threading
+from itertools import islice
+
+import bson
+from bson import ObjectId
+from pymongo import ReturnDocument, InsertOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany, ReplaceOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+LOGGER = logging.getLogger(__name__)
+
+BACKENDS = ["mongo", "memory"]
+
+MISSING = object()
+
+# command listeners of the memory backend: objects with a `record` method (see cocat.monitoring.CommandMonitor)
+LISTENERS = []
+
+
+def _documents(result) -> list:
+    """documents returned by a command"""
+    if isinstance(result, MemoryCursor):
+        return result._documents
+    if isinstance(result, dict):
+        return [result]
+    return []
+
+
+def _count(result) -> int:
+    if isinstance(result, (MemoryCursor, dict)):
+        return len(_documents(result))
+    if isinstance(result, UpdateResult):
+        return result.matched_count + int(result.upserted_id is not None)
+    if isinstance(result, DeleteResult):
+        return result.deleted_count
+    if isinstance(result, InsertOneResult):
+        return 1
+    if isinstance(result, BulkWriteResult):
+        return result.inserted_count + result.matched_count + result.deleted_count + result.upserted_count
+    return 0 if result is None else 1
+
+
+def monitored(command: str):
+    """publish the commands of a MemoryCollection to the LISTENERS as a database would"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if len(LISTENERS) == 0:
+                return method(self, *args, **kwargs)
+            started_at = time.perf_counter()
+            result = method(self, *args, **kwargs)
+            duration = time.perf_counter() - started_at
+            filter = args[0] if len(args) > 0 else kwargs.get("filter")
+            nbytes = sum(len(bson.encode(doc)) for doc in _documents(result))
+            for listener in LISTENERS:
+                listener.record(command, self.name, filter if isinstance(filter, dict) else None, duration, _count(result), nbytes)
+            return result
+        return wrapper
+    return decorator
+
+
+def get_path(document: dict, path: str):
+    """value of a dotted path in a document or MISSING"""
+    value = document
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return MISSING
+        value = value[key]
+    return value
+
+
+def set_path(document: dict, path: str, value):
+    *parents, key = path.split(".")
+    for parent in parents:
+        document = document.setdefault(parent, {})
+    document[key] = value
+
+
+def unset_path(document: dict, path: str):
+    *parents, key = path.split(".")
+    for parent in parents:
+        document = document.get(parent, {})
+    document.pop(key, None)
+
+
+def _comparable(a, b) -> bool:
+    numbers = (int, float)
+    return (isinstance(a, numbers) and isinstance(b, numbers)) or type(a) == type(b)
+
+
+def _match_operator(value, operator: str, expected) -> bool:
+    values = value if isinstance(value, list) else [value]
+    if operator == "$eq":
+        return _match_value(value, expected)
+    if operator == "$ne":
+        return not _match_value(value, expected)
+    if operator == "$in":
+        return any(_match_value(value, e) for e in expected)
+    if operator == "$nin":
+        return not any(_match_value(value, e) for e in expected)
+    if operator == "$exists":
+        return (value is not MISSING) == bool(expected)
+    if operator == "$regex":
+        return any(isinstance(v, str) and re.search(expected, v) is not None for v in values)
+    if operator in ["$gt", "$gte", "$lt", "$lte"]:
+        compare = {
+            "$gt": lambda v: v > expected,
+            "$gte": lambda v: v >= expected,
+            "$lt": lambda v: v < expected,
+            "$lte": lambda v: v <= expected,
+        }[operator]
+        return any(v is not MISSING and v is not None and _comparable(v, expected) and compare(v) for v in values)
+    raise OperationFailure(f"Storage Error. Unsupported query operator {operator}.")
+
+
+def _match_value(value, expected) -> bool:
+    """equality with the semantics of MongoDB: an array matches if one of its items matches"""
+    if value is MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return any(v == expected for v in value)
+    return value == expected
+
+
+def match(document: dict, query: dict) -> bool:
+    """check if a document matches a query"""
+    for key, expected in (query or {}).items():
+        if key == "$or":
+            if not any(match(document, q) for q in expected):
+                return False
+        elif key == "$and":
+            if not all(match(document, q) for q in expected):
+                return False
+        elif key == "$nor":
+            if any(match(document, q) for q in expected):
+                return False
+        else:
+            value = get_path(document, key)
+            if isinstance(expected, dict) and len(expected) > 0 and all(k.startswith("$") for k in expected):
+                if not all(_match_operator(value, op, e) for op, e in expected.items() if op != "$options"):
+                    return False
+            elif isinstance(expected, re.Pattern):
+                if not _match_operator(value, "$regex", expected):
+                    return False
+            elif not _match_value(value, expected):
+                return False
+    return True
+
+
+def project(document: dict, projection) -> dict:
+    """apply an inclusion or an exclusion projection"""
+    if projection is None:
+        return document
+    if isinstance(projection, (list, tuple)):
+        projection = {key: 1 for key in projection}
+    include = [key for key, value in projection.items() if value and key != "_id"]
+    if len(include) > 0:
+        projected = {}
+        if projection.get("_id", 1) and "_id" in document:
+            projected["_id"] = document["_id"]
+        for key in include:
+            value = get_path(document, key)
+            if value is not MISSING:
+                set_path(projected, key, value)
+        return projected
+    projected = dict(document)
+    for key, value in projection.items():
+        if not value:
+            unset_path(projected, key)
+    return projected
+
+
+def apply_update(document: dict, update: dict, inserted: bool = False):
+    """apply update operators in place"""
+    if not all(key.startswith("$") for key in update):
+        # replacement document
+        _id = document.get("_id")
+        document.clear()
+        document.update(copy.deepcopy(update))
+        if _id is not None:
+            document["_id"] = _id
+        return
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == "$set":
+                set_path(document, path, copy.deepcopy(value))
+            elif operator == "$setOnInsert":
+                if inserted:
+                    set_path(document, path, copy.deepcopy(value))
+            elif operator == "$unset":
+                unset_path(document, path)
+            elif operator == "$inc":
+                current = get_path(document, path)
+                set_path(document, path, (0 if current is MISSING else current) + value)
+            elif operator == "$push":
+                current = get_path(document, path)
+                set_path(document, path, ([] if current is MISSING else current) + [copy.deepcopy(value)])
+            elif operator == "$addToSet":
+                current = get_path(document, path)
+                current = [] if current is MISSING else current
+                if value not in current:
+                    set_path(document, path, current + [copy.deepcopy(value)])
+            elif operator == "$pull":
+                current = get_path(document, path)
+                if current is not MISSING:
+                    set_path(document, path, [v for v in current if v != value])
+            else:
+                raise OperationFailure(f"Storage Error. Unsupported update operator {operator}.")
+
+
+def _upserted_document(query: dict) -> dict:
+    """equality conditions of the query as the base of an upserted document"""
+    return {
+        key: copy.deepcopy(value) for key, value in query.items()
+        if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))
+    }
+
+
+class MemoryCursor:
+    """
+    Cursor on the documents of a MemoryCollection: iterable once with sort, skip and limit
+    """
+
+    def __init__(self, documents: list, projection=None):
+        self._documents = documents
+        self._projection = projection
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction: int = 1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for k, d in reversed(keys):
+            # documents without the key are sorted first as None in MongoDB
+            present = [doc for doc in self._documents if get_path(doc, k) not in [MISSING, None]]
+            absent = [doc for doc in self._documents if get_path(doc, k) in [MISSING, None]]
+            present.sort(key=lambda doc: get_path(doc, k), reverse=d < 0)
+            self._documents = absent + present if d > 0 else present + absent
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int):
+        """pymongo cursor interface: documents are already in memory"""
+        return self
+
+    def _selected(self):
+        stop = self._skip + self._limit if self._limit else None
+        for doc in islice(self._documents, self._skip, stop):
+            yield project(copy.deepcopy(doc), self._projection)
+
+    def _select(self) -> list:
+        return list(self._selected())
+
+    def __iter__(self):
+        # documents are copied one by one: a streaming consumer holds one document at a time
+        return self._selected()
+
+    def to_list(self, length: int = None) -> list:
+        documents = self._select()
+        return documents if length is None else documents[:length]
+
+
+class MemoryCollection:
+    """
+    In memory collection with the query semantics of MongoDB
+    for the operations used by cocat: equality (including on arrays), $in, $nin, $ne, $gt(e), $lt(e),
+    $exists, $regex, $or, $and, $nor; $set, $unset, $inc, $push, $addToSet, $pull, $setOnInsert;
+    unique (and partial) indexes; ordered and unordered bulk writes.
+
+    Documents are copied on write and on read as returned by a database
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._documents = {}
+        self._indexes = {"_id_": {"key": [("_id", 1)], "unique": True}}
+        # {index name: {key: _id}} of the unique indexes (documents are already stored by _id)
+        self._unique = {}
+        self._lock = threading.RLock()
+
+    # read
+
+    def _find(self, filter: dict = None) -> list:
+        with self._lock:
+            return [doc for doc in self._documents.values() if match(doc, filter)]
+
+    @monitored("find")
+    def find(self, filter: dict = None, projection=None, skip: int = 0, limit: int = 0, *, sort=None, **kwargs) -> MemoryCursor:
+        """pymongo signature: options other than sort (e.g. batch_size) have no effect in memory"""
+        documents = self._find(filter)
+        cursor = MemoryCursor(documents, projection).skip(skip).limit(limit)
+        if sort is not None:
+            cursor.sort(sort)
+        return cursor
+
+    def find_one(self, filter=None, projection=None, *args, **kwargs) -> dict:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        for document in self.find(filter, projection, *args, **kwargs).limit(1):
+            return document
+        return None
+
+    @monitored("count")
+    def count_documents(self, filter: dict, **kwargs) -> int:
+        with self._lock:
+            return sum(1 for doc in self._documents.values() if match(doc, filter))
+
+    def estimated_document_count(self) -> int:
+        return len(self._documents)
+
+    @monitored("distinct")
+    def distinct(self, key: str, filter: dict = None) -> list:
+        values = []
+        with self._lock:
+            for doc in self._documents.values():
+                if not match(doc, filter):
+                    continue
+                value = get_path(doc, key)
+                for v in (value if isinstance(value, list) else [value]):
+                    if v is not MISSING and v not in values:
+                        values.append(v)
+        try:
+            return sorted(values)
+        except TypeError:
+            return values
+
+    # indexes
+
+    def create_index(self, keys, **kwargs) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        name = kwargs.get("name") or "_".join(f"{k}_{d}" for k, d in keys)
+        index = {"key": list(keys), **{k: v for k, v in kwargs.items() if k != "name"}}
+        with self._lock:
+            if index.get("unique") and name != "_id_":
+                keys = {}
+                for _id, doc in self._documents.items():
+                    value = self._index_value(index, doc)
+                    if value is None:
+                        continue
+                    if value in keys:
+                        raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}", 11000)
+                    keys[value] = _id
+                self._unique[name] = keys
+            self._indexes[name] = index
+        return name
+
+    def create_indexes(self, indexes: list) -> list:
+        return [self.create_index(list(index.document["key"].items()), **{
+            k: v for k, v in index.document.items() if k != "key"
+        }) for index in indexes]
+
+    def index_information(self) -> dict:
+        return copy.deepcopy(self._indexes)
+
+    def drop_index(self, name: str):
+        self._indexes.pop(name, None)
+        self._unique.pop(name, None)
+
+    def drop_indexes(self):
+        self._indexes = {"_id_": self._indexes["_id_"]}
+        self._unique = {}
+
+    @staticmethod
+    def _index_value(index: dict, document: dict):
+        """key of a document in a unique index: None if the document is not indexed"""
+        partial = index.get("partialFilterExpression")
+        if partial is not None and not match(document, partial):
+            return None
+        values = tuple(get_path(document, key) for key, _ in index["key"])
+        if index.get("sparse") and all(v is MISSING for v in values):
+            return None
+        return tuple(None if v is MISSING else repr(v) for v in values)
+
+    def _unique_keys(self, document: dict) -> dict:
+        """{index name: key} of a document in the unique indexes it belongs to"""
+        keys = {}
+        for name in self._unique:
+            value = self._index_value(self._indexes[name], document)
+            if value is not None:
+                keys[name] = value
+        return keys
+
+    def _check_unique(self, document: dict, exclude=None) -> dict:
+        """raise a DuplicateKeyError if another document has a key of document: returns its keys"""
+        _id = document.get("_id")
+        if _id != exclude and _id in self._documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.name} index: _id_", 11000, {"keyValue": {"_id": _id}}
+            )
+        keys = self._unique_keys(document)
+        for name, value in keys.items():
+            owner = self._unique[name].get(value, exclude)
+            if owner != exclude:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {name}", 11000,
+                    {"keyValue": {key: get_path(document, key) for key, _ in self._indexes[name]["key"]}}
+                )
+        return keys
+
+    def _store(self, document: dict, keys: dict, previous: dict = None):
+        """store a checked document and move its keys in the unique indexes"""
+        if previous is not None:
+            self._unindex(previous)
+        self._documents[document["_id"]] = document
+        for name, value in keys.items():
+            self._unique[name][value] = document["_id"]
+
+    def _unindex(self, document: dict):
+        for name, value in self._unique_keys(document).items():
+            if self._unique[name].get(value) == document["_id"]:
+                del self._unique[name][value]
+
+    # write
+
+    @monitored("insert")
+    def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        return self._insert(document)
+
+    def _insert(self, document: dict) -> InsertOneResult:
+        with self._lock:
+            if "_id" not in document:
+                # as pymongo the _id is set on the given document
+                document["_id"] = ObjectId()
+            stored = copy.deepcopy(document)
+            self._store(stored, self._check_unique(stored))
+        return InsertOneResult(stored["_id"], True)
+
+    def insert_many(self, documents: list, ordered: bool = True, **kwargs) -> InsertManyResult:
+        result = self.bulk_write([InsertOne(doc) for doc in documents], ordered=ordered)
+        return InsertManyResult([doc["_id"] for doc in documents if "_id" in doc][:result.inserted_count], True)
+
+    def _update(self, filter: dict, update: dict, upsert: bool = False, many: bool = False) -> dict:
+        with self._lock:
+            matched = [doc for doc in self._documents.values() if match(doc, filter)]
+            if not many:
+                matched = matched[:1]
+            modified = 0
+            for document in matched:
+                updated = copy.deepcopy(document)
+                apply_update(updated, update)
+                if updated != document:
+                    self._store(updated, self._check_unique(updated, exclude=document["_id"]), previous=document)
+                    modified += 1
+            result = {"n": len(matched), "nModified": modified, "upserted": None}
+            if len(matched) == 0 and upsert:
+                document = _upserted_document(filter)
+                apply_update(document, update, inserted=True)
+                document.setdefault("_id", ObjectId())
+                self._store(document, self._check_unique(document))
+                result = {"n": 1, "nModified": 0, "upserted": document["_id"]}
+            return result
+
+    @monitored("update")
+    def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, upsert), True)
+
+    @monitored("update")
+    def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(filter, update, upsert, many=True), True)
+
+    @monitored("update")
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return UpdateResult(self._update(filter, replacement, upsert), True)
+
+    @monitored("findAndModify")
+    def find_one_and_update(self, filter: dict, update: dict, projection=None, upsert: bool = False,
+                            return_document=ReturnDocument.BEFORE, **kwargs) -> dict:
+        with self._lock:
+            before = next(iter(copy.deepcopy(self._find(filter)[:1])), None)
+            result = self._update(filter if before is None else {"_id": before["_id"]}, update, upsert)
+            if return_document == ReturnDocument.BEFORE:
+                return None if before is None else project(before, projection)
+            _id = before["_id"] if before is not None else result["upserted"]
+            if _id is None:
+                return None
+            return project(copy.deepcopy(self._documents[_id]), projection)
+
+    def _delete(self, filter: dict, many: bool = False) -> int:
+        with self._lock:
+            ids = [_id for _id, doc in self._documents.items() if match(doc, filter)]
+            if not many:
+                ids = ids[:1]
+            for _id in ids:
+                self._unindex(self._documents.pop(_id))
+            return len(ids)
+
+    @monitored("delete")
+    def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter)}, True)
+
+    @monitored("delete")
+    def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        return DeleteResult({"n": self._delete(filter, many=True)}, True)
+
+    @monitored("bulkWrite")
+    def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        """apply InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne and DeleteMany requests
+        raise a BulkWriteError with the details of the write errors as MongoDB does
+        """
+        result = {
+            "writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+            "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []
+        }
+        with self._lock:
+            for i, request in enumerate(requests):
+                try:
+                    if isinstance(request, InsertOne):
+                        self._insert(request._doc)
+                        result["nInserted"] += 1
+                    elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                        updated = self._update(
+                            request._filter, request._doc, bool(request._upsert), many=isinstance(request, UpdateMany)
+                        )
+                        if updated["upserted"] is not None:
+                            result["nUpserted"] += 1
+                            result["upserted"].append({"index": i, "_id": updated["upserted"]})
+                        else:
+                            result["nMatched"] += updated["n"]
+                            result["nModified"] += updated["nModified"]
+                    elif isinstance(request, (DeleteOne, DeleteMany)):
+                        result["nRemoved"] += self._delete(request._filter, many=isinstance(request, DeleteMany))
+                    else:
+                        raise OperationFailure(f"Storage Error. Unsupported bulk request {request}.")
+                except DuplicateKeyError as e:
+                    result["writeErrors"].append({"index": i, "code": 11000, "errmsg": str(e), "op": request})
+                    if ordered:
+                        break
+        if len(result["writeErrors"]) > 0:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def drop(self):
+        with self._lock:
+            self._documents.clear()
+            self.drop_indexes()
+
+
+class MemoryDatabase:
+    """
+    In memory database: collections are created on first access as in MongoDB
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(name)
+            return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str) -> MemoryCollection:
+        return self[name]
+
+    def list_collection_names(self) -> list:
+        return [name for name, collection in self._collections.items() if len(collection._documents) > 0]
+
+    def drop_collection(self, name: str):
+        with self._lock:
+            self._collections.pop(name, None)
+
+
+class MemoryClient:
+    """
+    In memory client: databases are created on first access and shared by every client of the process
+    """
+
+    _databases = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(name)
+        return self._databases[name]
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        return self[name]
+
+    def list_database_names(self) -> list:
+        return list(self._databases)
+
+    def drop_database(self, name: str):
+        self._databases.pop(name, None)
+
+    def server_info(self) -> dict:
+        return {"version": "memory", "ok": 1.0}
+
+    def close(self):
+        pass
+
+
+class AsyncMemoryCursor:
+    """asynchronous cursor (as motor): `async for` or `await cursor.to_list(length)`"""
+
+    def __init__(self, cursor: MemoryCursor):
+        self._cursor = cursor
+        self._iterator = None
+
+    def sort(self, *args, **kwargs):
+        self._cursor.sort(*args, **kwargs)
+        return self
+
+    def skip(self, skip: int):
+        self._cursor.skip(skip)
+        return self
+
+    def limit(self, limit: int):
+        self._cursor.limit(limit)
+        return self
+
+    def __aiter__(self):
+        self._iterator = iter(self._cursor)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length: int = None) -> list:
+        return self._cursor.to_list(length)
+
+
+class AsyncMemoryCollection:
+    """asynchronous (motor) interface of a MemoryCollection"""
+
+    def __init__(self, collection: MemoryCollection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs) -> AsyncMemoryCursor:
+        return AsyncMemoryCursor(self._collection.find(*args, **kwargs))
+
+    def __getattr__(self, name: str):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+class AsyncMemoryDatabase:
+    """asynchronous (motor) interface of a MemoryDatabase"""
+
+    def __init__(self, database: MemoryDatabase):
+        self._database = database
+
+    def __getitem__(self, name: str) -> AsyncMemoryCollection:
+        return AsyncMemoryCollection(self._database[name])
+
+    def __getattr__(self, name: str) -> AsyncMemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+class AsyncMemoryClient:
+    """asynchronous (motor) interface of a MemoryClient"""
+
+    def __init__(self, *args, **kwargs):
+        self._client = MemoryClient()
+
+    def __getitem__(self, name: str) -> AsyncMemoryDatabase:
+        return AsyncMemoryDatabase(self._client[name])
+
+    def __getattr__(self, name: str) -> AsyncMemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def server_info(self) -> dict:
+        return self._client.server_info()
+
+    def close(self):
+        pass
@@ -2,15 +2,21 @@
 
 
 import os
+import asyncio
 import uvicorn
-from fastapi import FastAPI
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import RedirectResponse
 from beanie import init_beanie
 
 from settings import settings 
+from cocat.cache import VOCABULARIES, QUERIES
+from cocat.db import DB_BACKEND, get_async_client
+from cocat.monitoring import MONITOR
+from cocat.reference import REFERENCE_CACHE
+from cocat.repository import VocabularyRepository
 
+from apps.vocabulary.routers import router as vocabulary_router
 {%for app_name in apps%}
 from apps.{{app_name}}.routers import router as {{app_name}}_router{%endfor%}
 {%for app_name, model_names in models%}
@@ -30,17 +36,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def monitor_queries(request: Request, call_next):
+    # repeated queries while serving a request are reported as N+1 patterns
+    with MONITOR.scope(f"{request.method} {request.url.path}"):
+        return await call_next(request)
+
 @app.on_event("startup")
 async def startup_db_client():
-    app.mongodb_client = AsyncIOMotorClient(settings.DB_URI)
+    app.mongodb_client = get_async_client(settings.DB_URI)
     app.mongodb = app.mongodb_client[settings.DB_NAME]
-    await init_beanie(database=app.mongodb, document_models=[{{docs}}])
+    app.vocabularies = VocabularyRepository(app.mongodb)
+    await app.vocabularies.references.create_indexes()
+    app.vocabulary_refresh = None
+    if VOCABULARIES.check_interval is not None:
+        # the validators of the models read the vocabularies in memory: loaded now and refreshed in background
+        await VOCABULARIES.arefresh(app.vocabularies)
+        app.vocabulary_refresh = asyncio.create_task(VOCABULARIES.refresh_forever(app.vocabularies))
+    if DB_BACKEND == "mongo":
+        # beanie documents need a motor database: model routes are not served by the memory backend
+        await init_beanie(database=app.mongodb, document_models=[{{docs}}])
     
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if app.vocabulary_refresh is not None:
+        app.vocabulary_refresh.cancel()
     app.mongodb_client.close()
 
 
+app.include_router(vocabulary_router, tags=["vocabularies"], prefix="/vocabulary")
 {%for model_name in apps%}
 app.include_router({{model_name}}_router, tags=["{{model_name}}s"], prefix="/{{model_name}}"){%endfor%}
 
@@ -50,5 +74,14 @@ async def root():
     response = RedirectResponse(url='/docs')
     return response
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "vocabulary_cache": {**VOCABULARIES.metrics, "size": len(VOCABULARIES)},
+        "reference_cache": {**REFERENCE_CACHE.metrics, "size": len(REFERENCE_CACHE), "hit_rate": REFERENCE_CACHE.hit_rate},
+        "query_cache": {**QUERIES.metrics, "size": len(QUERIES), "bytes": QUERIES.nbytes, "hit_rate": QUERIES.hit_rate},
+        "database": MONITOR.report(),
+    }
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host=settings.BACK_URL, port=settings.BACK_PORT, reload=settings.RELOAD, debug=settings.DEBUG, workers=settings.WORKERS_NB)
\ No newline at end of file
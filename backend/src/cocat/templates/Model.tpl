@@ -10,23 +10,31 @@ from datetime import datetime
 from datetime import date
 from pydantic import BaseModel, Field,  HttpUrl, EmailStr,  constr, validator
 {%if has_external_models%}{%for ext_model in external_models %}{{ext_model}}{%endfor%}{%endif%}
-{%if has_vocabulary%}from apps.vocabulary.routers import get_reference_values
+{%if has_vocabulary%}from cocat.cache import VOCABULARIES
+
+# the vocabularies are loaded and refreshed off the request path (see VocabularyCache.arefresh)
+# validators only read them in memory
+def loaded_vocabulary(name, lang):
+    vocabulary = VOCABULARIES.peek(name, lang)
+    if vocabulary is None:
+        raise ValueError(f"{name} vocabulary is not loaded")
+    return vocabulary
 
 def check_value_in_set(cls, v, values, field):
     lang = values.get('lang')
     if lang:
-        ref_values = get_reference_values(field.name, lang)
-        accepted_values = ",".join([repr(e) for e in ref_values])
-        if v not in ref_values: 
+        vocabulary = loaded_vocabulary(field.name, lang)
+        if not vocabulary.has_value(v):
+            accepted_values = ",".join([repr(e) for e in vocabulary.labels])
             raise ValueError(f"{field.name} must be one of [{accepted_values}]")
     return v
 
 def check_multiple_values_in_set(cls, v, values, field):
     lang = values.get('lang')
     if lang:
-        ref_values = get_reference_values(field.name, lang)
-        accepted_values = ",".join([repr(e) for e in ref_values])
-        if not set(v).issubset(ref_values):  
+        vocabulary = loaded_vocabulary(field.name, lang)
+        if not all(vocabulary.has_value(e) for e in v):
+            accepted_values = ",".join([repr(e) for e in vocabulary.labels])
             raise ValueError(f"{field.name} must be one of [{accepted_values}]")
     return v
 {%endif%}
@@ -8,12 +8,133 @@ from fastapi.responses import JSONResponse, Response
 from fastapi.encoders import jsonable_encoder
 from typing import Optional, List, Union, Set, Dict
 from apps.models.{{name}} import {{model_name}}
-#from apps.services.db import DB
+from cocat.cache import QUERIES
+from cocat.translation import TranslationWorker
+{%if search %}from cocat.search import SearchIndex
+{%endif%}{%if filter %}from cocat.facets import FacetIndex
+{%endif%}#from apps.services.db import DB
 {{import_models}}
 {{import_external_models}}
 
 router = APIRouter()
 
+LANGS = ["fr", "en"]
+{%if search %}SEARCH_INDEX = {lang: SearchIndex({{search_fields}}, lang) for lang in LANGS}
+{%endif%}{%if filter %}FACET_INDEX = {lang: FacetIndex({{filter_fields}}) for lang in LANGS}
+{%endif%}# version stamp of the {{name}} documents the indexes of this process are built from
+INDEXED = {"version": None}
+# translation fields are translated in background: documents are saved in the given lang first
+TRANSLATION_FIELDS = {{translation_fields}}
+TRANSLATIONS = TranslationWorker()
+
+
+def index_doc(doc_id, multilang_doc: dict):
+    """add or replace a document in the search and filter indexes of its langs"""
+    for lang in LANGS:
+        if lang not in multilang_doc:
+            # not indexed in a lang it is not written in
+            delete_lang_index_doc(doc_id, lang)
+            continue
+        {%if search %}SEARCH_INDEX[lang].add(doc_id, multilang_doc[lang])
+        {%endif%}{%if filter %}FACET_INDEX[lang].add(doc_id, multilang_doc[lang])
+        {%endif%}{%if not (search or filter) %}pass{%endif%}
+    return doc_id
+
+
+def delete_lang_index_doc(doc_id, lang: str):
+    {%if search %}SEARCH_INDEX[lang].remove(doc_id)
+    {%endif%}{%if filter %}FACET_INDEX[lang].remove(doc_id)
+    {%endif%}{%if not (search or filter) %}pass{%endif%}
+    return doc_id
+
+
+def delete_index_doc(doc_id):
+    for lang in LANGS:
+        delete_lang_index_doc(doc_id, lang)
+    return doc_id
+
+
+async def refresh_indexes():
+    """rebuild the indexes from the collection when the stamp of the {{name}} documents has changed
+    (e.g. written by another worker): new indexes are built then swapped, queries in between read the previous ones
+    """
+    version = await QUERIES.aversion("{{name}}")
+    if INDEXED["version"] == version:
+        return
+    {%if search %}search_index = {lang: SearchIndex({{search_fields}}, lang) for lang in LANGS}
+    {%endif%}{%if filter %}facet_index = {lang: FacetIndex({{filter_fields}}) for lang in LANGS}
+    {%endif%}# the multilang documents written by create, update and the translations
+    async for doc in {{model_name}}Multilang.find_all():
+        multilang_doc = jsonable_encoder(doc)
+        for lang in LANGS:
+            if lang not in multilang_doc:
+                continue
+            {%if search %}search_index[lang].add(str(doc.id), multilang_doc[lang])
+            {%endif%}{%if filter %}facet_index[lang].add(str(doc.id), multilang_doc[lang])
+            {%endif%}{%if not (search or filter) %}pass{%endif%}
+    {%if search %}SEARCH_INDEX.update(search_index)
+    {%endif%}{%if filter %}FACET_INDEX.update(facet_index)
+    {%endif%}INDEXED["version"] = version
+
+
+async def changed():
+    """to call after a write already applied to the indexes of this process: bump the stamp of the documents"""
+    version = await QUERIES.amodel_changed("{{name}}")
+    # no write of another worker in between: the indexes are up to date
+    if INDEXED["version"] == version - 1:
+        INDEXED["version"] = version
+    return version
+
+
+@router.on_event("startup")
+async def build_{{name}}_indexes():
+    await refresh_indexes()
+
+
+@router.on_event("shutdown")
+async def stop_{{name}}_translations():
+    await TRANSLATIONS.stop()
+
+
+def translated(doc_id):
+    """callback saving and indexing a document once translated"""
+    async def save(multilang_doc: dict):
+        doc = await {{model_name}}Multilang.get(doc_id)
+        if doc is None:
+            return
+        await doc.set(multilang_doc)
+        index_doc(str(doc_id), multilang_doc)
+        await changed()
+    return save
+{%if search %}
+
+@router.get("/search", response_description="Search {{model_name}} ids by full text", status_code=200)
+async def search_{{name}}(q: str, limit: int = 10, lang: constr(regex="^(fr|en)$") = "fr"):
+    """ids and scores of the best matching {{model_name}}: identical queries are served from QUERIES until a write"""
+    await refresh_indexes()
+    return await QUERIES.aget(
+        "{{name}}", "search", {"q": q, "limit": limit}, lang,
+        lambda: [{"id": doc_id, "score": score} for doc_id, score in SEARCH_INDEX[lang].search(q, limit)],
+    )
+{%endif%}{%if filter %}
+
+@router.post("/filter", response_description="Filter {{model_name}} ids and facet counts", status_code=200)
+async def filter_{{name}}(filters: Dict[str, Union[str, List[str]]] = Body({}), skip: int = 0, limit: int = 100, lang: constr(regex="^(fr|en)$") = "fr"):
+    """ids of the matching {{model_name}} and the counts of every filter value in lang: served from QUERIES until a write"""
+    await refresh_indexes()
+    try:
+        return await QUERIES.aget(
+            "{{name}}", "filter", {**filters, "_skip": skip, "_limit": limit}, lang,
+            lambda: {
+                "ids": FACET_INDEX[lang].search(filters, skip, limit),
+                "count": FACET_INDEX[lang].count(filters),
+                "facets": FACET_INDEX[lang].counts(filters),
+            },
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+{%endif%}
+
 
 @router.get("/", response_description="Get {{model_name}} list", response_model=List[{{model_name}}], status_code=200)
 async def get_{{name}}_list(skip: int = 0, limit: int = 100, lang: constr(regex="^(fr|en)$") = "fr"):
@@ -32,7 +153,7 @@ async def get_{{name}}_list(skip: int = 0, limit: int = 100, lang: constr(regex=
 
 
 @router.get("/<id>", response_description="Get {{model_name}} item given id and lang", response_model={{model_name}}, status_code=200)
-async def get_{{name}}_item(id=str, lang := constr(regex="^(fr|en)$")="fr"):
+async def get_{{name}}_item(id=str, lang: constr(regex="^(fr|en)$") = "fr"):
     model_multilang_doc = await {{model_name}}.get(id)
     if model_multilang_doc is None:
         raise HTTPException(status_code=404, detail="Item not found")
@@ -44,23 +165,24 @@ async def get_{{name}}_item(id=str, lang := constr(regex="^(fr|en)$")="fr"):
     return model_multilang_doc
     {%endif%}
 @router.delete("/<id>", response_description="Delete {{model_name}} item given id", response_model={{model_name}}, status_code=204)
-async def delete_{name}}_item(id=str):
+async def delete_{{name}}_item(id=str):
     model_multilang_doc = await {{model_name}}.get(id)
     if model_multilang_doc is None:
         raise HTTPException(status_code=404, detail="Item not found")
     model_multilang_doc.delete()
-    #remove fromindex
-    #{{model_name}}.index.delete()
+    delete_index_doc(id)
+    await changed()
     return Response(status_code= status.HTTP_204_NO_CONTENT)
 
 @router.post("/", response_description="Add a new {{model_name}} item given lang", response_model={{model_name}}, status_code=201)
-async def create_{{name}}(model: {{model_name}}, lang := constr(regex="^(fr|en)$")="fr"):
-    new_doc = {lang: model}
-    #translate
-    new_multilang_doc = translate_doc(new_doc)
-    #index
-    index_doc(new_multilang_doc)
+async def create_{{name}}(model: {{model_name}}, lang: constr(regex="^(fr|en)$") = "fr"):
+    new_multilang_doc = {lang: jsonable_encoder(model)}
     new_model = await {{model_name}}Multilang(**new_multilang_doc).create()
+    #index
+    index_doc(str(new_model.id), new_multilang_doc)
+    await changed()
+    #translate
+    await TRANSLATIONS.submit(new_multilang_doc, TRANSLATION_FIELDS, translated(new_model.id))
     return JSONResponse(new_multilang_doc, status_code=status.HTTP_201_CREATED)
 
     model.create()
@@ -68,16 +190,16 @@ async def create_{{name}}(model: {{model_name}}, lang := constr(regex="^(fr|en)$
 
 @router.put("/<id>", response_description="Update {{model_name}} item given id and lang", response_model={{model_name}}, status_code=201)
 async def update_{{name}}(id: str, model: {{model_name}}, lang : constr(regex="^(fr|en)$")="fr"):
-    doc = await {{model_name}}.get(id)
+    doc = await {{model_name}}Multilang.get(id)
     if doc is None:
         raise HTTPException(status_code=404, detail="Item not found")
     for key, value in model.items():
         doc[lang][key] = value 
-    #update translation
-    new_multilang_doc = translate_doc(new_doc)
-    #update index
-    delete_index_doc(doc)
-    index_doc(new_multilang_doc)
     updated_doc  = await doc.save()
+    #update index
+    index_doc(id, jsonable_encoder(updated_doc))
+    await changed()
+    #update translation: only the fields missing in the other lang are translated, its curated values are kept
+    await TRANSLATIONS.submit({other: doc[other] for other in LANGS if other in doc}, TRANSLATION_FIELDS, translated(id), lang)
     return JSONResponse(updated_doc, status_code=status.HTTP_204_UPDATED)
 
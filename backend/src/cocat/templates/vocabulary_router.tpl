@@ -0,0 +1,42 @@
+# file: routers.py
+# autogenerated by cocat.generator.write_vocabulary_router()
+from pydantic import constr
+
+from fastapi import APIRouter, Body, Request, HTTPException, status
+from fastapi.responses import JSONResponse, Response
+from typing import List
+
+router = APIRouter()
+
+
+@router.get("/", response_description="Get the names of the vocabularies", status_code=200)
+async def get_vocabulary_names(request: Request):
+    return await request.app.vocabularies.names()
+
+
+@router.get("/{name}", response_description="Get the references of a vocabulary given lang", status_code=200)
+async def get_vocabulary(request: Request, name: str, lang: constr(regex="^(fr|en)$") = "fr"):
+    vocabulary = await request.app.vocabularies.get(name, lang)
+    if vocabulary is None:
+        raise HTTPException(status_code=404, detail="Vocabulary not found")
+    return {"name": name, "lang": lang, "labels": vocabulary.labels, "uris": vocabulary.uris}
+
+
+@router.post("/{name}", response_description="Add references to a vocabulary", status_code=201)
+async def add_references(request: Request, name: str, references: List[dict] = Body(...)):
+    inserted = await request.app.vocabularies.add_references(name, references)
+    return JSONResponse({"inserted": inserted}, status_code=status.HTTP_201_CREATED)
+
+
+@router.put("/{name}/{label}", response_description="Update a reference of a vocabulary", status_code=200)
+async def update_reference(request: Request, name: str, label: str, reference: dict = Body(...)):
+    if not await request.app.vocabularies.update_reference(name, label, reference):
+        raise HTTPException(status_code=404, detail="Reference not found")
+    return {"updated": label}
+
+
+@router.delete("/{name}/{label}", response_description="Delete a reference of a vocabulary", status_code=204)
+async def delete_reference(request: Request, name: str, label: str):
+    if not await request.app.vocabularies.delete_reference(name, label):
+        raise HTTPException(status_code=404, detail="Reference not found")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,320 @@
+"""
+Translation
+
+translation of the multilang fields of a model (Property.multilang) between fr and en:
+strings are deduplicated, cached by content hash in the database and sent by batch to a pluggable translator
+(TRANSLATOR environment variable): without a translator documents are left unchanged
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+import importlib
+
+from pymongo import UpdateOne
+
+from cocat.db import DB
+
+LOGGER = logging.getLogger(__name__)
+
+LANGS = ["fr", "en"]
+
+
+def content_key(text: str, source: str, target: str) -> str:
+    """hash of a string and its translation direction"""
+    return hashlib.sha256(f"{source}:{target}:{text}".encode("utf-8")).hexdigest()
+
+
+class StubTranslator:
+    """
+    Local translator for tests and development: prefix the text with the target lang (e.g. `[en] Qualité de l'air`)
+    its output is not a translation and is never stored (see TranslationPipeline)
+
+    Attributes
+    ----------
+    batches: list
+        number of strings of every batch received
+    persistent: bool
+        False: the translations are not stored
+    """
+
+    persistent = False
+
+    def __init__(self):
+        self.batches = []
+
+    def translate(self, texts: list, source: str, target: str) -> list:
+        self.batches.append(len(texts))
+        return [f"[{target}] {text}" for text in texts]
+
+
+def get_translator(name: str = None):
+    """translator by name: `stub` or the dotted path of a class with translate(texts, source, target) -> list
+    e.g. `apps.services.deepl:DeeplTranslator` (default to the TRANSLATOR environment variable)
+    None if no translator is set
+    """
+    name = name or os.getenv("TRANSLATOR")
+    if name in [None, ""]:
+        LOGGER.warning("No translator is set (TRANSLATOR): multilang fields are not translated")
+        return None
+    if name == "stub":
+        return StubTranslator()
+    module_name, _, class_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class TranslationStore:
+    """
+    Persistent cache of translations keyed by content hash (see content_key)
+
+    Methods
+    -------
+    get_many(keys)
+    set_many(translations)
+    """
+
+    def __init__(self, collection=None):
+        self.collection = collection if collection is not None else DB.translation
+
+    def get_many(self, keys: list) -> dict:
+        """{key: translation} of the stored keys in one query"""
+        if len(keys) == 0:
+            return {}
+        return {
+            doc["_id"]: doc["translation"]
+            for doc in self.collection.find({"_id": {"$in": list(keys)}}, {"translation": 1})
+        }
+
+    def set_many(self, translations: list):
+        """store (key, text, source, target, translation) tuples in one bulk write"""
+        if len(translations) == 0:
+            return None
+        return self.collection.bulk_write([
+            UpdateOne(
+                {"_id": key},
+                {"$set": {"text": text, "source": source, "target": target, "translation": translation}},
+                upsert=True,
+            )
+            for key, text, source, target, translation in translations
+        ], ordered=False)
+
+
+class TranslationPipeline:
+    """
+    Translate the translation fields of documents
+
+    The strings of every document are collected and deduplicated, looked up in the store in one query
+    and only the missing ones are sent to the translator by batches of `batch_size`.
+
+    Attributes
+    ----------
+    translator: object
+        translate(texts, source, target) -> list of translations in the same order
+        None: documents are left unchanged. Translations of a translator with `persistent = False`
+        (e.g. StubTranslator) are not stored
+    store: TranslationStore
+    batch_size: int
+        maximum number of strings by translator call
+    metrics: dict
+        number of strings requested, found in the store and translated
+
+    Methods
+    -------
+    translate_texts(texts, source, target)
+    translate_docs(docs, fields, source)
+    translate_doc(doc, fields)
+    """
+
+    def __init__(self, translator=None, store: TranslationStore = None, batch_size: int = 50):
+        self.translator = translator if translator is not None else get_translator()
+        self.store = store if store is not None else TranslationStore()
+        self.batch_size = batch_size
+        self.metrics = {"requested": 0, "cached": 0, "translated": 0}
+
+    def translate_texts(self, texts, source: str, target: str) -> dict:
+        """{text: translation} of every distinct text"""
+        if self.translator is None:
+            raise ValueError("Translation Error. No translator is set (TRANSLATOR).")
+        texts = list(dict.fromkeys(t for t in texts if isinstance(t, str) and t.strip() != ""))
+        keys = {text: content_key(text, source, target) for text in texts}
+        found = self.store.get_many(list(keys.values()))
+        translations = {text: found[key] for text, key in keys.items() if key in found}
+        missing = [text for text in texts if text not in translations]
+        self.metrics["requested"] += len(texts)
+        self.metrics["cached"] += len(translations)
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            results = self.translator.translate(batch, source, target)
+            if len(results) != len(batch):
+                raise ValueError(f"Translation Error. {len(batch)} strings sent but {len(results)} translated.")
+            if getattr(self.translator, "persistent", True):
+                self.store.set_many([(keys[text], text, source, target, result) for text, result in zip(batch, results)])
+            translations.update(zip(batch, results))
+            self.metrics["translated"] += len(batch)
+        return translations
+
+    @staticmethod
+    def _texts(value) -> list:
+        if isinstance(value, str):
+            return [value]
+        if isinstance(value, (list, tuple)):
+            return [v for v in value if isinstance(v, str)]
+        return []
+
+    @staticmethod
+    def _translated(value, translations: dict):
+        if isinstance(value, str):
+            return translations.get(value, value)
+        if isinstance(value, (list, tuple)):
+            return [translations.get(v, v) if isinstance(v, str) else v for v in value]
+        return value
+
+    def translate_docs(self, docs: list, fields: list, source: str = "fr") -> list:
+        """fill the missing fields of the other lang of multilang documents ({"fr": {...}, "en": {...}})
+        from the source lang: the fields already set in the other lang are kept
+        without a translator the documents are left unchanged
+        """
+        if self.translator is None:
+            return docs
+        target = next(lang for lang in LANGS if lang != source)
+        texts = [
+            text
+            for doc in docs
+            for field in fields
+            if doc.get(target, {}).get(field) in [None, "", []]
+            for text in self._texts(doc.get(source, {}).get(field))
+        ]
+        translations = self.translate_texts(texts, source, target)
+        for doc in docs:
+            translated = doc.setdefault(target, {})
+            for key, value in doc.get(source, {}).items():
+                if translated.get(key) not in [None, "", []]:
+                    continue
+                translated[key] = self._translated(value, translations) if key in fields else value
+        return docs
+
+    def translate_doc(self, doc: dict, fields: list) -> dict:
+        """translate a document given in one lang ({lang: {...}}) into a multilang document"""
+        source = next(lang for lang in LANGS if lang in doc)
+        return self.translate_docs([doc], fields, source)[0]
+
+
+class TranslationWorker:
+    """
+    Background translation off the request path
+
+    Submitted documents are queued and translated together: a batch is closed after `batch_size` documents
+    or `max_delay` seconds. The pipeline runs in a thread (translators are usually blocking HTTP clients)
+    and the callback of every document then receives the translated document (e.g. to save it).
+    Errors are caught by document: a failing document or callback does not drop the others of its batch.
+    Without a translator submitted documents are ignored.
+
+    Attributes
+    ----------
+    pipeline: TranslationPipeline
+    batch_size: int
+        maximum number of documents by batch
+    max_delay: float
+        maximum delay in seconds of a queued document before its batch is translated
+
+    Methods
+    -------
+    start()
+    submit(doc, fields, callback, source)
+    join()
+    stop()
+    """
+
+    def __init__(self, pipeline: TranslationPipeline = None, batch_size: int = 100, max_delay: float = 0.5):
+        self.pipeline = pipeline if pipeline is not None else TranslationPipeline()
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def submit(self, doc: dict, fields: list, callback=None, source: str = None):
+        """queue a multilang document: its fields missing in the other lang are translated from source
+        (default to its first lang) and callback(multilang_doc) is awaited once it is translated
+        """
+        if self.pipeline.translator is None:
+            return
+        source = source or next((lang for lang in LANGS if lang in doc), None)
+        if source not in LANGS:
+            raise ValueError(f"Translation Error. Document has no lang in {LANGS}.")
+        self.start()
+        await self._queue.put((doc, list(fields), callback, source))
+
+    async def join(self):
+        """wait for the queued documents"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self):
+        await self.join()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task, self._queue = None, None
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _translate(self, items: list, fields: list, source: str):
+        """translate queued documents of a source lang and fields, then await their callbacks"""
+        loop = asyncio.get_running_loop()
+        translated = items
+        try:
+            await loop.run_in_executor(None, self.pipeline.translate_docs, [doc for doc, _, _, _ in items], fields, source)
+        except Exception as e:
+            LOGGER.warning(f"Translation of {len(items)} documents failed: {e}")
+            # the documents are translated one by one so that a failing one does not drop the others
+            translated = []
+            for item in items if len(items) > 1 else []:
+                try:
+                    await loop.run_in_executor(None, self.pipeline.translate_docs, [item[0]], fields, source)
+                    translated.append(item)
+                except Exception as e:
+                    LOGGER.error(f"Translation of a document failed: {e}")
+        for doc, _, callback, _ in translated:
+            if callback is None:
+                continue
+            try:
+                await callback(doc)
+            except Exception as e:
+                LOGGER.error(f"Translation callback failed: {e}")
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                # one pipeline call by source lang and fields
+                groups = {}
+                for item in batch:
+                    _, fields, _, source = item
+                    groups.setdefault((source, tuple(fields)), []).append(item)
+                for (source, fields), items in groups.items():
+                    await self._translate(items, list(fields), source)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,157 @@
+"""
+Unit of work
+
+write batching of references: mutations are collected and flushed as a single bulk_write
+"""
+
+import logging
+from contextvars import ContextVar
+
+from pymongo import InsertOne
+from pymongo.errors import PyMongoError, BulkWriteError
+
+from cocat.db import DB, DB_BACKEND, mongodb_client, bump_version
+
+LOGGER = logging.getLogger(__name__)
+
+# unit of work collecting the writes of the current context
+CURRENT = ContextVar("cocat_unit_of_work", default=None)
+
+
+def current_unit_of_work():
+    """active unit of work or None: writes are then issued immediately"""
+    return CURRENT.get()
+
+
+class UnitOfWork:
+    """
+    Collect the writes of Reference.add, update and delete (and so of the Vocabulary mutations)
+    and flush them as a single ordered bulk_write when the block exits without error
+
+    The version stamps of the modified vocabularies are bumped once after the flush, and also when a flush
+    without transaction fails after some writes were applied (the writes before the failing one of the ordered bulk).
+    With `transaction` the flush and the stamps are applied in a MongoDB transaction (replica set required):
+    either every write is applied or none. A unit of work opened inside another one joins it.
+
+    Attributes
+    ----------
+    transaction: bool
+        flush in a transaction: ignored by the memory backend
+    requests: list
+        pending InsertOne, UpdateOne and DeleteOne requests
+    versions: list
+        version stamps to bump on flush
+
+    Methods
+    -------
+    add(request)
+    insert(document)
+    pending(predicate)
+    touch(version_key, rollback=None)
+    after_flush(callback)
+    flush()
+    discard()
+    """
+
+    def __init__(self, collection=None, transaction: bool = False):
+        self.collection = collection if collection is not None else DB.reference
+        self.transaction = transaction
+        self.requests = []
+        self.versions = []
+        self._inserts = []
+        self._rollbacks = {}
+        self._after_flush = []
+        self._token = None
+        self._joined = False
+
+    def __enter__(self):
+        if current_unit_of_work() is not None:
+            self._joined = True
+            return current_unit_of_work()
+        self._token = CURRENT.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self._joined:
+            return False
+        CURRENT.reset(self._token)
+        if exc_type is not None:
+            self.discard()
+            return False
+        self.flush()
+        return False
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, request):
+        self.requests.append(request)
+
+    def insert(self, document: dict):
+        """queue the insert of a document: it is then found by pending() until the flush"""
+        self._inserts.append(document)
+        self.add(InsertOne(document))
+
+    def pending(self, predicate) -> dict:
+        """first document queued by insert() matching predicate(document) or None"""
+        return next((document for document in self._inserts if predicate(document)), None)
+
+    def touch(self, version_key: str, rollback=None):
+        """register a version stamp to bump on flush and the callback restoring the in memory state on failure"""
+        if version_key not in self.versions:
+            self.versions.append(version_key)
+        if rollback is not None:
+            self._rollbacks[version_key] = rollback
+
+    def after_flush(self, callback):
+        """register a callback run once the pending requests are written (or failed)"""
+        self._after_flush.append(callback)
+
+    def flush(self):
+        """apply the pending requests in one bulk_write and bump the version stamps: returns the BulkWriteResult"""
+        requests, versions = self.requests, self.versions
+        self.requests, self.versions, self._inserts = [], [], []
+        result = None
+        try:
+            if self.transaction and DB_BACKEND == "mongo":
+                with mongodb_client.start_session() as session:
+                    with session.start_transaction():
+                        if len(requests) > 0:
+                            result = self.collection.bulk_write(requests, ordered=True, session=session)
+                        for key in versions:
+                            bump_version(key, session=session)
+            else:
+                if self.transaction:
+                    LOGGER.debug(f"{DB_BACKEND} backend has no transaction: writes are flushed in one bulk")
+                try:
+                    if len(requests) > 0:
+                        result = self.collection.bulk_write(requests, ordered=True)
+                except BulkWriteError as e:
+                    # the writes before the failing one are applied: readers must see a new stamp
+                    if any(e.details.get(n, 0) > 0 for n in ["nInserted", "nUpserted", "nModified", "nRemoved"]):
+                        for key in versions:
+                            bump_version(key)
+                    raise
+                for key in versions:
+                    bump_version(key)
+        except PyMongoError as e:
+            LOGGER.warning(f"Unit of work failed: {e}")
+            self._rollback()
+            raise
+        finally:
+            callbacks, self._after_flush = self._after_flush, []
+            for callback in callbacks:
+                callback()
+        self._rollbacks = {}
+        LOGGER.debug(f"Unit of work flushed {len(requests)} writes")
+        return result
+
+    def discard(self):
+        """drop the pending requests and restore the in memory state"""
+        self.requests, self.versions, self._inserts, self._after_flush = [], [], [], []
+        self._rollback()
+
+    def _rollback(self):
+        rollbacks, self._rollbacks = self._rollbacks, {}
+        for rollback in rollbacks.values():
+            rollback()
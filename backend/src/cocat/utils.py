@@ -1,4 +1,5 @@
 import os
+import unicodedata
 from jinja2 import Environment, FileSystemLoader, select_autoescape, exceptions
 
 def load_template(template_name, template_dirname="templates"):
@@ -8,3 +9,12 @@ def load_template(template_name, template_dirname="templates"):
         loader=FileSystemLoader(template_dir), autoescape=select_autoescape()
     )
     return env.get_template(template_name)
+
+
+def normalize(value: str) -> str:
+    """fold case, accents and spaces of a value: ` Qualité de l'Air` -> `qualite de l'air`"""
+    if value is None:
+        return None
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return " ".join(value.casefold().split())
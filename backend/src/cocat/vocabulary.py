@@ -1,13 +1,38 @@
 
 
 import os
+import logging
 from csv import DictReader
 from typing import Optional, List
 
-from pydantic import BaseModel, validator, constr, root_validator
+from pydantic import BaseModel, validator, constr, root_validator, PrivateAttr
 import pymongo
-from cocat.db import DB, PyObjectId
-from cocat.reference import Reference
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+from cocat.monitoring import traced
+from cocat.db import DB, PyObjectId, get_version, bump_version
+from cocat.unit_of_work import current_unit_of_work
+from cocat.reference import Reference, REFERENCE_CACHE
+from cocat.columns import ReferenceColumns, ReferenceList, INDEX_KEYS
+from cocat.autocomplete import PrefixIndex
+from cocat.fuzzy import FuzzyMatcher
+from cocat.hierarchy import Hierarchy
+
+LOGGER = logging.getLogger(__name__)
+
+# keys identifying a reference across csv imports, by priority
+NATURAL_KEYS = ["slug", "name_en", "name_fr"]
+
+
+def natural_key(reference: dict, key: str = None) -> str:
+    """value of key or of the first non empty NATURAL_KEYS of a reference"""
+    if key is not None:
+        return reference.get(key)
+    for k in NATURAL_KEYS:
+        if reference.get(k) not in ["", None]:
+            return reference[k]
+    return None
+
 
 class Vocabulary(BaseModel):
     """
@@ -21,14 +46,23 @@ class Vocabulary(BaseModel):
         language for vocabulary: fr or en default to fr
 
     references: list
-        all the references given the name
+        all the references given the name: built on access from columns
+
+    columns: ReferenceColumns
+        columnar storage of the references with indexes by label, name_fr, name_en, slug and uri
 
-    values: list
+    labels: list
         all the name of the values in default lang
 
     uris: list
         all the uris of the vocabulary's values  
 
+    version: int
+        version stamp of the stored vocabulary, incremented on every write
+
+    hierarchy: Hierarchy
+        transitive closure of the broader/narrower relations: built on first use
+
     Methods
     -------
     build_references
@@ -40,12 +74,17 @@ class Vocabulary(BaseModel):
     lang: constr(regex="^(fr|en)$") = "fr"
     csv_file: Optional[str] = None
     filename: Optional[str] = None
-    references: Optional[List[Reference]] = [ ]
+    # References or dicts: stored by columns (see set_references)
+    references: Optional[List] = [ ]
     db_name: Optional[str] = "reference"
     standards: Optional[List] = []
     exists: Optional[bool] = False
+    _prefix_index: Optional[PrefixIndex] = PrivateAttr(default=None)
+    _matcher: Optional[FuzzyMatcher] = PrivateAttr(default=None)
+    _hierarchy: Optional[Hierarchy] = PrivateAttr(default=None)
     
     @root_validator
+    @traced("Vocabulary.create_from_csv_file")
     def create_from_csv_file(cls, values) -> dict:
         if values["csv_file"] is not None:
             values["filename"] = os.path.basename(values["csv_file"]) 
@@ -64,9 +103,11 @@ class Vocabulary(BaseModel):
                             row["vocabulary"] = values["name"]
                         row["lang"] = values["lang"]
                         r = Reference.parse_obj(row)
-                        r.add()
+                        # stamped once after the load
+                        r.add(stamp=False)
                         values["references"].append(r)
                 values["exists"] = True
+                bump_version(f"vocabulary:{values['name']}")
         return values
    
     # @root_validator
@@ -82,50 +123,45 @@ class Vocabulary(BaseModel):
     #     return values
     
     @root_validator
+    @traced("Vocabulary.set_references")
     def set_references(cls, values) -> dict:
-        if len(values["references"]) == 0:
-            refs = DB.reference.find({"vocabulary": values["name"]})
-            if refs is not None:
-                values["references"] = [ Reference(**r).add() for r in refs]
-                # values["exists"] = True
-        else:
-            if not isinstance(values["references"][0], Reference): 
-                #logger.warning(values["references"][0])
-                values["references"] = [ Reference(**r) for r in values["references"]]
-        # if len(values["references"]) > 0:
-        #     values["references"] = [ Reference(**r) for r in values["references"]]
-        return values
-    
-    @root_validator
-    def check_if_exists(cls, values):
-        values["exists"] = len(values["references"]) > 0 
-        return values
-    
-    
-    @root_validator
-    def set_labels(cls, values) -> dict:
-        if values["exists"]:
-            values["labels"] = [r.label for r in values["references"]]
-        else:
-            values["labels"] = []
+        references = values["references"]
+        if len(references) == 0:
+            # stored references are loaded as is: no lookup per reference
+            references = DB.reference.find({"vocabulary": values["name"]})
+        values["columns"] = ReferenceColumns(values["name"], values["lang"], references)
+        values["references"] = ReferenceList(values["columns"])
+        values["exists"] = len(values["columns"]) > 0
         return values
 
-    @root_validator
-    def set_names_en(cls, values) -> dict:
-        values["names_en"] = [r.name_en for r in values["references"]]
-        return values
-    @root_validator
-    def set_names_fr(cls, values) -> dict:
-        values["names_fr"] = [r.name_fr for r in values["references"]]
-        return values
-    @root_validator
-    def set_uris(cls, values) -> dict:
-        values["uris"] = [r.uri for r in values["references"] if r.uri is not None]
-        return values
-    
+    @property
+    def labels(self) -> list:
+        if self.references is None:
+            return []
+        return self.columns.column("label")
+
+    @property
+    def names_en(self) -> list:
+        if self.references is None:
+            return []
+        return self.columns.column("name_en")
+
+    @property
+    def names_fr(self) -> list:
+        if self.references is None:
+            return []
+        return self.columns.column("name_fr")
+
+    @property
+    def uris(self) -> list:
+        if self.references is None:
+            return []
+        return [uri for uri in self.columns.column("uri") if uri is not None]
+
+    @traced("Vocabulary.create")
     def create(self, csv_file) -> list:
         self.filename = os.path.basename(csv_file)
-        self.references = []
+        self.columns.clear()
         with open(csv_file, "r") as f:
             reader = DictReader(f, delimiter=",")
             for row in reader:
@@ -133,49 +169,279 @@ class Vocabulary(BaseModel):
                 row["vocabulary"] = self.name
                 row["lang"] = self.lang
                 r = Reference.parse_obj(row)
-                r.add()
-                self.references.append(r)
+                # stamped once after the load
+                r.add(stamp=False)
+                self.columns.append(r)
+        self.references = ReferenceList(self.columns)
+        self.reset_indexes()
+        bump_version(self.version_key)
         return self.references
 
+    @traced("Vocabulary.delete")
     def delete(self) -> dict:
-        for ref in self.references:
-            ref.delete()            
+        ids = [i for i in self.columns.column("id") if i is not None]
+        DB.reference.delete_many({"_id": {"$in": ids}})
+        REFERENCE_CACHE.clear()
+        self.columns.clear()
         self.references = None
+        self.reset_indexes()
+        bump_version(self.version_key)
         return self
+
+    @traced("Vocabulary.sync")
+    def sync(self, csv_file, key: str = None) -> dict:
+        """synchronize the stored references with an edited csv file
+        rows and stored references are matched by natural key (see natural_key):
+        only new, modified and removed references are written in a single bulk operation
+        rows without key or with the key of a previous row are rejected, stored references sharing a key are left as is
+        returns a report of the keys inserted, updated and deleted, of the rejected rows and of the failed writes
+        """
+        report = {"inserted": [], "updated": [], "deleted": [], "unchanged": 0, "rejected": [], "errors": []}
+        stored, shared = {}, set()
+        for r in DB.reference.find({"vocabulary": self.name}):
+            ref_key = natural_key(r, key)
+            if ref_key is None or ref_key in stored:
+                shared.add(ref_key)
+            stored.setdefault(ref_key, r)
+        for ref_key in shared:
+            stored.pop(ref_key, None)
+            report["rejected"].append({"line": None, "key": ref_key, "error": "key shared by stored references"})
+        requests, request_keys, seen = [], [], set()
+        with open(csv_file, "r") as f:
+            reader = DictReader(f, delimiter=",")
+            for line, row in enumerate(reader, 2):
+                row["file"] = os.path.basename(csv_file)
+                row["vocabulary"] = self.name
+                row["lang"] = self.lang
+                row_key = natural_key(row, key)
+                if row_key in ["", None] or row_key in seen or row_key in shared:
+                    error = "duplicated key" if row_key in seen or row_key in shared else "no key"
+                    report["rejected"].append({"line": line, "key": row_key, "error": error})
+                    continue
+                seen.add(row_key)
+                existing = stored.pop(row_key, None)
+                if existing is None:
+                    r = Reference.parse_obj(row)
+                    requests.append(InsertOne(dict(r.__dict__)))
+                    request_keys.append(("inserted", row_key))
+                    continue
+                changes = {
+                    k: v for k, v in Reference.parse_obj({**existing, **row}).__dict__.items()
+                    if k in row and k not in ["lang", "file"] and existing.get(k) != v
+                }
+                if len(changes) > 0:
+                    requests.append(UpdateOne({"_id": existing["_id"]}, {"$set": changes}))
+                    request_keys.append(("updated", row_key))
+                else:
+                    report["unchanged"] += 1
+        for row_key, existing in stored.items():
+            requests.append(DeleteOne({"_id": existing["_id"]}))
+            request_keys.append(("deleted", row_key))
+        if len(requests) > 0:
+            failed = {}
+            try:
+                DB.reference.bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                failed = {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+                LOGGER.warning(f"Vocabulary {self.name} sync: {len(failed)} of {len(requests)} writes failed")
+            for index, (operation, row_key) in enumerate(request_keys):
+                if index in failed:
+                    report["errors"].append({"operation": operation, "key": row_key, "error": failed[index]})
+                else:
+                    report[operation].append(row_key)
+            # the writes of an unordered bulk are applied except the failed ones
+            if len(failed) < len(requests):
+                REFERENCE_CACHE.clear()
+                bump_version(self.version_key)
+        self.filename = os.path.basename(csv_file)
+        self.columns.clear()
+        for r in DB.reference.find({"vocabulary": self.name}):
+            self.columns.append(r)
+        self.references = ReferenceList(self.columns)
+        self.reset_indexes()
+        return report
+
+    def _track_rollback(self):
+        """reload the references if the active unit of work fails
+        the version stamp is bumped by the writes of the references (now or on flush)
+        """
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is not None:
+            unit_of_work.touch(self.version_key, rollback=self.reload)
+
+    def reload(self):
+        """reload the references from the database e.g. after a failed unit of work"""
+        self.columns.clear()
+        for r in DB.reference.find({"vocabulary": self.name}):
+            self.columns.append(r)
+        self.references = ReferenceList(self.columns)
+        self.reset_indexes()
+        return self.references
+
+    def reset_indexes(self):
+        """drop the prefix index and the fuzzy matcher: rebuilt on next use"""
+        self._prefix_index = None
+        self._matcher = None
+        self._hierarchy = None
     
+    @traced("Vocabulary.add_reference")
     def add_reference(self, reference: Reference):
         reference["lang"] = self.lang
         r = Reference(**reference)
-        r.add()
-        self.references.append(r)
+        if not r.add() and self.columns.find(r.name, key=f"name_{r.lang}") is not None:
+            # already known (stored or pending in the unit of work)
+            return self.references
+        row = self.columns.append(r)
+        if self._prefix_index is not None:
+            self._prefix_index.add(self.columns.row(row), key=row)
+        if self._matcher is not None:
+            self._matcher.add(self.columns.row(row), key=row)
+        self._hierarchy = None
+        self._track_rollback()
         return self.references
 
+    @traced("Vocabulary.delete_reference")
     def delete_reference(self, reference: Reference):
         r = Reference(**reference)
+        row = self.columns.find(r.name, key=f"name_{r.lang}")
+        if row is not None:
+            # known id: the reference may not be stored yet in a unit of work
+            r.id = self.columns.value(row, "id")
         r.delete()
-        self.references.remove(r)
+        if row is not None:
+            self.columns.remove(row)
+            if self._prefix_index is not None:
+                self._prefix_index.remove(None, key=row)
+            if self._matcher is not None:
+                self._matcher.remove(None, key=row)
+            self._hierarchy = None
+        self._track_rollback()
         return self.references
 
+    @traced("Vocabulary.update_reference")
     def update_reference(self, reference_label, reference: Reference):
-        existing_r = Reference(
-            label=reference_label)
-        self.references.delete(existing_r)
-        updated_r = existing_r.update(reference)
-        self.references.append(updated_r)
+        row = self.columns.find(reference_label, key="label")
+        if row is None:
+            return self.references
+        existing_r = self.columns.reference(row)
+        existing_r.update(reference)
+        self.columns.update(row, reference)
+        if self._prefix_index is not None:
+            self._prefix_index.remove(None, key=row)
+            self._prefix_index.add(self.columns.row(row), key=row)
+        if self._matcher is not None:
+            self._matcher.remove(None, key=row)
+            self._matcher.add(self.columns.row(row), key=row)
+        self._hierarchy = None
+        self._track_rollback()
         return self.references
 
+    def get_reference(self, value: str, key: str = None, normalized: bool = False) -> Reference:
+        """find the reference by one of its INDEX_KEYS (any key if not specified) in constant time
+        if normalized case and accents are ignored
+        """
+        row = self.columns.find(value, key, normalized)
+        if row is None:
+            return None
+        return self.columns.reference(row)
+
+    def has_value(self, value: str, key: str = "label", normalized: bool = False) -> bool:
+        """check if value is a declared label (or any other INDEX_KEYS) of the vocabulary"""
+        return self.columns.find(value, key, normalized) is not None
+
+    def translate(self, value: str, to: str = "uri", key: str = None, normalized: bool = False) -> str:
+        """translate a value into another attribute of its reference: e.g. label to uri or name_fr to name_en"""
+        row = self.columns.find(value, key, normalized)
+        if row is None:
+            return None
+        return self.columns.value(row, to)
+
+    @property
+    def prefix_index(self) -> PrefixIndex:
+        """prefix index of the names of the references: built on first use"""
+        if self._prefix_index is None:
+            self._prefix_index = PrefixIndex()
+            for row in self.columns.rows:
+                self._prefix_index.add(self.columns.row(row), key=row)
+        return self._prefix_index
+
+    def complete(self, prefix: str, k: int = 10, lang: str = None) -> list:
+        """autocomplete: top k (name, lang, reference) whose name or one of its words starts with prefix
+        case and accents are ignored
+        """
+        return [
+            (name, name_lang, self.columns.reference(r.row))
+            for name, name_lang, r in self.prefix_index.search(prefix, k, lang)
+        ]
+
+    @property
+    def matcher(self) -> FuzzyMatcher:
+        """fuzzy matcher of the names of the references: built on first use"""
+        if self._matcher is None:
+            self._matcher = FuzzyMatcher()
+            for row in self.columns.rows:
+                self._matcher.add(self.columns.row(row), key=row)
+        return self._matcher
+
+    def match(self, value: str) -> tuple:
+        """map a free value to the closest reference: returns (reference, score) or (None, 0.0)
+        score is 1.0 for an exact match ignoring case and accents
+        """
+        r, score = self.matcher.match(value)
+        if r is None:
+            return (None, score)
+        return (self.columns.reference(r.row), score)
+
+    @property
+    def hierarchy(self) -> Hierarchy:
+        """closure of the broader/narrower relations: built on first use, dropped on every write"""
+        if self._hierarchy is None:
+            self._hierarchy = Hierarchy(self.columns)
+        return self._hierarchy
+
+    def _related(self, value: str, relation: dict, key: str = None) -> list:
+        row = self.columns.find(value, key)
+        if row is None:
+            return []
+        return [self.columns.value(r, "label") for r in relation.get(row, ())]
+
+    def ancestors(self, value: str, key: str = None) -> list:
+        """labels of all the broader references of value (found by any INDEX_KEYS if key is not specified)"""
+        return self._related(value, self.hierarchy.ancestors, key)
+
+    def descendants(self, value: str, key: str = None) -> list:
+        """labels of all the narrower references of value (found by any INDEX_KEYS if key is not specified)"""
+        return self._related(value, self.hierarchy.descendants, key)
+
+    def expand(self, value: str, key: str = None) -> list:
+        """labels of the reference of value and of all its descendants: e.g. to filter on a term and its subterms
+        an unknown value is returned as is
+        """
+        row = self.columns.find(value, key)
+        if row is None:
+            return [value]
+        return [self.columns.value(r, "label") for r in self.hierarchy.expand(row)]
+
+    @property
+    def version_key(self) -> str:
+        return f"vocabulary:{self.name}"
+
+    @property
+    def version(self) -> int:
+        return get_version(self.version_key)
+
+    @traced("Vocabulary.get_references")
     def get_references(self):
-        if len(self.references) == 0:
-            self.references = [
-                Reference(**r) for r in DB.reference.find({"vocabulary": self.name})]
+        if len(self.columns) == 0:
+            for r in DB.reference.find({"vocabulary": self.name}):
+                self.columns.append(r)
+            self.references = ReferenceList(self.columns)
         return self.references
 
     def get_labels_by_lang(self, lang):
         if lang not in ["en", "fr"]:
             raise ValueError(f"Language with code {lang} is not supported: choose between 'en' and 'fr'")
-        if lang == "en":
-            return [r.name_en for r in self.references]
-        return [r.name_fr for r in self.references]
+        return self.columns.column(f"name_{lang}")
 
     def set_standards(self, standards):
         self.standards = standards
@@ -0,0 +1,4 @@
+import os
+
+# tests run on the in memory storage unless DB_BACKEND is set (e.g. DB_BACKEND=mongo to test against MongoDB)
+os.environ.setdefault("DB_BACKEND", "memory")
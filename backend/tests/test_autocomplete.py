@@ -0,0 +1,44 @@
+from cocat.reference import Reference
+from cocat.vocabulary import Vocabulary
+from cocat.autocomplete import PrefixIndex
+
+
+def build_references():
+    names = [
+        ("Qualité de l'air", "Air quality"),
+        ("Qualité de l'eau", "Water quality"),
+        ("Air intérieur", "Indoor air"),
+        ("Santé", "Health"),
+    ]
+    return [Reference(name_fr=fr, name_en=en, vocabulary="data_domain") for fr, en in names]
+
+
+def test_prefix_index_000_search():
+    index = PrefixIndex(build_references())
+    names = [name for name, lang, ref in index.search("qualite")]
+    assert names == ["Qualité de l'air", "Qualité de l'eau"], names
+    names = [name for name, lang, ref in index.search("AIR", lang="fr")]
+    assert names == ["Air intérieur", "Qualité de l'air"], names
+    names = [name for name, lang, ref in index.search("sant")]
+    assert names == ["Santé"], names
+    assert index.search("") == []
+    assert len(index.search("a", k=2)) == 2
+
+
+def test_prefix_index_001_add_remove():
+    references = build_references()
+    index = PrefixIndex(references)
+    index.remove(references[0])
+    names = [name for name, lang, ref in index.search("qual", lang="fr")]
+    assert names == ["Qualité de l'eau"], names
+    index.add(references[0])
+    names = [name for name, lang, ref in index.search("qual", lang="fr")]
+    assert names == ["Qualité de l'air", "Qualité de l'eau"], names
+
+
+def test_prefix_index_002_vocabulary():
+    references = [r.dict() for r in build_references()]
+    v = Vocabulary(name="data_domain", references=references)
+    name, lang, ref = v.complete("health")[0]
+    assert (name, lang) == ("Health", "en")
+    assert ref.name_fr == "Santé"
@@ -0,0 +1,105 @@
+import asyncio
+import os
+from cocat.vocabulary import Vocabulary
+from cocat.cache import VocabularyCache, QueryCache, normalize_query
+
+
+def test_vocabulary_cache_000_hit_and_miss():
+    fname = os.path.join(os.path.dirname(__file__), 'test_ref_environment.csv')
+    v = Vocabulary(name="environment", lang="fr", csv_file=fname)
+    cache = VocabularyCache(check_interval=0)
+    cached = cache.get("environment", "fr")
+    assert cached.labels == v.labels, cached.labels
+    assert cache.get("environment", "fr") is cached
+    assert cache.metrics == {"hits": 1, "misses": 1, "reloads": 0}, cache.metrics
+    v.delete()
+
+
+def test_vocabulary_cache_001_reload_on_new_version():
+    fname = os.path.join(os.path.dirname(__file__), 'test_ref_environment.csv')
+    v = Vocabulary(name="environment", lang="fr", csv_file=fname)
+    cache = VocabularyCache(check_interval=0)
+    cached = cache.get("environment", "fr")
+    v.add_reference({"name_fr": "Bruit", "name_en": "Noise", "vocabulary": "environment"})
+    reloaded = cache.get("environment", "fr")
+    assert reloaded is not cached
+    assert "Bruit" in reloaded.labels, reloaded.labels
+    assert cache.metrics["reloads"] == 1, cache.metrics
+    v.delete()
+
+
+def test_query_cache_002_normalized_key():
+    assert normalize_query({"q": " Qualité  de l'Air", "theme": ["Eau", "Air"], "status": None}) == \
+        normalize_query({"theme": ["Air", "Eau"], "q": "qualite de l'air"})
+    # filter values are matched exactly: their case is kept
+    assert normalize_query({"theme": "Eau"}) != normalize_query({"theme": "eau"})
+
+
+def test_query_cache_003_model_version():
+    cache = QueryCache(check_interval=0)
+    calls = []
+    loader = lambda: calls.append(1) or ["a", "b"]
+    assert cache.get("test_query_cache", "search", {"q": "Eau"}, "fr", loader) == ["a", "b"]
+    assert cache.get("test_query_cache", "search", {"q": "eau"}, "fr", loader) == ["a", "b"]
+    assert cache.get("test_query_cache", "search", {"q": "eau"}, "en", loader) == ["a", "b"]
+    assert len(calls) == 2
+    # a write from another process bumps the stamp: the entry is stale
+    other = QueryCache(check_interval=0)
+    other.model_changed("test_query_cache")
+    cache.get("test_query_cache", "search", {"q": "eau"}, "fr", loader)
+    assert len(calls) == 3
+    assert cache.metrics == {"hits": 1, "misses": 2, "stale": 1, "evictions": 0}, cache.metrics
+    cache.model_changed("test_query_cache")
+    assert len(cache) == 0
+
+
+def test_query_cache_004_memory_budget():
+    cache = QueryCache(max_bytes=100, check_interval=None)
+    for i in range(5):
+        cache.get("test_query_cache", "filter", {"page": i}, "fr", lambda: ["x" * 10] * 2)
+    cache.get("test_query_cache", "filter", {"page": 3}, "fr", lambda: None)
+    cache.get("test_query_cache", "filter", {"page": 5}, "fr", lambda: ["x" * 10] * 2)
+    assert cache.nbytes <= 100
+    keys = [k[2] for k in cache._entries]
+    # the oldest entries are evicted, the recently used one is kept
+    assert keys == [normalize_query({"page": i}) for i in [4, 3, 5]]
+    assert cache.metrics["evictions"] == 3
+
+
+def test_vocabulary_cache_005_async_refresh():
+    from cocat.db import get_async_db
+    from cocat.repository import VocabularyRepository
+
+    async def refresh():
+        repository = VocabularyRepository(get_async_db())
+        await repository.delete("async_status")
+        cache = VocabularyCache(check_interval=0)
+        assert cache.peek("async_status", "fr") is None
+        await repository.add_references("async_status", [{"name_fr": "Actif", "name_en": "Active"}])
+        assert await cache.arefresh(repository, ["async_status"]) == 2
+        assert cache.peek("async_status", "en").labels == ["Active"]
+        assert await cache.arefresh(repository, ["async_status"]) == 0
+        await repository.add_references("async_status", [{"name_fr": "Inactif", "name_en": "Inactive"}])
+        assert await cache.arefresh(repository, ["async_status"]) == 2
+        assert cache.peek("async_status", "fr").labels == ["Actif", "Inactif"]
+        await repository.delete("async_status")
+        await cache.arefresh(repository)
+        assert cache.peek("async_status", "fr") is None
+    asyncio.run(refresh())
+
+
+def test_query_cache_006_async():
+    async def run():
+        cache = QueryCache(check_interval=0)
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            return ["a"]
+        assert await cache.aget("test_query_cache", "search", {"q": "Eau"}, "fr", loader) == ["a"]
+        assert await cache.aget("test_query_cache", "search", {"q": "eau"}, "fr", lambda: calls.append(1) or ["b"]) == ["a"]
+        version = await cache.aversion("test_query_cache")
+        assert await cache.amodel_changed("test_query_cache") == version + 1
+        assert await cache.aget("test_query_cache", "search", {"q": "eau"}, "fr", lambda: calls.append(1) or ["b"]) == ["b"]
+        return len(calls)
+    assert asyncio.run(run()) == 2
@@ -0,0 +1,53 @@
+from cocat.reference import Reference
+from cocat.columns import ReferenceColumns, ReferenceList
+
+
+def build_columns(lang="fr"):
+    references = [
+        {"name_fr": "Air", "name_en": "Air", "slug": "air", "uri": "http://dcat-ap.ch/vocabulary/themes/air"},
+        {"name_fr": "Eau", "name_en": "Water", "slug": "water", "uri": None},
+        Reference(name_fr="Sols", name_en="Soils", slug="soil", vocabulary="environment"),
+    ]
+    return ReferenceColumns("environment", lang, references)
+
+
+def test_columns_000_store():
+    columns = build_columns()
+    assert len(columns) == 3
+    assert columns.column("label") == ["Air", "Eau", "Sols"]
+    assert build_columns("en").column("label") == ["Air", "Water", "Soils"]
+    assert columns.find("Water") == 1
+    assert columns.find("Water", key="label") is None
+    assert columns.find("SOLS", normalized=True) == 2
+    r = columns.reference(1)
+    assert isinstance(r, Reference)
+    assert (r.vocabulary, r.label, r.slug) == ("environment", "Eau", "water")
+
+
+def test_columns_001_remove_update():
+    columns = build_columns()
+    columns.remove(1)
+    assert len(columns) == 2
+    assert columns.find("Eau") is None
+    assert columns.find("Sols") == 2
+    assert columns.column("name_en") == ["Air", "Soils"]
+    columns.update(2, {"name_fr": "Sol"})
+    assert columns.find("Sols") is None
+    assert columns.find("sol", normalized=True) == 2
+    references = ReferenceList(columns)
+    assert [r.label for r in references] == ["Air", "Sol"]
+    assert references[-1].slug == "soil"
+
+
+def test_columns_002_shared_values():
+    columns = build_columns()
+    # an english name shared with Air and a folded name shared with Eau
+    row = columns.append({"name_fr": "eau", "name_en": "Air", "slug": "air-bis"})
+    assert columns.find("eau", key="name_fr", normalized=True) == 1
+    columns.remove(0)
+    assert columns.find("Air", key="name_en") == row
+    columns.remove(1)
+    assert columns.find("Eau", key="name_fr", normalized=True) == row
+    columns.update(row, {"name_en": "Airs"})
+    assert columns.find("Air", key="name_en") is None
+    assert columns.find("Airs", key="name_en") == row
@@ -0,0 +1,184 @@
+import io
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from xml.etree import ElementTree
+
+from cocat.db import DB
+from cocat.property import Property
+from cocat.vocabulary import Vocabulary
+from cocat.config_model import CSVConfig
+import json
+import os
+
+from cocat.export import CatalogExporter, LinkedDataExporter, ParquetExporter, NAMESPACES, qualified_name
+
+
+def build_model():
+    # constructed: a validated vocabulary property loads its vocabulary from a csv file
+    properties = [
+        Property.construct(model="dataset", field="title", dcat_label="dcat:title", multilang=True),
+        Property.construct(model="dataset", field="status", dcat_label="adms:status",
+                           is_vocabulary=True, vocabulary_name="export_status"),
+        Property.construct(model="dataset", field="issued", dcat_label="dcat:issued", datatype="date"),
+        Property.construct(model="dataset", field="theme", dcat_label="dcat:themeTaxonomy: skos", multiple=True),
+        Property.construct(model="dataset", field="description", inspire_label="Resource abstract"),
+        Property.construct(model="dataset", field="temporal", dcat_label="dct:temporal", datatype="integer"),
+    ]
+    return SimpleNamespace(name="dataset", properties=properties)
+
+
+def build_csv_model():
+    return CSVConfig(os.path.join(os.path.dirname(__file__), "test_rules.csv")).models["dataset"]
+
+
+def test_export_000_qualified_name():
+    assert qualified_name("dcat:themeTaxonomy: skos") == "dcat:themeTaxonomy"
+    assert qualified_name("dcat/organisationType") == "dcat:organisationType"
+    assert qualified_name("unknown:label") is None
+    assert qualified_name("Resource abstract") is None
+
+
+def test_export_001_dcat():
+    vocabulary = Vocabulary(name="export_status", lang="fr")
+    vocabulary.add_reference({"vocabulary": "export_status", "name_fr": "Actif", "name_en": "Active", "uri": "http://example.org/status/active"})
+    documents = [
+        {"_id": 1, "fr": {"title": "Qualité <air>", "status": "Actif", "issued": datetime.date(2022, 1, 2), "theme": ["Air", "Eau"]},
+         "en": {"title": "Air quality"}},
+        {"_id": 2, "fr": {"title": "Bruit", "status": "Inconnu", "description": "Sans abstract"}},
+    ]
+    out = io.StringIO()
+    assert CatalogExporter(build_model(), base_uri="http://example.org/dataset/").write(iter(documents), out) == 2
+    root = ElementTree.fromstring(out.getvalue().encode("utf-8"))
+    datasets = root.findall(".//dcat:Dataset", NAMESPACES)
+    assert [d.get(f"{{{NAMESPACES['rdf']}}}about") for d in datasets] == ["http://example.org/dataset/1", "http://example.org/dataset/2"]
+    first = datasets[0]
+    assert [t.text for t in first.findall("dcat:title", NAMESPACES)] == ["Qualité <air>", "Air quality"]
+    assert first.find("adms:status", NAMESPACES).get(f"{{{NAMESPACES['rdf']}}}resource") == "http://example.org/status/active"
+    assert first.find("dcat:issued", NAMESPACES).text == "2022-01-02"
+    assert [t.text for t in first.findall("dcat:themeTaxonomy", NAMESPACES)] == ["Air", "Eau"]
+    # a value without reference is written as text
+    assert datasets[1].find("adms:status", NAMESPACES).text == "Inconnu"
+    vocabulary.delete()
+
+
+def test_export_002_file(tmp_path):
+    # INSPIRE metadata are ISO 19139 records: not exported
+    with pytest.raises(ValueError):
+        CatalogExporter(build_model(), format="inspire")
+    DB.test_export.drop()
+    DB.test_export.insert_many([{"title": f"Titre {i}", "description": f"Abstract {i}"} for i in range(5)])
+    filename = tmp_path / "catalog.xml"
+    assert CatalogExporter(build_model()).export(DB.test_export, str(filename), batch_size=2) == 5
+    root = ElementTree.parse(str(filename)).getroot()
+    titles = root.findall(".//dcat:Dataset/dcat:title", NAMESPACES)
+    assert [t.text for t in titles] == [f"Titre {i}" for i in range(5)]
+    # a property without dcat label is not exported
+    assert "Abstract" not in filename.read_text(encoding="utf-8")
+    DB.test_export.drop()
+
+
+def test_export_003_parquet(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    model = build_model()
+    exporter = ParquetExporter(model, row_group_size=2)
+    schema = exporter.schema
+    assert schema.field("title_en").type == pa.string()
+    assert schema.field("issued").type == pa.date32()
+    assert schema.field("theme").type == pa.list_(pa.string())
+    assert schema.field("status").type == pa.dictionary(pa.int32(), pa.string())
+    documents = [
+        {"_id": i, "fr": {"title": f"Titre {i}", "issued": "2022-01-0%d" % (i + 1), "theme": ["Air", "Eau"][:i % 3],
+                "status": "Actif" if i % 2 else "Inactif", "temporal": [2020, "2021", None, "N/D", 2024][i]},
+         "en": {"title": f"Title {i}"}}
+        for i in range(5)
+    ]
+    filename = str(tmp_path / "catalog.parquet")
+    assert exporter.write(iter(documents), filename) == 5
+    parquet = pq.ParquetFile(filename)
+    assert parquet.metadata.num_row_groups == 3
+    table = parquet.read()
+    assert table.column("id").to_pylist() == ["0", "1", "2", "3", "4"]
+    assert table.column("title_en").to_pylist()[1] == "Title 1"
+    assert table.column("issued").to_pylist()[0] == datetime.date(2022, 1, 1)
+    assert table.column("theme").to_pylist() == [[], ["Air"], ["Air", "Eau"], [], ["Air"]]
+    assert table.column("status").to_pylist() == ["Inactif", "Actif", "Inactif", "Actif", "Inactif"]
+    # values which are not of the datatype of the property are cast one by one
+    assert table.column("temporal").to_pylist() == [2020, 2021, None, None, 2024]
+    assert parquet.schema_arrow.field("status").type == pa.dictionary(pa.int32(), pa.string())
+
+
+def test_export_004_linked_data(tmp_path):
+    vocabulary = Vocabulary(name="export_status", lang="fr")
+    vocabulary.add_reference({"vocabulary": "export_status", "name_fr": "Actif", "name_en": "Active", "uri": "http://example.org/status/active"})
+    exporter = LinkedDataExporter(build_model(), base_uri="http://example.org/dataset/", chunk_size=2)
+    assert exporter.uris["status"]["Actif"] == "http://example.org/status/active"
+    documents = [
+        {"_id": 1, "fr": {"title": 'Qualité "air"', "status": "Actif", "temporal": 2020}, "en": {"title": "Air quality"}},
+        {"_id": 2, "fr": {"title": "Bruit", "status": "Inconnu", "theme": ["Eau"]}},
+        {"_id": 3, "fr": {"title": "Sols"}},
+    ]
+    DB.test_export.drop()
+    DB.test_export.insert_many(documents)
+    filename = tmp_path / "catalog.nt"
+    assert exporter.export(DB.test_export, str(filename), "nt") == 3
+    lines = filename.read_text(encoding="utf-8").splitlines()
+    subject = "<http://example.org/dataset/1>"
+    assert f"{subject} <{NAMESPACES['rdf']}type> <{NAMESPACES['dcat']}Dataset> ." in lines
+    assert f'{subject} <{NAMESPACES["dcat"]}title> "Qualité \\"air\\""@fr .' in lines
+    assert f"{subject} <{NAMESPACES['adms']}status> <http://example.org/status/active> ." in lines
+    assert f'{subject} <{NAMESPACES["dct"]}temporal> "2020"^^<http://www.w3.org/2001/XMLSchema#integer> .' in lines
+    assert f'<http://example.org/dataset/2> <{NAMESPACES["adms"]}status> "Inconnu" .' in lines
+    assert len(lines) == 11
+
+    filename = tmp_path / "catalog.jsonld"
+    assert exporter.export(DB.test_export, str(filename), "jsonld") == 3
+    graph = json.loads(filename.read_text(encoding="utf-8"))["@graph"]
+    assert [node["@id"] for node in graph] == [f"http://example.org/dataset/{i}" for i in [1, 2, 3]]
+    assert graph[0]["adms:status"] == {"@id": "http://example.org/status/active"}
+    assert graph[0]["dcat:title"] == [{"@value": 'Qualité "air"', "@language": "fr"}, {"@value": "Air quality", "@language": "en"}]
+    assert graph[1]["dcat:themeTaxonomy"] == ["Eau"]
+    DB.test_export.drop()
+    vocabulary.delete()
+
+
+def test_export_005_csv_model(tmp_path):
+    DB.test_export.drop()
+    DB.test_export.insert_many([{"environment_detail": ["Air", "Eau"]} for _ in range(3)])
+    model = build_csv_model()
+    exporter = CatalogExporter(model)
+    assert [prop.field for prop in model.properties] == ["environment_detail"]
+    filename = tmp_path / "catalog.xml"
+    assert exporter.export(DB.test_export, str(filename)) == 3
+    root = ElementTree.parse(str(filename)).getroot()
+    assert len(root.findall(".//dcat:Dataset", NAMESPACES)) == 3
+    DB.test_export.drop()
+
+
+def test_export_006_csv_model_parquet(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    exporter = ParquetExporter(build_csv_model())
+    assert exporter.schema.names == ["id", "environment_detail"]
+    assert exporter.schema.field("environment_detail").type == pa.list_(pa.string())
+    filename = str(tmp_path / "catalog.parquet")
+    assert exporter.write(iter([{"_id": 1, "environment_detail": ["Air", "Eau"]}, {"_id": 2}]), filename) == 2
+    assert pq.read_table(filename).column("environment_detail").to_pylist() == [["Air", "Eau"], None]
+
+
+def test_export_007_linked_data_iris():
+    for base_uri in ["", "dataset/", "http://example.org/data set/"]:
+        with pytest.raises(ValueError):
+            LinkedDataExporter(build_model(), base_uri=base_uri)
+    vocabulary = Vocabulary(name="export_status", lang="fr")
+    vocabulary.add_reference({"vocabulary": "export_status", "name_fr": "Actif", "uri": "http://example.org/status/active"})
+    vocabulary.add_reference({"vocabulary": "export_status", "name_fr": "Inactif", "uri": 'http://example.org/status/<in active>"'})
+    exporter = LinkedDataExporter(build_model(), base_uri="http://example.org/dataset/")
+    out = io.StringIO()
+    exporter.write_ntriples(iter([{"_id": "a b", "status": "Inactif"}, {"_id": 2, "status": "Actif"}]), out)
+    lines = out.getvalue().splitlines()
+    assert f'<http://example.org/dataset/a%20b> <{NAMESPACES["adms"]}status> "Inactif" .' in lines
+    assert f"<http://example.org/dataset/2> <{NAMESPACES['adms']}status> <http://example.org/status/active> ." in lines
+    vocabulary.delete()
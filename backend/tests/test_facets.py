@@ -0,0 +1,74 @@
+from cocat.facets import FacetIndex, popcount, positions
+from cocat.vocabulary import Vocabulary
+from cocat.config_model import CSVConfig
+
+
+def build_index(expand=None):
+    index = FacetIndex(["theme", "status"], expand)
+    index.add("a", {"theme": ["Air", "Eau"], "status": "Actif"})
+    index.add("b", {"theme": ["Eau"], "status": "Inactif"})
+    index.add("c", {"theme": "Lacs", "status": "Actif"})
+    index.add("d", {"theme": [], "status": None})
+    return index
+
+
+def test_facets_000_bitmaps():
+    assert popcount(0b10110) == 3
+    assert positions(0b10110) == [1, 2, 4]
+
+
+def test_facets_001_filter():
+    index = build_index()
+    assert index.search() == ["a", "b", "c", "d"]
+    assert index.search({"theme": ["Eau"]}) == ["a", "b"]
+    assert index.search({"theme": ["Eau", "Lacs"], "status": "Actif"}) == ["a", "c"]
+    assert index.search({"theme": "Sols"}) == []
+    assert index.count({"status": ["Actif"]}) == 2
+
+
+def test_facets_002_counts():
+    index = build_index()
+    assert index.counts() == {"theme": {"Air": 1, "Eau": 2, "Lacs": 1}, "status": {"Actif": 2, "Inactif": 1}}
+    # the counts of a filtered field ignore its own filter
+    assert index.counts({"status": "Actif"}) == {"theme": {"Air": 1, "Eau": 1, "Lacs": 1}, "status": {"Actif": 2, "Inactif": 1}}
+
+
+def test_facets_003_incremental():
+    index = build_index()
+    index.add("b", {"theme": ["Air"], "status": "Actif"})
+    assert index.search({"theme": "Eau"}) == ["a"]
+    assert index.remove("a") is True
+    assert index.counts()["theme"] == {"Air": 1, "Lacs": 1}
+    index.add("e", {"theme": "Eau"})
+    assert len(index) == 4 and "a" not in index
+    assert index.search({"theme": "Eau"}) == ["e"]
+
+
+def test_facets_004_hierarchy():
+    vocabulary = Vocabulary(name="facet_themes", references=[
+        {"name_fr": "Eau", "slug": "water"},
+        {"name_fr": "Lacs", "slug": "lake", "broader": ["water"]},
+    ])
+    index = build_index({"theme": vocabulary.expand})
+    assert index.search({"theme": "Eau"}) == ["a", "b", "c"]
+
+
+def test_facets_005_from_model(tmp_path):
+    (tmp_path / "themes.csv").write_text("name_fr,slug,broader\nEau,water,\nLacs,lake,water\nAir,air,\n", encoding="utf-8")
+    (tmp_path / "rules.csv").write_text(
+        "model,field,datatype,multiple,required,filter_values,is_vocabulary,vocabulary_name,filename\n"
+        f"dataset,theme,string,True,False,True,True,facet_model_themes,{tmp_path / 'themes.csv'}\n"
+        "dataset,status,string,False,False,False,False,,\n"
+        "dataset,year,integer,False,False,True,False,,\n",
+        encoding="utf-8",
+    )
+    model = CSVConfig(str(tmp_path / "rules.csv")).models["dataset"]
+    index = FacetIndex.from_model(model)
+    assert index.fields == ["theme", "year"]
+    index.add("a", {"theme": ["Air", "Eau"], "year": 2020})
+    index.add("b", {"theme": ["Eau"], "year": 2021})
+    index.add("c", {"theme": "Lacs", "year": 2021})
+    # a vocabulary filter value covers its narrower values
+    assert index.search({"theme": "Eau"}) == ["a", "b", "c"]
+    assert index.search({"theme": "water", "year": 2021}) == ["b", "c"]
+    Vocabulary(name="facet_model_themes").delete()
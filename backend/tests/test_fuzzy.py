@@ -0,0 +1,38 @@
+from cocat.reference import Reference
+from cocat.vocabulary import Vocabulary
+from cocat.fuzzy import FuzzyMatcher, levenshtein
+
+
+def build_references():
+    names = [
+        ("Qualité de l'air", "Air quality"),
+        ("Qualité de l'eau", "Water quality"),
+        ("Alimentation", "Food"),
+    ]
+    return [Reference(name_fr=fr, name_en=en, vocabulary="environment") for fr, en in names]
+
+
+def test_levenshtein_000():
+    assert levenshtein("kitten", "sitting") == 3
+    assert levenshtein("", "abc") == 3
+    assert levenshtein("kitten", "sitting", max_distance=1) == 2
+
+
+def test_fuzzy_matcher_001_match():
+    matcher = FuzzyMatcher(build_references())
+    ref, score = matcher.match("Qualite de l'air")
+    assert (ref.name_fr, score) == ("Qualité de l'air", 1.0)
+    ref, score = matcher.match("Qualte de l'eau")
+    assert ref.name_fr == "Qualité de l'eau"
+    assert 0.9 < score < 1.0, score
+    ref, score = matcher.match("Alimentatoin")
+    assert ref.name_en == "Food", ref
+    assert matcher.match("Santé") == (None, 0.0)
+
+
+def test_fuzzy_matcher_002_vocabulary():
+    references = [r.dict() for r in build_references()]
+    v = Vocabulary(name="environment", references=references)
+    ref, score = v.match("water qualty")
+    assert ref.name_fr == "Qualité de l'eau"
+    assert score > 0.9
@@ -0,0 +1,50 @@
+from cocat.reference import Reference
+from cocat.columns import ReferenceColumns
+from cocat.hierarchy import Hierarchy
+from cocat.vocabulary import Vocabulary
+
+
+def build_references():
+    return [
+        {"name_fr": "Environnement", "name_en": "Environment", "slug": "environment"},
+        {"name_fr": "Eau", "name_en": "Water", "slug": "water", "broader": ["environment"]},
+        {"name_fr": "Lacs", "name_en": "Lakes", "slug": "lake", "broader": ["Water"]},
+        {"name_fr": "Rivières", "name_en": "Rivers", "slug": "river", "broader": ["water"]},
+        {"name_fr": "Sols", "name_en": "Soils", "slug": "soil", "narrower": ["sediment"]},
+        {"name_fr": "Sédiments", "name_en": "Sediments", "slug": "sediment", "broader": ["environment", "unknown"]},
+    ]
+
+
+def test_hierarchy_000_split():
+    r = Reference(name_fr="Lacs", vocabulary="themes", broader="water| environment ")
+    assert r.broader == ["water", "environment"]
+    assert Reference(name_fr="Eau", vocabulary="themes", broader="").broader == []
+
+
+def test_hierarchy_001_closure():
+    hierarchy = Hierarchy(ReferenceColumns("themes", "fr", build_references()))
+    assert hierarchy.ancestors[2] == {0, 1}
+    assert hierarchy.ancestors[5] == {0, 4}
+    assert hierarchy.descendants[0] == {1, 2, 3, 5}
+    assert hierarchy.descendants[4] == {5}
+    assert sorted(hierarchy.expand(1)) == [1, 2, 3]
+
+
+def test_hierarchy_002_cycle():
+    references = [
+        {"name_fr": "A", "slug": "a", "broader": ["b"]},
+        {"name_fr": "B", "slug": "b", "broader": ["a"]},
+    ]
+    hierarchy = Hierarchy(ReferenceColumns("cycle", "fr", references))
+    assert hierarchy.ancestors == {0: {1}, 1: {0}}
+
+
+def test_hierarchy_003_vocabulary():
+    vocabulary = Vocabulary(name="themes", references=build_references())
+    assert sorted(vocabulary.expand("Eau")) == ["Eau", "Lacs", "Rivières"]
+    assert sorted(vocabulary.ancestors("lake", key="slug")) == ["Eau", "Environnement"]
+    assert vocabulary.descendants("Sols") == ["Sédiments"]
+    assert vocabulary.expand("Inconnu") == ["Inconnu"]
+    vocabulary.columns.update(2, {"broader": ["soil"]})
+    vocabulary.reset_indexes()
+    assert sorted(vocabulary.descendants("Sols")) == ["Lacs", "Sédiments"]
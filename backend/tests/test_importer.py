@@ -0,0 +1,107 @@
+import os
+import csv
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from cocat.db import DB, get_version
+from cocat.cache import model_version_key
+from cocat.property import Property
+from cocat.vocabulary import Vocabulary
+from cocat.config_model import CSVConfig
+from cocat.importer import RecordImporter, cast_value, import_records
+
+
+def build_model():
+    # constructed: a validated vocabulary property loads its vocabulary from a csv file
+    properties = [
+        Property.construct(model="dataset", field="title", multilang=True),
+        Property.construct(model="dataset", field="status", is_vocabulary=True, vocabulary_name="importer_status"),
+        Property.construct(model="dataset", field="issued", datatype="date", format="%d/%m/%Y", required=False),
+        Property.construct(model="dataset", field="temporal", datatype="integer", multiple=True, required=False),
+        Property.construct(model="dataset", field="is_open_data", datatype="boolean", required=False),
+    ]
+    return SimpleNamespace(name="test_importer", properties=properties)
+
+
+def write_records(filename, size):
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["title", "status", "issued", "temporal", "is_open_data"])
+        for i in range(size):
+            if i % 10 == 3:
+                writer.writerow([f"Jeu {i}", "Inconnu", "2022-13-45", "2020|deux", "peut-être"])
+            else:
+                writer.writerow([f"Jeu {i}", ["Actif", "active"][i % 2], "02/01/2022", "2020|2021", "oui"])
+
+
+def test_importer_000_cast():
+    assert cast_value(" 12 ", "integer") == 12
+    assert cast_value("Non", "boolean") is False
+    assert cast_value("2022-01-02", "date", "%d/%m/%Y") == datetime.datetime(2022, 1, 2)
+    assert cast_value('{"name": "ORS"}', "object") == {"name": "ORS"}
+    with pytest.raises(ValueError):
+        cast_value("contact", "string", "email")
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_importer_001_run(tmp_path, workers):
+    vocabulary = Vocabulary(name="importer_status", lang="fr")
+    vocabulary.add_reference({"vocabulary": "importer_status", "name_fr": "Actif", "name_en": "Active", "slug": "active"})
+    DB.test_importer.drop()
+    records, errors = str(tmp_path / "records.csv"), str(tmp_path / "errors.csv")
+    write_records(records, 50)
+    version = get_version(model_version_key("test_importer"))
+    report = RecordImporter(build_model(), workers=workers, batch_size=7).run(records, errors)
+    assert (report["rows"], report["imported"], report["rejected"]) == (50, 45, 5)
+    # one stamp change by import whatever the number of chunks
+    assert get_version(model_version_key("test_importer")) == version + 1
+    assert DB.test_importer.count_documents({}) == 45
+    document = DB.test_importer.find_one({"fr.title": "Jeu 1"})["fr"]
+    # vocabulary values are stored as their label
+    assert document == {
+        "title": "Jeu 1", "status": "Actif", "issued": datetime.datetime(2022, 1, 2), "temporal": [2020, 2021], "is_open_data": True
+    }
+    with open(errors, newline="") as f:
+        rejected = list(csv.DictReader(f))
+    assert [row["line"] for row in rejected] == ["5", "15", "25", "35", "45"]
+    assert rejected[0]["title"] == "Jeu 3"
+    assert rejected[0]["errors"].split("; ") == [
+        "status: Inconnu is not in vocabulary importer_status",
+        "issued: 2022-13-45 is not a date",
+        "temporal: invalid literal for int() with base 10: 'deux'",
+        "is_open_data: peut-être is not a boolean",
+    ]
+    DB.test_importer.drop()
+    vocabulary.delete()
+
+
+def test_importer_002_csv_model(tmp_path):
+    model = CSVConfig(os.path.join(os.path.dirname(__file__), "test_rules.csv")).models["dataset"]
+    records = tmp_path / "records.csv"
+    records.write_text("environment_detail\nAir|Eau\n\nSols\n", encoding="utf-8")
+    DB.test_importer.drop()
+    report = import_records(model, str(records), collection=DB.test_importer, lang="en", workers=0)
+    assert (report["rows"], report["imported"], report["rejected"]) == (2, 2, 0)
+    assert sorted(d["environment_detail"] for d in DB.test_importer.find({}, {"_id": 0})) == [["Air", "Eau"], ["Sols"]]
+    DB.test_importer.drop()
+
+
+def test_importer_003_duplicate_keys(tmp_path):
+    vocabulary = Vocabulary(name="importer_status", lang="fr")
+    vocabulary.add_reference({"vocabulary": "importer_status", "name_fr": "Actif", "name_en": "Active", "slug": "active"})
+    DB.test_importer.drop()
+    DB.test_importer.create_index("fr.title", unique=True)
+    records, errors = tmp_path / "records.csv", str(tmp_path / "errors.csv")
+    records.write_text("title,status\nJeu 1,Actif\nJeu 2,Actif\nJeu 1,active\nJeu 3,Inconnu\nJeu 2,Actif\n", encoding="utf-8")
+    report = import_records(build_model(), str(records), errors, collection=DB.test_importer, workers=0, batch_size=10)
+    # refused documents do not stop the insert of the others of their chunk
+    assert (report["rows"], report["imported"], report["rejected"]) == (5, 2, 3)
+    assert DB.test_importer.count_documents({}) == 2
+    with open(errors, newline="") as f:
+        rejected = list(csv.DictReader(f))
+    assert [(row["line"], row["title"]) for row in rejected] == [("4", "Jeu 1"), ("5", "Jeu 3"), ("6", "Jeu 2")]
+    assert "duplicate key" in rejected[0]["errors"]
+    DB.test_importer.drop()
+    vocabulary.delete()
@@ -236,4 +236,15 @@ def test_model_build_multilang_010():
 #     raw = CSVPropertyImporter(fname)
 #     m = Model("dataset", raw.properties)
 #     assert len(m.types) == 3, m.types
-#     m.write_model()
\ No newline at end of file
+#     m.write_model()
+def test_model_write_router_011(tmp_path, monkeypatch):
+    fname = os.path.join(os.path.dirname(__file__), 'test_rules.csv')
+    dataset_model = CSVConfig(fname).models["dataset"]
+    monkeypatch.chdir(tmp_path)
+    dataset_model.write_router()
+    with open(tmp_path / "test-Dataset-router.py") as f:
+        router = f.read()
+    compile(router, "test-Dataset-router.py", "exec")
+    assert 'SEARCH_INDEX = {lang: SearchIndex([\'environment_detail\'], lang) for lang in LANGS}' in router
+    assert "FACET_INDEX" not in router
+    assert "TRANSLATION_FIELDS = []" in router
@@ -0,0 +1,51 @@
+from cocat import storage
+from cocat.monitoring import CommandMonitor, query_shape, call_site
+from cocat.reference import Reference
+
+
+def test_monitoring_000_shape():
+    assert query_shape("find", "reference", {"vocabulary": "status", "name_fr": {"$in": ["A", "B"]}}) == \
+        query_shape("find", "reference", {"name_fr": {"$in": ["C"]}, "vocabulary": "environment"})
+    assert query_shape("find", "reference", {"vocabulary": "status"}) != query_shape("find", "reference", {"slug": "status"})
+
+
+def test_monitoring_001_call_site():
+    monitor = CommandMonitor(threshold=3)
+    storage.LISTENERS.append(monitor)
+    try:
+        r = Reference(name_fr="Actif", name_en="Active", vocabulary="monitoring_status")
+        r.add()
+        with call_site("test"):
+            Reference.get_by_lang(r, "Active", "en")
+        with monitor.scope("build"):
+            for name in ["Actif", "Inactif", "Archivé"]:
+                r.get_by_label(name)
+        r.delete()
+    finally:
+        storage.LISTENERS.remove(monitor)
+    report = monitor.report()
+    sites = {(c["site"], c["command"]) for c in report["commands"]}
+    assert ("Reference.add", "insert") in sites
+    assert ("Reference.get_by_lang", "find") in sites
+    assert ("Reference.delete", "delete") in sites
+    assert report["totals"]["count"] == sum(c["count"] for c in report["commands"])
+    assert len(report["n_plus_one"]) == 1, report["n_plus_one"]
+    assert (report["n_plus_one"][0]["site"], report["n_plus_one"][0]["count"]) == ("Reference.get_by_label", 3)
+
+
+def test_monitoring_002_listener():
+    from types import SimpleNamespace
+    monitor = CommandMonitor()
+    with call_site("Vocabulary.set_references"):
+        monitor.started(SimpleNamespace(
+            command_name="find", command={"find": "reference", "filter": {"vocabulary": "status"}},
+            connection_id=("localhost", 27017), request_id=1
+        ))
+    monitor.succeeded(SimpleNamespace(
+        command_name="find", reply={"cursor": {"firstBatch": [{"name_fr": "Actif"}, {"name_fr": "Inactif"}]}, "ok": 1},
+        connection_id=("localhost", 27017), request_id=1, duration_micros=1500
+    ))
+    [command] = monitor.report()["commands"]
+    assert (command["site"], command["collection"], command["documents"], command["duration"]) == \
+        ("Vocabulary.set_references", "reference", 2, 0.0015)
+    assert command["bytes"] > 0
@@ -142,4 +142,95 @@ def test_reference_007_find_by_name():
     assert new_ref2["name_fr"] == "Alimentation", new_ref2
     assert new_ref2["name_en"] == "Food", new_ref2["name_en"]
     assert new_ref2["uri"] == "http://dcat-ap.ch/vocabulary/themes/food", new_ref2["uri"]
-    DB.reference.delete_many({"vocabulary": "environment"})
\ No newline at end of file
+    DB.reference.delete_many({"vocabulary": "environment"})
+
+def test_reference_008_indexes():
+    Reference.create_indexes()
+    indexes = DB.reference.index_information()
+    for name in ["vocabulary", "vocabulary_name_fr", "vocabulary_name_en", "uri", "slug"]:
+        assert name in indexes, indexes.keys()
+    assert indexes["vocabulary_name_fr"]["unique"] is True
+    assert indexes["vocabulary_name_en"]["unique"] is True
+
+
+def test_reference_009_find_by_label_in_vocabulary():
+    DB.reference.delete_many({"vocabulary": {"$in": ["environment", "environment_detail"]}})
+    for vocabulary in ["environment", "environment_detail"]:
+        r = Reference(name_fr="Air", name_en="Air", vocabulary=vocabulary, lang="fr")
+        assert r.add() is True
+    ref = Reference(vocabulary="environment_detail").get_by_label("Air")
+    assert ref["vocabulary"] == "environment_detail", ref
+    DB.reference.delete_many({"vocabulary": {"$in": ["environment", "environment_detail"]}})
+
+
+def test_reference_010_lazy_xml():
+    r = Reference(name_en="Triennial", name_fr="Triannuel", vocabulary="ref_temporal", field="temporal")
+    assert "xml" not in r.__dict__
+    assert "<name>Triennial</name>" in r.xml
+    assert r.xml is r.xml
+    assert r.exists
+
+
+def test_reference_011_cache():
+    from cocat.reference import REFERENCE_CACHE, ReferenceCache
+    DB.reference.delete_many({"vocabulary": "cache_status"})
+    REFERENCE_CACHE.clear()
+    r = Reference(name_fr="Actif", name_en="Active", vocabulary="cache_status")
+    assert r.get_by_label("Actif") is None
+    assert r.add() is True
+    hits = REFERENCE_CACHE.metrics["hits"]
+    for _ in range(3):
+        assert r.get_by_label("Actif")["name_en"] == "Active"
+    assert REFERENCE_CACHE.metrics["hits"] == hits + 2
+    r.update({"name_en": "Enabled"})
+    assert r.get_by_lang("Active", "en") is None
+    assert r.get_by_lang("Enabled", "en")["name_fr"] == "Actif"
+    assert r.get_by_id(r.id)["name_en"] == "Enabled"
+    r.delete()
+    assert r.get_by_label("Actif") is None
+    cache = ReferenceCache(maxsize=2)
+    for key in ["a", "b", "a", "c"]:
+        cache.get(key, lambda: {"name_fr": key})
+    assert len(cache) == 2 and cache.get("a", lambda: None) is not None
+    assert cache.hit_rate == 2 / 5
+
+
+def test_reference_012_cache_stamps():
+    from cocat.db import bump_version
+    from cocat.reference import ReferenceCache
+    DB.reference.delete_many({"vocabulary": "cache_stamp"})
+    cache = ReferenceCache(check_interval=0, negative_ttl=0)
+    query = {"vocabulary": "cache_stamp", "name_fr": "Actif"}
+    load = lambda: DB.reference.find_one(query)
+    assert cache.get(("label", "cache_stamp", "Actif"), load) is None
+    assert cache.get(("label", None, "Actif"), load) is None
+    # written by another process: the stamp moves, the cache is not invalidated
+    DB.reference.insert_one(dict(query))
+    bump_version("vocabulary:cache_stamp")
+    assert cache.get(("label", "cache_stamp", "Actif"), load)["name_fr"] == "Actif"
+    assert cache.get(("label", None, "Actif"), load)["name_fr"] == "Actif"
+    assert cache.metrics["stale"] == 2
+    DB.reference.delete_many({"vocabulary": "cache_stamp"})
+
+
+def test_reference_013_writes_bump_stamp():
+    from cocat.db import get_version
+    from cocat.unit_of_work import UnitOfWork
+    DB.reference.delete_many({"vocabulary": "direct_stamp"})
+    key = "vocabulary:direct_stamp"
+    version = get_version(key)
+    r = Reference(vocabulary="direct_stamp", name_fr="Actif", name_en="Active", lang="fr")
+    assert r.add() is True
+    assert get_version(key) == version + 1
+    # nothing written: the stamp does not move
+    assert Reference(vocabulary="direct_stamp", name_fr="Actif", lang="fr").add() is False
+    assert get_version(key) == version + 1
+    r.update({"slug": "active"})
+    assert get_version(key) == version + 2
+    with UnitOfWork():
+        r.update({"slug": "enabled"})
+        r.delete()
+        assert get_version(key) == version + 2
+    # stamped once by the flush
+    assert get_version(key) == version + 3
+    assert DB.reference.count_documents({"vocabulary": "direct_stamp"}) == 0
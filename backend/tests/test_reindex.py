@@ -0,0 +1,88 @@
+import pytest
+
+from cocat.db import DB
+from cocat.config_model import CSVConfig
+from cocat.reindex import LocalCluster, Reindexer, index_mapping, reindex_model
+
+MAPPING = {"properties": {"title": {"type": "text"}}}
+
+
+def documents(size):
+    return ((i, {"title": f"document {i}"}) for i in range(size))
+
+
+def test_reindex_001_versions():
+    cluster = LocalCluster()
+    reindexer = Reindexer(cluster, "dataset", workers=3, batch_size=7)
+    report = reindexer.run(MAPPING, documents(50))
+    assert report["index"] == "dataset_v1" and report["documents"] == 50
+    assert cluster.get_alias("dataset") == {"dataset_v1"}
+    new_mapping = {"properties": {"title": {"type": "keyword"}}}
+    report = reindexer.run(new_mapping, documents(20))
+    assert report["index"] == "dataset_v2" and report["previous"] == ["dataset_v1"]
+    assert cluster.get_alias("dataset") == {"dataset_v2"}
+    assert not cluster.exists("dataset_v1")
+    assert cluster.mappings["dataset_v2"] == new_mapping
+    assert cluster.count("dataset") == 20
+    assert cluster.get("dataset", 3) == {"title": "document 3"}
+
+
+def test_reindex_002_failure():
+    cluster = LocalCluster()
+    reindexer = Reindexer(cluster, "dataset", batch_size=10)
+    reindexer.run(MAPPING, documents(30))
+
+    def broken(document):
+        if document["title"] == "document 25":
+            raise ValueError("broken document")
+        return document
+
+    with pytest.raises(ValueError):
+        reindexer.run(MAPPING, documents(30), transform=broken)
+    # the alias still reads the previous index and the partial one is dropped
+    assert cluster.get_alias("dataset") == {"dataset_v1"}
+    assert set(cluster.indices) == {"dataset_v1"}
+    assert cluster.count("dataset") == 30
+
+
+def test_reindex_003_model(tmp_path):
+    rules = tmp_path / "rules.csv"
+    rules.write_text(
+        "model,field,datatype,multilang,required,search_full_text,filter_values\n"
+        "dataset,title,string,True,True,True,False\n"
+        "dataset,year,integer,False,False,False,True\n",
+        encoding="utf-8",
+    )
+    model = CSVConfig(str(rules)).models["dataset"]
+    mapping = index_mapping(model)
+    assert mapping["fr"]["properties"] == {"title": {"type": "text", "analyzer": "french"}, "year": {"type": "long"}}
+    assert mapping["en"]["properties"]["title"]["analyzer"] == "english"
+    collection = DB.test_reindex_model
+    collection.drop()
+    collection.insert_many([{"fr": {"title": f"titre {i}"}, "en": {"title": f"title {i}"}} for i in range(12)])
+    cluster = LocalCluster()
+    reports = reindex_model(model, cluster, collection, batch_size=5)
+    assert [report["index"] for report in reports] == ["dataset_fr_v1", "dataset_en_v1"]
+    assert cluster.mappings["dataset_fr_v1"] == mapping["fr"]
+    doc_id = collection.find_one({})["_id"]
+    assert cluster.get("dataset_en", doc_id) == {"title": "title 0"}
+    collection.drop()
+
+
+def test_reindex_004_replay_changes():
+    cluster = LocalCluster()
+    reindexer = Reindexer(cluster, "dataset", workers=2, batch_size=3)
+    written = []
+
+    def source():
+        for doc_id, document in documents(20):
+            # written by the application while the copy runs
+            if doc_id == 10:
+                written.extend([(3, {"title": "document 3 updated"}), (5, None), (20, {"title": "document 20"})])
+            yield doc_id, document
+
+    report = reindexer.run(MAPPING, source(), changes=lambda since: iter(written))
+    assert report["replayed"] == 3
+    assert cluster.count("dataset") == 20
+    assert cluster.get("dataset", 3) == {"title": "document 3 updated"}
+    assert cluster.get("dataset", 5) is None
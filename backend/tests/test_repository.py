@@ -0,0 +1,25 @@
+import asyncio
+from cocat.db import get_async_db
+from cocat.repository import VocabularyRepository
+
+
+def test_repository_000_vocabulary_crud():
+    async def crud():
+        vocabularies = VocabularyRepository(get_async_db())
+        await vocabularies.references.create_indexes()
+        await vocabularies.delete("broadcast_mode")
+        references = [
+            {"name_fr": "Portail", "name_en": "Portal"},
+            {"name_fr": "API", "name_en": "API"},
+        ]
+        assert await vocabularies.add_references("broadcast_mode", references) == 2
+        assert await vocabularies.add_references("broadcast_mode", references[:1]) == 0
+        v = await vocabularies.get("broadcast_mode", "en")
+        assert v.labels == ["Portal", "API"], v.labels
+        assert await vocabularies.update_reference("broadcast_mode", "API", {"name_fr": "Interface"})
+        v = await vocabularies.get("broadcast_mode", "fr")
+        assert v.labels == ["Portail", "Interface"], v.labels
+        assert await vocabularies.delete_reference("broadcast_mode", "Portal")
+        assert await vocabularies.delete("broadcast_mode") == 1
+        assert await vocabularies.get("broadcast_mode") is None
+    asyncio.run(crud())
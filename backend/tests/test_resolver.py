@@ -0,0 +1,32 @@
+from cocat.vocabulary import Vocabulary
+from cocat.resolver import URIResolver, standard_values
+
+
+def test_resolver_000_standard_values():
+    assert standard_values(["theme:air", "", {"inspire": "AirQuality", "version": 4}]) == ["theme:air", "AirQuality"]
+    assert standard_values(None) == []
+
+
+def test_resolver_001_resolve():
+    v = Vocabulary(name="resolver_themes", lang="fr")
+    v.add_reference({"vocabulary": "resolver_themes", "name_fr": "Air", "name_en": "Air", "uri": "http://dcat-ap.ch/vocabulary/themes/air", "standards": ["AirQuality"]})
+    resolver = URIResolver(check_interval=0)
+    vocabulary, r = resolver.resolve("http://dcat-ap.ch/vocabulary/themes/air")
+    assert (vocabulary, r.name_fr) == ("resolver_themes", "Air")
+    assert r.id is not None
+    assert resolver.resolve("AirQuality", lang="en")[1].label == "Air"
+    assert resolver.resolve("http://unknown") is None
+    v.add_reference({"vocabulary": "resolver_themes", "name_fr": "Eau", "name_en": "Water", "uri": "http://dcat-ap.ch/vocabulary/themes/water"})
+    assert resolver.resolve("http://dcat-ap.ch/vocabulary/themes/water")[1].name_en == "Water"
+    v.delete()
+    assert resolver.resolve("http://dcat-ap.ch/vocabulary/themes/air") is None
+
+
+def test_resolver_002_label():
+    v = Vocabulary(name="resolver_themes", lang="fr")
+    v.add_reference({"vocabulary": "resolver_themes", "name_fr": "Air", "uri": "http://dcat-ap.ch/vocabulary/themes/air"})
+    resolver = URIResolver(check_interval=None)
+    resolver.labels["dcat:theme"] = {"resolver_themes"}
+    assert resolver.resolve("http://dcat-ap.ch/vocabulary/themes/air", label="dcat:theme")[0] == "resolver_themes"
+    assert resolver.resolve("http://dcat-ap.ch/vocabulary/themes/air", label="dct:spatial") is None
+    v.delete()
@@ -0,0 +1,54 @@
+import os
+from cocat.config_model import CSVConfig
+from cocat.search import SearchIndex, analyze
+
+
+def build_index(lang="fr"):
+    index = SearchIndex({"title": 2, "description": 1, "themes": 1}, lang)
+    index.add(1, {"title": "Qualité de l'air", "description": "Mesures des polluants atmosphériques", "themes": ["Air"]})
+    index.add(2, {"title": "Qualité des eaux", "description": "Analyses des rivières et des lacs", "themes": ["Eau"]})
+    index.add(3, {"title": "Sols pollués", "description": "Inventaire des sites et sols pollués", "themes": ["Sols"]})
+    return index
+
+
+def test_search_000_analyze():
+    assert analyze("Qualité de l'Air des Rivières", "fr") == ["qualite", "air", "riviere"]
+    assert analyze("The Cities' water quality", "en") == ["city", "water", "quality"]
+
+
+def test_search_001_bm25():
+    index = build_index()
+    assert [doc_id for doc_id, _ in index.search("qualite")] == ["2", "1"] or \
+        [doc_id for doc_id, _ in index.search("qualite")] == ["1", "2"]
+    assert index.search("air")[0][0] == "1"
+    assert index.search("rivière")[0][0] == "2"
+    assert [doc_id for doc_id, _ in index.search("sol pollué", k=1)] == ["3"]
+    assert index.search("de la") == []
+
+
+def test_search_002_incremental():
+    index = build_index()
+    index.add(1, {"title": "Bruit", "description": "Cartes de bruit", "themes": []})
+    assert index.search("air") == []
+    assert index.search("bruit")[0][0] == "1"
+    assert index.remove(2) is True
+    assert index.search("eaux") == []
+    assert len(index) == 2 and 2 not in index
+
+
+def test_search_003_persist(tmp_path):
+    index = build_index()
+    filename = os.path.join(tmp_path, "dataset.fr.index")
+    index.save(filename)
+    loaded = SearchIndex.load(filename)
+    assert loaded.search("polluants") == index.search("polluants")
+    loaded.remove(3)
+    assert loaded.search("sols") == []
+
+
+def test_search_004_from_model():
+    model = CSVConfig(os.path.join(os.path.dirname(__file__), "test_rules.csv")).models["dataset"]
+    index = SearchIndex.from_model(model, "fr")
+    assert index.fields == {"environment_detail": 1}
+    index.add(1, {"environment_detail": ["Eaux souterraines", "Air"]})
+    assert index.search("eau")[0][0] == "1"
@@ -0,0 +1,68 @@
+import os
+import pytest
+from cocat.vocabulary import Vocabulary
+from cocat.cache import VocabularyCache
+from cocat.snapshot import encode_snapshot, decode_snapshot, dump_snapshot
+
+
+def build_vocabularies():
+    return {
+        "environment": {
+            "version": 3,
+            "references": [
+                {"name_fr": "Air", "name_en": "Air", "uri": "http://dcat-ap.ch/vocabulary/themes/air", "slug": "air"},
+                {"name_fr": "Eau", "name_en": "Water", "uri": None, "slug": "water"},
+            ]
+        }
+    }
+
+
+def test_snapshot_000_roundtrip():
+    raw = encode_snapshot(build_vocabularies())
+    vocabularies = decode_snapshot(raw)
+    assert vocabularies["environment"]["version"] == 3
+    assert vocabularies["environment"]["references"][1]["name_en"] == "Water"
+    assert vocabularies["environment"]["references"][1]["vocabulary"] == "environment"
+    with pytest.raises(ValueError):
+        decode_snapshot(raw[:-1] + bytes([raw[-1] ^ 1]))
+
+
+def test_snapshot_001_cache_offline(tmp_path):
+    fname = tmp_path / "vocabularies.snapshot"
+    fname.write_bytes(encode_snapshot(build_vocabularies()))
+    cache = VocabularyCache()
+    assert cache.load_snapshot(str(fname)) == 1
+    assert cache.get("environment", "en").labels == ["Air", "Water"]
+    assert cache.get("environment", "fr").labels == ["Air", "Eau"]
+    assert cache.metrics == {"hits": 2, "misses": 0, "reloads": 0}
+
+
+def test_snapshot_002_dump(tmp_path):
+    fname = os.path.join(os.path.dirname(__file__), 'test_ref_environment.csv')
+    v = Vocabulary(name="environment", lang="fr", csv_file=fname)
+    vocabularies = dump_snapshot(str(tmp_path / "vocabularies.snapshot"))
+    assert len(vocabularies["environment"]["references"]) == 4
+    assert vocabularies["environment"]["version"] == v.version
+    v.delete()
+
+
+def test_snapshot_003_restore(tmp_path):
+    from cocat.db import DB, bump_version, get_version
+    from cocat.snapshot import restore_snapshot
+    fname = os.path.join(os.path.dirname(__file__), 'test_ref_environment.csv')
+    v = Vocabulary(name="environment", lang="en", csv_file=fname)
+    DB.reference.update_many({"vocabulary": "environment"}, {"$set": {"field": "theme"}})
+    stored = {r["_id"]: r for r in DB.reference.find({"vocabulary": "environment"})}
+    snapshot = str(tmp_path / "vocabularies.snapshot")
+    dump_snapshot(snapshot)
+    DB.reference.delete_many({"vocabulary": "environment"})
+    # the live stamp is ahead of the snapshot: it only moves forward
+    for _ in range(3):
+        bump_version("vocabulary:environment")
+    version = get_version("vocabulary:environment")
+    restore_snapshot(snapshot)
+    assert get_version("vocabulary:environment") == version + 1
+    restored = {r["_id"]: r for r in DB.reference.find({"vocabulary": "environment"})}
+    assert restored.keys() == stored.keys()
+    assert {(r["field"], r["lang"]) for r in restored.values()} == {("theme", "en")}
+    DB.reference.delete_many({"vocabulary": "environment"})
@@ -0,0 +1,104 @@
+import time
+import asyncio
+import pytest
+from pymongo import IndexModel, InsertOne, UpdateOne, DeleteOne, ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from cocat.storage import MemoryClient, AsyncMemoryClient
+
+
+def build_collection():
+    collection = MemoryClient()["test_storage"]["reference"]
+    collection.drop()
+    collection.insert_many([
+        {"vocabulary": "environment", "name_fr": "Air", "standards": ["AirQuality"]},
+        {"vocabulary": "environment", "name_fr": "Eau", "name_en": "Water"},
+        {"vocabulary": "status", "name_fr": "Actif", "name_en": ""},
+    ])
+    return collection
+
+
+def test_storage_000_query():
+    collection = build_collection()
+    assert collection.count_documents({"vocabulary": "environment"}) == 2
+    assert collection.find_one({"standards": "AirQuality"})["name_fr"] == "Air"
+    assert collection.find_one({"name_en": None})["name_fr"] == "Air"
+    assert [r["name_fr"] for r in collection.find({"$or": [{"name_en": "Water"}, {"vocabulary": {"$in": ["status"]}}]})] == ["Eau", "Actif"]
+    assert [r["name_fr"] for r in collection.find({"name_en": {"$gt": ""}})] == ["Eau"]
+    assert [r["name_fr"] for r in collection.find({}).sort("name_fr", -1).limit(2)] == ["Eau", "Air"]
+    assert list(collection.find_one({"name_fr": "Eau"}, {"name_en": 1})) == ["_id", "name_en"]
+    assert collection.distinct("vocabulary") == ["environment", "status"]
+    found = collection.find_one({"name_fr": "Air"})
+    found["name_fr"] = "Changed"
+    assert collection.count_documents({"name_fr": "Air"}) == 1
+
+
+def test_storage_001_write():
+    collection = build_collection()
+    assert collection.update_one({"name_fr": "Eau"}, {"$set": {"slug": "water"}}).modified_count == 1
+    assert collection.find_one({"slug": "water"})["name_en"] == "Water"
+    assert collection.delete_many({"vocabulary": "environment"}).deleted_count == 2
+    stamp = collection.find_one_and_update(
+        {"_id": "vocabulary:status"}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    assert stamp == {"_id": "vocabulary:status", "version": 1}
+
+
+def test_storage_002_unique_index():
+    collection = build_collection()
+    collection.create_indexes([
+        IndexModel([("vocabulary", ASCENDING), ("name_en", ASCENDING)], unique=True, partialFilterExpression={"name_en": {"$gt": ""}})
+    ])
+    collection.insert_one({"vocabulary": "status", "name_fr": "Inactif", "name_en": ""})
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"vocabulary": "environment", "name_fr": "Eaux", "name_en": "Water"})
+    with pytest.raises(BulkWriteError) as e:
+        collection.bulk_write([
+            InsertOne({"vocabulary": "environment", "name_en": "Water"}),
+            UpdateOne({"name_fr": "Air"}, {"$set": {"name_en": "Air"}}),
+            DeleteOne({"name_fr": "Actif"}),
+        ], ordered=False)
+    assert len(e.value.details["writeErrors"]) == 1
+    assert (e.value.details["nModified"], e.value.details["nRemoved"]) == (1, 1)
+
+
+def test_storage_003_async():
+    build_collection()
+
+    async def run():
+        collection = AsyncMemoryClient()["test_storage"]["reference"]
+        names = [r["name_fr"] async for r in collection.find({"vocabulary": "environment"})]
+        await collection.delete_one({"name_fr": "Air"})
+        return names, await collection.count_documents({})
+    assert asyncio.run(run()) == (["Air", "Eau"], 2)
+
+
+def test_storage_004_unique_index_maintenance():
+    collection = build_collection()
+    collection.create_index([("vocabulary", ASCENDING), ("name_en", ASCENDING)], unique=True, partialFilterExpression={"name_en": {"$gt": ""}})
+    # a key is moved by an update and freed by a delete
+    collection.update_one({"name_fr": "Eau"}, {"$set": {"name_en": "Waters"}})
+    collection.insert_one({"vocabulary": "environment", "name_fr": "Eau douce", "name_en": "Water"})
+    with pytest.raises(DuplicateKeyError):
+        collection.update_one({"name_fr": "Air"}, {"$set": {"name_en": "Waters"}})
+    collection.delete_one({"name_fr": "Eau"})
+    collection.update_one({"name_fr": "Air"}, {"$set": {"name_en": "Waters"}})
+    # documents outside of the partial filter are not indexed
+    collection.insert_many([{"vocabulary": "status", "name_en": ""} for _ in range(3)])
+    assert collection.find({}, None, 1, 2, sort=[("name_fr", ASCENDING)]).to_list() == \
+        collection.find({}, sort=[("name_fr", ASCENDING)]).to_list()[1:3]
+
+
+def test_storage_005_bulk_insert_is_linear():
+    from cocat.reference import REFERENCE_INDEXES
+    collection = MemoryClient()["test_storage"]["bulk"]
+    collection.drop()
+    collection.create_indexes(REFERENCE_INDEXES)
+    start = time.monotonic()
+    collection.insert_many([
+        {"vocabulary": f"v{i % 10}", "name_fr": f"Nom {i}", "name_en": f"Name {i}", "slug": f"name-{i}", "uri": f"http://x/{i}"}
+        for i in range(5000)
+    ])
+    assert time.monotonic() - start < 5
+    with pytest.raises(BulkWriteError):
+        collection.insert_many([{"vocabulary": "v1", "name_fr": "Nom 1", "name_en": "Other", "slug": "other"}])
+    collection.drop()
@@ -0,0 +1,111 @@
+import asyncio
+
+from cocat.db import DB
+from cocat.translation import StubTranslator, TranslationPipeline, TranslationStore, TranslationWorker, content_key, get_translator
+
+
+class PrefixTranslator(StubTranslator):
+    """stand-in of a real translator: its translations are stored"""
+    persistent = True
+
+
+def build_pipeline(batch_size=2, translator=None):
+    DB.test_translation.drop()
+    return TranslationPipeline(translator or PrefixTranslator(), TranslationStore(DB.test_translation), batch_size)
+
+
+def test_translation_001_deduplicated_batches():
+    pipeline = build_pipeline()
+    translations = pipeline.translate_texts(["Eau", "Air", "Eau", "Sols", " "], "fr", "en")
+    assert translations == {"Eau": "[en] Eau", "Air": "[en] Air", "Sols": "[en] Sols"}
+    assert pipeline.translator.batches == [2, 1]
+    stored = DB.test_translation.find_one({"_id": content_key("Eau", "fr", "en")})
+    assert stored["translation"] == "[en] Eau"
+    # stored translations are not sent again
+    pipeline.translate_texts(["Eau", "Bruit"], "fr", "en")
+    assert pipeline.translator.batches == [2, 1, 1]
+    assert pipeline.metrics == {"requested": 5, "cached": 1, "translated": 4}, pipeline.metrics
+    DB.test_translation.drop()
+
+
+def test_translation_002_docs():
+    pipeline = build_pipeline(batch_size=10)
+    docs = [
+        {"fr": {"title": "Lacs", "keywords": ["Eau", "Lacs"], "theme": "Eau"}},
+        {"fr": {"title": "Eau", "theme": "Air"}, "en": {"title": "Water"}},
+    ]
+    pipeline.translate_docs(docs, ["title", "keywords"], "fr")
+    assert docs[0]["en"] == {"title": "[en] Lacs", "keywords": ["[en] Eau", "[en] Lacs"], "theme": "Eau"}
+    # fields set in the target lang are kept
+    assert docs[1]["en"] == {"title": "Water", "theme": "Air"}
+    assert pipeline.translator.batches == [2]
+    assert pipeline.translate_doc({"en": {"title": "Water"}}, ["title"]) == {"en": {"title": "Water"}, "fr": {"title": "[fr] Water"}}
+    DB.test_translation.drop()
+
+
+def test_translation_003_worker():
+    pipeline = build_pipeline(batch_size=10)
+    saved = []
+
+    async def save(doc):
+        saved.append(doc)
+
+    async def run():
+        worker = TranslationWorker(pipeline, batch_size=10, max_delay=0.05)
+        for title in ["Eau", "Air", "Eau"]:
+            await worker.submit({"fr": {"title": title}}, ["title"], save)
+        await worker.stop()
+
+    asyncio.run(run())
+    assert [doc["en"]["title"] for doc in saved] == ["[en] Eau", "[en] Air", "[en] Eau"]
+    # the queued documents are translated together
+    assert pipeline.translator.batches == [2]
+    DB.test_translation.drop()
+
+
+def test_translation_004_no_translator(monkeypatch):
+    monkeypatch.delenv("TRANSLATOR", raising=False)
+    assert get_translator() is None
+    pipeline = TranslationPipeline(store=TranslationStore(DB.test_translation))
+    doc = {"fr": {"title": "Eau"}}
+    assert pipeline.translate_doc(doc, ["title"]) == {"fr": {"title": "Eau"}}
+    saved = []
+
+    async def save(doc):
+        saved.append(doc)
+
+    async def run():
+        worker = TranslationWorker(pipeline)
+        await worker.submit(doc, ["title"], save)
+        await worker.stop()
+
+    asyncio.run(run())
+    assert saved == []
+    # the output of the stub translator is never stored
+    pipeline = build_pipeline(translator=StubTranslator())
+    assert pipeline.translate_texts(["Eau"], "fr", "en") == {"Eau": "[en] Eau"}
+    assert DB.test_translation.count_documents({}) == 0
+
+
+def test_translation_005_worker_errors():
+    pipeline = build_pipeline(batch_size=10)
+    saved = []
+
+    async def save(doc):
+        if doc["fr"]["title"] == "Air":
+            raise ValueError("not saved")
+        saved.append(doc)
+
+    async def run():
+        worker = TranslationWorker(pipeline, batch_size=10, max_delay=0.05)
+        await worker.submit({"fr": {"title": "Eau"}}, ["title"], save)
+        # translate_docs fails on a document whose lang is not a dict
+        await worker.submit({"fr": "Sols"}, ["title"], save)
+        await worker.submit({"fr": {"title": "Air"}}, ["title"], save)
+        # fields set in the other lang are kept
+        await worker.submit({"fr": {"title": "Lacs", "keywords": ["Eau"]}, "en": {"title": "Lakes"}}, ["title", "keywords"], save, "fr")
+        await worker.stop()
+
+    asyncio.run(run())
+    assert [doc["en"] for doc in saved] == [{"title": "[en] Eau"}, {"title": "Lakes", "keywords": ["[en] Eau"]}]
+    DB.test_translation.drop()
@@ -0,0 +1,65 @@
+import pytest
+from pymongo.errors import BulkWriteError
+from cocat.db import DB
+from cocat import storage
+from cocat.monitoring import CommandMonitor
+from cocat.reference import Reference
+from cocat.vocabulary import Vocabulary
+from cocat.unit_of_work import UnitOfWork
+
+
+def test_unit_of_work_000_flush():
+    Reference.create_indexes()
+    v = Vocabulary(name="uow_status", lang="fr")
+    version = v.version
+    monitor = CommandMonitor()
+    storage.LISTENERS.append(monitor)
+    try:
+        with UnitOfWork() as unit_of_work:
+            v.add_reference({"vocabulary": "uow_status", "name_fr": "Actif", "name_en": "Active"})
+            v.add_reference({"vocabulary": "uow_status", "name_fr": "Inactif", "name_en": "Inactive"})
+            v.update_reference("Actif", {"slug": "active"})
+            v.delete_reference({"vocabulary": "uow_status", "name_fr": "Inactif", "lang": "fr"})
+            assert len(unit_of_work) == 4
+            assert DB.reference.count_documents({"vocabulary": "uow_status"}) == 0
+    finally:
+        storage.LISTENERS.remove(monitor)
+    writes = [c for c in monitor.report()["commands"] if c["command"] in ["insert", "update", "delete", "bulkWrite"]]
+    assert [c["command"] for c in writes] == ["bulkWrite"]
+    assert [r["slug"] for r in DB.reference.find({"vocabulary": "uow_status"})] == ["active"]
+    assert v.labels == ["Actif"]
+    assert v.version == version + 1
+    v.delete()
+
+
+def test_unit_of_work_001_rollback():
+    Reference.create_indexes()
+    v = Vocabulary(name="uow_status", lang="fr")
+    v.add_reference({"vocabulary": "uow_status", "name_fr": "Actif", "name_en": "Active"})
+    version = v.version
+    with pytest.raises(BulkWriteError):
+        with UnitOfWork(transaction=True):
+            v.add_reference({"vocabulary": "uow_status", "name_fr": "Inactif", "name_en": "Inactive"})
+            # an english name already used by Actif: rejected by the unique index on flush
+            v.add_reference({"vocabulary": "uow_status", "name_fr": "Actif bis", "name_en": "Active"})
+    # no transaction on the memory backend: Inactif is written before the failure, so the stamp moves
+    assert v.version == version + 1
+    assert sorted(v.labels) == sorted(r["name_fr"] for r in DB.reference.find({"vocabulary": "uow_status"}))
+    with pytest.raises(ValueError):
+        with UnitOfWork():
+            v.add_reference({"vocabulary": "uow_status", "name_fr": "Archivé"})
+            raise ValueError("abort")
+    assert "Archivé" not in v.labels
+    v.delete()
+
+
+def test_unit_of_work_002_pending_duplicates():
+    Reference.create_indexes()
+    v = Vocabulary(name="uow_status", lang="fr")
+    with UnitOfWork() as unit_of_work:
+        v.add_reference({"vocabulary": "uow_status", "name_fr": "Actif", "name_en": "Active"})
+        v.add_reference({"vocabulary": "uow_status", "name_fr": "Actif", "name_en": "Enabled"})
+        assert len(unit_of_work) == 1
+        assert v.labels == ["Actif"]
+    assert DB.reference.count_documents({"vocabulary": "uow_status"}) == 1
+    v.delete()
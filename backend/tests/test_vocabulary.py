@@ -24,9 +24,8 @@ def test_vocabulary_000_init_with_csv():
         'lang',
         'updated',
         'standards',
-        'name',
-        'xml',
-        'exists', "_id"
+        'broader',
+        'narrower'
     ], list(v.references[0].__dict__.keys())
     v.delete()
 
@@ -60,9 +59,8 @@ def test_vocabulary_000_init_with_jsonl():
         'lang',
         'updated',
         'standards',
-        'name',
-        'xml',
-        'exists'
+        'broader',
+        'narrower'
     ], list(v.references[0].__dict__.keys())
     v.delete()
 
@@ -116,4 +114,66 @@ def test_voc_004_declared_csv():
     v = Vocabulary(name="environment", lang="en", csv_file=fname)
     assert len(v.references) == 4
     assert v.labels == ['Air', 'Water', 'Soils', 'Food'], v.labels
-    v.delete()
\ No newline at end of file
+    v.delete()
+
+def test_voc_005_index():
+    fname = os.path.join(os.path.dirname(__file__), 'test_ref_environment.csv')
+    with open(fname, "r") as f:
+        references = [dict(row, vocabulary="environment", lang="fr") for row in DictReader(f, delimiter=",")]
+    v = Vocabulary(name="environment", lang="fr", references=references)
+    assert v.has_value("Alimentation")
+    assert not v.has_value("Food")
+    assert v.has_value("Food", key="name_en")
+    assert v.get_reference("food").name_fr == "Alimentation"
+    assert v.translate("Alimentation") == "http://dcat-ap.ch/vocabulary/themes/food"
+    assert v.translate("Food", to="name_fr") == "Alimentation"
+    assert v.translate("  alimentATION", to="slug", normalized=True) == "food"
+    assert v.get_reference("Qualité", normalized=True) is None
+
+
+def test_voc_006_sync(tmp_path):
+    fname = os.path.join(os.path.dirname(__file__), 'test_ref_environment.csv')
+    v = Vocabulary(name="environment", lang="fr", csv_file=fname)
+    ids = {r["slug"]: r["_id"] for r in DB.reference.find({"vocabulary": "environment"})}
+    version = v.version
+    with open(fname, "r") as f:
+        rows = list(DictReader(f, delimiter=","))
+    rows[1]["name_fr"] = "Eaux"
+    del rows[2]
+    rows.append({"name_en": "Noise", "name_fr": "Bruit", "slug": "noise", "uri": ""})
+    edited = tmp_path / "environment.csv"
+    with open(edited, "w") as f:
+        f.write("name_en,name_fr,slug,uri\n")
+        for row in rows:
+            f.write(",".join([row["name_en"], row["name_fr"], row["slug"], row["uri"]]) + "\n")
+    report = v.sync(str(edited))
+    assert report == {"inserted": ["noise"], "updated": ["water"], "deleted": ["soil"], "unchanged": 2, "rejected": [], "errors": []}, report
+    assert v.version == version + 1
+    assert sorted(v.labels) == ["Air", "Alimentation", "Bruit", "Eaux"], v.labels
+    assert v.get_reference("water", key="slug").id == ids["water"]
+    assert v.sync(str(edited)) == {"inserted": [], "updated": [], "deleted": [], "unchanged": 4, "rejected": [], "errors": []}
+    assert v.version == version + 1
+    v.delete()
+
+
+def test_voc_007_sync_rejects(tmp_path):
+    Reference.create_indexes()
+    v = Vocabulary(name="sync_status", lang="fr")
+    v.add_reference({"vocabulary": "sync_status", "name_fr": "Actif", "name_en": "Active", "slug": "active"})
+    version = v.version
+    edited = tmp_path / "status.csv"
+    with open(edited, "w") as f:
+        f.write("name_en,name_fr,slug\n")
+        f.write("Active,Actif,active\n")
+        f.write("Enabled,Activé,active\n")
+        f.write(",,\n")
+        f.write("Inactive,Inactif,inactive\n")
+        # the english name of Actif: rejected by the unique index
+        f.write("Active,Actif bis,active-bis\n")
+    report = v.sync(str(edited))
+    assert report["inserted"] == ["inactive"]
+    assert [(r["line"], r["error"]) for r in report["rejected"]] == [(3, "duplicated key"), (4, "no key")]
+    assert [(e["operation"], e["key"]) for e in report["errors"]] == [("inserted", "active-bis")]
+    assert v.version == version + 1
+    assert sorted(v.labels) == ["Actif", "Inactif"]
+    v.delete()